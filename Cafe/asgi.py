@@ -3,6 +3,15 @@ ASGI config for Cafe project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The push channel ``events/stream/`` (Server-Sent Events) is an async view and
+needs this entry point, e.g. ``uvicorn Cafe.asgi:application``; under WSGI each
+open stream would pin a worker thread.
+
+Under ASGI the hot order views (table order actions, orders list, dashboard,
+add portions) are served by their async versions (CAFE_ASYNC_VIEWS=1), so a
+slow SQLite write does not hold a worker thread while other requests wait.
+Compare with the WSGI path: ``python manage.py asgi_benchmark``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -12,5 +21,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Cafe.settings')
+os.environ.setdefault('CAFE_SQLITE_TUNING', '1')
+os.environ.setdefault('CAFE_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -29,6 +30,11 @@ ALLOWED_HOSTS = []
 
 AUTH_USER_MODEL = 'main.User'
 
+# Пользователь берётся из кэша (main.auth), сессии — из кэша с записью в БД:
+# запрос авторизованного пользователя не делает SQL ради сессии и личности
+AUTHENTICATION_BACKENDS = ['main.auth.CachedModelBackend']
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -42,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым: замер охватывает все остальные middleware
+    'main.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +63,8 @@ ROOT_URLCONF = 'Cafe.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени отрисовки для Server-Timing
+        'BACKEND': 'main.templating.TimedDjangoTemplates',
         'DIRS': [BASE_DIR/'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -65,21 +74,90 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.media', 
+                'main.context_processors.live_events',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'Cafe.wsgi.application'
+ASGI_APPLICATION = 'Cafe.asgi.application'
+
+# Асинхронные версии горячих view (заказы, стол, панель, порции); Cafe/asgi.py включает их
+ASYNC_VIEWS = os.environ.get('CAFE_ASYNC_VIEWS', '0') == '1'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# Профиль БД выбирается переменной окружения CAFE_DB: sqlite (по умолчанию) или postgres
+
+DB_PROFILE = os.environ.get('CAFE_DB', 'sqlite')
+
+if DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('CAFE_DB_NAME', 'cafe'),
+            'USER': os.environ.get('CAFE_DB_USER', 'cafe'),
+            'PASSWORD': os.environ.get('CAFE_DB_PASSWORD', ''),
+            'HOST': os.environ.get('CAFE_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('CAFE_DB_PORT', '5432'),
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    # Пул соединений psycopg 3 — только если установлен psycopg[pool]; несовместим с CONN_MAX_AGE
+    try:
+        import psycopg_pool  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.environ.get('CAFE_DB_POOL_MIN', 2)),
+                'max_size': int(os.environ.get('CAFE_DB_POOL_MAX', 10)),
+                'timeout': 10,
+            },
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('CAFE_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            # Соединение живёт между запросами, PRAGMA выполняются один раз на соединение
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            # Транзакции DEFERRED: пути записи берут блокировку сразу через main.db.write_atomic()
+            'OPTIONS': {
+                'timeout': 20,
+            },
+        }
+    }
+
+# PRAGMA для каждого нового SQLite-соединения (см. main/db.py). Включаются в процессе
+# сервера: Cafe/wsgi.py, Cafe/asgi.py и runserver задают CAFE_SQLITE_TUNING=1
+SQLITE_TUNING = os.environ.get('CAFE_SQLITE_TUNING', '0') == '1'
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # в КиБ: 64 МБ
+    'temp_store': 'MEMORY',
+}
+
+
+# Cache
+# Файловый кэш общий для всех worker-процессов на одном сервере
+# (версия меню, фрагменты страниц)
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'TIMEOUT': 60 * 60 * 24,
     }
 }
 
@@ -138,4 +216,32 @@ ACCOUNT_EMAIL_VERIFICATION = 'optional'
 
 LOGIN_URL = 'login'  # имя вашего URL для логина
 LOGIN_REDIRECT_URL = 'home'  # куда перенаправлять после логина
-LOGOUT_REDIRECT_URL = 'login'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'login'
+
+
+# Замер производительности запросов (main.middleware.PerformanceMiddleware)
+PERF_SLOW_REQUEST_MS = int(os.environ.get('CAFE_PERF_SLOW_MS', 500))
+PERF_REPEATED_QUERY_THRESHOLD = 10  # одинаковых запросов с разными параметрами — вероятный N+1
+PERF_FLUSH_INTERVAL = 10  # секунд между сбросами гистограмм процесса в кэш
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # Одна JSON-строка на запрос (INFO); при DEBUG по умолчанию только медленные и N+1
+        'main.performance': {
+            'handlers': ['console'],
+            'level': os.environ.get('CAFE_PERF_LOG_LEVEL', 'WARNING' if DEBUG else 'INFO'),
+            'propagate': False,
+        },
+        # Ошибки фоновых задач (main.jobs)
+        'main.jobs': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
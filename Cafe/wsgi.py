@@ -12,5 +12,6 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Cafe.settings')
+os.environ.setdefault('CAFE_SQLITE_TUNING', '1')
 
 application = get_wsgi_application()
@@ -0,0 +1,231 @@
+"""
+Аналитика продаж на сводных таблицах.
+
+При завершении заказа его выручка и позиции прибавляются к часовым и дневным
+строкам SalesRollup (тип заказа x стол) и DishSalesRollup (блюдо) в той же
+транзакции. Отчёты читают только сводные строки, поэтому их стоимость зависит
+от длины периода, а не от числа заказов. rebuild() пересобирает сводки из
+истории заказов (по текущим ценам блюд).
+"""
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDay, TruncHour
+from django.utils import timezone
+
+from .db import write_atomic
+from .models import DishSalesRollup, Order, OrderItem, SalesRollup, Table
+
+HOUR = SalesRollup.PERIOD_HOUR
+DAY = SalesRollup.PERIOD_DAY
+TRUNCATE = {HOUR: TruncHour, DAY: TruncDay}
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+ZERO = Decimal('0.00')
+
+SalesReport = namedtuple('SalesReport', ['start', 'end', 'period', 'totals', 'series',
+                                         'by_order_type', 'by_table', 'top_dishes'])
+
+
+def bucket_start(moment, period):
+    """Начало часа или дня (по местному времени), в который попадает момент"""
+    local = timezone.localtime(moment)
+    if period == DAY:
+        return timezone.make_aware(datetime.combine(local.date(), time.min))
+    return local.replace(minute=0, second=0, microsecond=0)
+
+
+def _increment(model, key, **amounts):
+    """Прибавить значения к строке сводки, создав её при первом обращении"""
+    changes = {field: F(field) + amount for field, amount in amounts.items()}
+    if model.objects.filter(**key).update(**changes):
+        return
+    try:
+        with write_atomic():
+            model.objects.create(**key, **amounts)
+    except IntegrityError:
+        # Строку только что создал параллельный заказ
+        model.objects.filter(**key).update(**changes)
+
+
+def record_order(order, lines, completed_at):
+    """
+    Учесть завершённый заказ в сводках. Вызывается внутри транзакции
+    Order.complete(); lines — [(dish_id, quantity, price)].
+    """
+    dishes = {}
+    for dish_id, quantity, price in lines:
+        dish_quantity, dish_revenue = dishes.get(dish_id, (0, ZERO))
+        dishes[dish_id] = (dish_quantity + quantity, dish_revenue + price * quantity)
+    revenue = sum((amount for _, amount in dishes.values()), ZERO)
+    items = sum(quantity for quantity, _ in dishes.values())
+    table_number = 0
+    if order.table_id:
+        table_number = Table.objects.filter(pk=order.table_id).values_list('number', flat=True).first() or 0
+
+    buckets = {period: bucket_start(completed_at, period) for period in (HOUR, DAY)}
+    for period, bucket in buckets.items():
+        _increment(SalesRollup, {
+            'period': period, 'bucket': bucket,
+            'order_type': order.order_type, 'table_number': table_number,
+        }, orders=1, items=items, revenue=revenue)
+    _increment_dishes(buckets, dishes)
+
+
+def _increment_dishes(buckets, dishes):
+    """
+    Прибавить продажи блюд к DishSalesRollup за все периоды: число запросов
+    не зависит от числа блюд (выборка, UPDATE с CASE на период, один INSERT).
+    """
+    if not dishes:
+        return
+    keys = Q()
+    for period, bucket in buckets.items():
+        keys |= Q(period=period, bucket=bucket)
+    existing = set(DishSalesRollup.objects.filter(keys, dish_id__in=dishes).values_list('period', 'dish_id'))
+
+    missing = []
+    for period, bucket in buckets.items():
+        found = sorted(dish_id for row_period, dish_id in existing if row_period == period)
+        if found:
+            DishSalesRollup.objects.filter(period=period, bucket=bucket, dish_id__in=found).update(
+                orders=F('orders') + 1,
+                quantity=F('quantity') + Case(
+                    *[When(dish_id=dish_id, then=Value(dishes[dish_id][0])) for dish_id in found],
+                    output_field=IntegerField()),
+                revenue=F('revenue') + Case(
+                    *[When(dish_id=dish_id, then=Value(dishes[dish_id][1])) for dish_id in found],
+                    output_field=MONEY),
+            )
+        missing += [(period, bucket, dish_id) for dish_id in sorted(dishes) if (period, dish_id) not in existing]
+    if not missing:
+        return
+    try:
+        with write_atomic():
+            DishSalesRollup.objects.bulk_create([
+                DishSalesRollup(period=period, bucket=bucket, dish_id=dish_id, orders=1,
+                                quantity=dishes[dish_id][0], revenue=dishes[dish_id][1])
+                for period, bucket, dish_id in missing
+            ])
+    except IntegrityError:
+        # Часть строк только что создал параллельный заказ — по одной
+        for period, bucket, dish_id in missing:
+            quantity, revenue = dishes[dish_id]
+            _increment(DishSalesRollup, {'period': period, 'bucket': bucket, 'dish_id': dish_id},
+                       orders=1, quantity=quantity, revenue=revenue)
+
+
+def rebuild():
+    """Пересобрать все сводки из истории заказов; возвращает (строк заказов, строк блюд)"""
+    tz = timezone.get_current_timezone()
+    completed = Order.objects.filter(is_completed=True, completed_at__isnull=False)
+    line_revenue = Sum(F('quantity') * F('dish__price'), output_field=MONEY)
+    order_rows, dish_rows = [], []
+
+    for period, trunc in TRUNCATE.items():
+        # Выручка и позиции по строкам, число заказов — по самим заказам
+        items = dict(
+            ((row['bucket'], row['order__order_type'], row['order__table__number'] or 0),
+             (row['sold'], row['revenue']))
+            for row in OrderItem.objects.filter(order__in=completed)
+            .annotate(bucket=trunc('order__completed_at', tzinfo=tz))
+            .values('bucket', 'order__order_type', 'order__table__number')
+            .annotate(sold=Sum('quantity'), revenue=line_revenue)
+        )
+        for row in (completed.annotate(bucket=trunc('completed_at', tzinfo=tz))
+                    .values('bucket', 'order_type', 'table__number')
+                    .annotate(orders=Count('id'))):
+            key = (row['bucket'], row['order_type'], row['table__number'] or 0)
+            quantity, revenue = items.get(key, (0, ZERO))
+            order_rows.append(SalesRollup(
+                period=period, bucket=key[0], order_type=key[1], table_number=key[2],
+                orders=row['orders'], items=quantity or 0, revenue=revenue or ZERO,
+            ))
+
+        for row in (OrderItem.objects.filter(order__in=completed)
+                    .annotate(bucket=trunc('order__completed_at', tzinfo=tz))
+                    .values('bucket', 'dish_id')
+                    .annotate(orders=Count('order_id', distinct=True), sold=Sum('quantity'),
+                              revenue=line_revenue)):
+            dish_rows.append(DishSalesRollup(
+                period=period, bucket=row['bucket'], dish_id=row['dish_id'],
+                orders=row['orders'], quantity=row['sold'], revenue=row['revenue'],
+            ))
+
+    with write_atomic():
+        SalesRollup.objects.all().delete()
+        DishSalesRollup.objects.all().delete()
+        SalesRollup.objects.bulk_create(order_rows, batch_size=500)
+        DishSalesRollup.objects.bulk_create(dish_rows, batch_size=500)
+    return len(order_rows), len(dish_rows)
+
+
+def date_range(start, end):
+    """Границы отчёта [начало первого дня, начало дня после последнего)"""
+    return (timezone.make_aware(datetime.combine(start, time.min)),
+            timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+
+
+def _sums(queryset, *fields):
+    return queryset.values(*fields).annotate(
+        orders_sum=Coalesce(Sum('orders'), 0),
+        revenue_sum=Coalesce(Sum('revenue'), Value(ZERO), output_field=MONEY),
+    ).order_by(*fields)
+
+
+def sales_report(start, end, period=DAY, top=10):
+    """Отчёт за даты start..end включительно; series — по часам или дням"""
+    lower, upper = date_range(start, end)
+    days = SalesRollup.objects.filter(period=DAY, bucket__gte=lower, bucket__lt=upper)
+    dish_days = DishSalesRollup.objects.filter(period=DAY, bucket__gte=lower, bucket__lt=upper)
+
+    totals = days.aggregate(
+        orders=Coalesce(Sum('orders'), 0),
+        items=Coalesce(Sum('items'), 0),
+        revenue=Coalesce(Sum('revenue'), Value(ZERO), output_field=MONEY),
+    )
+    totals['average_check'] = (totals['revenue'] / totals['orders']).quantize(Decimal('0.01')) \
+        if totals['orders'] else ZERO
+
+    series = SalesRollup.objects.filter(period=period, bucket__gte=lower, bucket__lt=upper)
+    top_dishes = (dish_days.values('dish_id', 'dish__name')
+                  .annotate(quantity_sum=Sum('quantity'), orders_sum=Sum('orders'), revenue_sum=Sum('revenue'))
+                  .order_by('-quantity_sum', '-revenue_sum', 'dish__name'))
+    if top:
+        top_dishes = top_dishes[:top]
+
+    return SalesReport(
+        start=start, end=end, period=period, totals=totals,
+        series=list(_sums(series, 'bucket')),
+        by_order_type=list(_sums(days, 'order_type')),
+        by_table=list(_sums(days.exclude(table_number=0), 'table_number')),
+        top_dishes=list(top_dishes),
+    )
+
+
+EXPORTS = {
+    'series': ('bucket', 'orders_sum', 'revenue_sum'),
+    'order_type': ('order_type', 'orders_sum', 'revenue_sum'),
+    'table': ('table_number', 'orders_sum', 'revenue_sum'),
+    'dish': ('dish__name', 'quantity_sum', 'orders_sum', 'revenue_sum'),
+}
+
+
+def export_rows(report, section):
+    """Строки раздела отчёта для CSV: сначала заголовок"""
+    columns = EXPORTS[section]
+    rows = {
+        'series': report.series,
+        'order_type': report.by_order_type,
+        'table': report.by_table,
+        'dish': report.top_dishes,
+    }[section]
+    yield columns
+    for row in rows:
+        values = [row[column] for column in columns]
+        if section == 'series':
+            values[0] = timezone.localtime(values[0]).strftime('%Y-%m-%d %H:%M')
+        yield values
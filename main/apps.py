@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        from .db import configure_sqlite
+        from .performance import install
+        connection_created.connect(configure_sqlite, dispatch_uid='main.configure_sqlite')
+        connection_created.connect(install, dispatch_uid='main.performance')
+
+        from .auth import invalidate_user
+        from .models import User
+        post_save.connect(invalidate_user, sender=User, dispatch_uid='main.invalidate_user')
+        post_delete.connect(invalidate_user, sender=User, dispatch_uid='main.invalidate_user_delete')
+
+        from .search import install
+        post_migrate.connect(install, sender=self, dispatch_uid='main.search_install')
@@ -0,0 +1,62 @@
+"""
+Кэш пользователя для аутентификации.
+
+ModelBackend загружает User по id из сессии на каждом запросе. Здесь в кэше
+хранятся поля пользователя (вместе с ролью) без хэша пароля — кэш лежит в
+файлах, — и готовый хэш сессии, которым django.contrib.auth проверяет, что
+пароль не менялся. Из кэша собирается User с отложенным полем password: оно
+читается из БД только при обращении. Запись сбрасывается при любом сохранении
+или удалении пользователя, сразу и после коммита транзакции, чтобы
+параллельный запрос не закэшировал незакоммиченное состояние.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+USER_CACHE_TTL = 300  # секунд; изменения пользователя сбрасывают кэш сразу
+SECRET_FIELDS = {'password'}
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _cached_fields(user):
+    return [field for field in user._meta.concrete_fields if field.attname not in SECRET_FIELDS]
+
+
+def dump_user(user):
+    """Запись кэша: значения полей без секретов и хэш сессии"""
+    return {
+        'fields': {field.attname: field.get_prep_value(field.value_from_object(user))
+                   for field in _cached_fields(user)},
+        'session_auth_hash': user.get_session_auth_hash(),
+    }
+
+
+def load_user(entry):
+    """User из записи кэша; password остаётся отложенным полем"""
+    fields = entry['fields']
+    user = get_user_model().from_db(DEFAULT_DB_ALIAS, list(fields), list(fields.values()))
+    user._session_auth_hash = entry['session_auth_hash']
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        entry = cache.get(key)
+        if entry is not None:
+            user = load_user(entry)
+            return user if self.user_can_authenticate(user) else None
+        user = super().get_user(user_id)
+        if user is not None:
+            cache.set(key, dump_user(user), USER_CACHE_TTL)
+        return user
+
+
+def invalidate_user(sender, instance, **kwargs):
+    key = user_cache_key(instance.pk)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
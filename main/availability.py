@@ -0,0 +1,60 @@
+"""
+Сколько порций каждого блюда можно приготовить из текущего склада.
+
+Все строки рецептов и остатки продуктов читаются одним запросом, затем для
+каждого блюда берётся минимум по его ингредиентам из floor(остаток / расход
+на порцию) — это минимум по строкам разреженной матрицы "блюдо x продукт".
+Расход берётся из DishIngredient.base_quantity, уже в единицах продукта.
+"""
+import math
+
+from .models import Dish, DishIngredient
+
+# Допуск на ошибки округления FloatField (как в stock.EPSILON)
+EPSILON = 1e-9
+
+
+def recipe_matrix(dish_ids=None):
+    """
+    Разреженная матрица рецептов и вектор остатков.
+
+    Возвращает ({dish_id: {product_id: расход на порцию}}, {product_id: свободный остаток}).
+    """
+    ingredients = DishIngredient.objects.values_list(
+        'dish_id', 'product_id', 'base_quantity', 'product__quantity', 'product__reserved_quantity')
+    if dish_ids is not None:
+        ingredients = ingredients.filter(dish_id__in=dish_ids)
+
+    matrix = {}
+    stock = {}
+    for dish_id, product_id, per_portion, quantity, reserved in ingredients:
+        row = matrix.setdefault(dish_id, {})
+        row[product_id] = row.get(product_id, 0) + per_portion
+        stock[product_id] = max(0, quantity - reserved)
+    return matrix, stock
+
+
+def max_portions(row, stock):
+    """Максимум порций для одной строки матрицы; None — рецепт не ограничен складом"""
+    limits = [
+        math.floor(stock.get(product_id, 0) / amount + EPSILON)
+        for product_id, amount in row.items() if amount > 0
+    ]
+    return max(0, min(limits)) if limits else None
+
+
+def producible_portions(dish_ids=None):
+    """{dish_id: максимум порций из текущего склада} для всех (или указанных) блюд"""
+    matrix, stock = recipe_matrix(dish_ids)
+    if dish_ids is None:
+        dish_ids = Dish.objects.values_list('pk', flat=True)
+    return {dish_id: max_portions(matrix.get(dish_id, {}), stock) for dish_id in dish_ids}
+
+
+def annotate_dishes(dishes):
+    """Проставляет атрибут `producible` каждому блюду из списка одним расчётом"""
+    dishes = list(dishes)
+    availability = producible_portions([dish.pk for dish in dishes])
+    for dish in dishes:
+        dish.producible = availability.get(dish.pk)
+    return dishes
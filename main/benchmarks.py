@@ -0,0 +1,226 @@
+"""
+Общие утилиты нагрузочных замеров: параллельный прогон и перцентили задержек,
+генерация реалистичных данных и сценарий официанта поверх настоящих view.
+"""
+import math
+import random
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import F
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+BENCH_PREFIX = '__bench__'
+BENCH_TABLE_BASE = 10 ** 6  # номера столов замера не пересекаются с настоящими
+
+# Потолок SQL-запросов на один запрос к view; не зависит от объёма данных.
+# Сессия и пользователь берутся из кэша, поэтому в бюджет не входят.
+# complete рассчитан на заказ до 4 разных блюд; на блюдо — только условный UPDATE
+# порций (PER_DISH_QUERIES), сводки и события пишутся пачками
+QUERY_BUDGETS = {
+    'table_order.open': 10,
+    'table_order.add_item': 8,
+    'table_order.complete': 30,
+    'orders_list': 1,
+    'dish_list': 2,
+    'add_portions': 13,
+}
+PER_DISH_QUERIES = {'table_order.complete': 1}
+
+
+def percentile(values, pct):
+    """Перцентиль по методу ближайшего ранга; values должны быть отсортированы"""
+    if not values:
+        return 0.0
+    rank = max(0, math.ceil(pct / 100 * len(values)) - 1)
+    return values[rank]
+
+
+def summarize(latencies, elapsed):
+    """Сводка: количество, пропускная способность и p50/p95/p99 в миллисекундах"""
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+    }
+
+
+def format_summary(name, summary):
+    return (f"{name:<28} {summary['count']:>7} оп. {summary['throughput']:>9.1f} оп/с "
+            f"p50 {summary['p50']:>7.2f} мс  p95 {summary['p95']:>7.2f} мс  p99 {summary['p99']:>7.2f} мс")
+
+
+def run_concurrently(operation, workers, iterations):
+    """
+    Выполнить operation(worker, i) в `workers` потоках по `iterations` раз.
+
+    Возвращает (словарь имя -> список задержек, время прогона, список ошибок).
+    operation возвращает имя замера (или None — тогда 'operation').
+    """
+    latencies = {}
+    errors = []
+    lock = threading.Lock()
+
+    def worker(number):
+        local = {}
+        try:
+            for i in range(iterations):
+                started = time.perf_counter()
+                try:
+                    name = operation(number, i) or 'operation'
+                except Exception as error:  # замер не должен обрываться на первой ошибке
+                    with lock:
+                        errors.append(error)
+                    continue
+                local.setdefault(name, []).append(time.perf_counter() - started)
+        finally:
+            connections.close_all()
+            with lock:
+                for name, values in local.items():
+                    latencies.setdefault(name, []).extend(values)
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started, errors
+
+
+def seed(dishes=300, orders=20000, tables=30, products=None, days=90, seed_value=1):
+    """
+    Данные замера: продукты, блюда с рецептами, столы и история завершённых
+    заказов. Всё пишется пачками и помечается BENCH_PREFIX; возвращает сводку.
+    """
+    from . import ledger, units
+    from .models import Dish, DishIngredient, Order, OrderItem, Product, StockMovement, Table
+
+    rng = random.Random(seed_value)
+    products = products or max(10, dishes // 3)
+    product_rows = Product.objects.bulk_create([
+        Product(name=f'{BENCH_PREFIX}product-{i}', unit=rng.choice(['kg', 'liters', 'pieces']),
+                quantity=10 ** 7, purchase_price=Decimal(rng.randrange(1000, 50000)))
+        for i in range(products)
+    ], batch_size=500)
+    ledger.record(StockMovement.RECEIPT, {product.pk: (product.quantity, 0) for product in product_rows})
+
+    dish_rows = Dish.objects.bulk_create([
+        Dish(name=f'{BENCH_PREFIX}dish-{i}', price=Decimal(rng.randrange(10, 120) * 1000), portions=10 ** 6)
+        for i in range(dishes)
+    ], batch_size=500)
+
+    ingredients = []
+    for dish in dish_rows:
+        for product in rng.sample(product_rows, 3):
+            quantity, unit = rng.choice([(0.2, 'kg'), (150, 'g'), (0.1, 'liters'), (1, 'pieces')])
+            ingredients.append(DishIngredient(
+                dish=dish, product=product, quantity=quantity, unit=unit,
+                base_quantity=units.convert(quantity, unit, product.unit),
+            ))
+    DishIngredient.objects.bulk_create(ingredients, batch_size=1000)
+    Dish.objects.filter(name__startswith=BENCH_PREFIX).refresh_costs()
+
+    Table.objects.bulk_create([Table(number=BENCH_TABLE_BASE + i) for i in range(tables)])
+    table_ids = list(Table.objects.filter(number__gte=BENCH_TABLE_BASE).values_list('pk', flat=True))
+
+    now = timezone.now()
+    order_types = [value for value, _ in Order.ORDER_TYPES]
+    for start in range(0, orders, 1000):
+        batch = []
+        for _ in range(min(1000, orders - start)):
+            order_type = rng.choice(order_types)
+            batch.append(Order(
+                order_type=order_type, customer_name=BENCH_PREFIX, is_completed=True,
+                table_id=rng.choice(table_ids) if order_type == 'dine_in' else None,
+                completed_at=now - timedelta(seconds=rng.randrange(days * 86400)),
+            ))
+        batch = Order.objects.bulk_create(batch)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, dish=dish, quantity=rng.randint(1, 3))
+            for order in batch
+            for dish in rng.sample(dish_rows, rng.randint(1, 4))
+        ], batch_size=1000)
+    # created_at с auto_now_add при вставке — переносим историю в прошлое одним UPDATE
+    Order.objects.filter(customer_name=BENCH_PREFIX).update(created_at=F('completed_at'))
+
+    return {'products': products, 'dishes': dishes, 'tables': tables, 'orders': orders}
+
+
+def cleanup():
+    """Удалить всё, что создал seed() и сценарий официанта"""
+    from .models import Dish, Order, Product, SalesRollup, Table
+
+    Order.objects.filter(customer_name=BENCH_PREFIX).delete()
+    Order.objects.filter(table__number__gte=BENCH_TABLE_BASE).delete()
+    Table.objects.filter(number__gte=BENCH_TABLE_BASE).delete()
+    SalesRollup.objects.filter(table_number__gte=BENCH_TABLE_BASE).delete()
+    Dish.objects.filter(name__startswith=BENCH_PREFIX).delete()
+    Product.objects.filter(name__startswith=BENCH_PREFIX).delete()
+
+
+def _host():
+    """Имя хоста, которое пропустит ALLOWED_HOSTS (тестовый клиент шлёт testserver)"""
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+class Waiter:
+    """
+    Официант со своим столом и тестовым клиентом: каждый вызов step() — один
+    HTTP-запрос к настоящему view. Цикл: открыть стол, добавить N блюд,
+    закрыть заказ, список заказов, меню, заготовка порций.
+    """
+
+    def __init__(self, user, table_id, dish_ids, items=4, seed_value=0):
+        self.client = Client(SERVER_NAME=_host())
+        self.client.force_login(user)
+        self.table_id = table_id
+        self.dish_ids = dish_ids
+        self.items = items
+        self.rng = random.Random(seed_value)
+        self.steps = (['table_order.open'] + ['table_order.add_item'] * items
+                      + ['table_order.complete', 'orders_list', 'dish_list', 'add_portions'])
+        self.position = 0
+        self.queries = {}
+
+    def step(self):
+        """Выполнить следующий шаг; возвращает его имя"""
+        name = self.steps[self.position % len(self.steps)]
+        self.position += 1
+        with CaptureQueriesContext(connection) as captured:
+            response = self.request(name)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{name}: HTTP {response.status_code}')
+        self.queries[name] = max(self.queries.get(name, 0), len(captured))
+        return name
+
+    def request(self, name):
+        table_url = reverse('table_order', args=[self.table_id])
+        if name == 'table_order.open':
+            return self.client.get(table_url)
+        if name == 'table_order.add_item':
+            return self.client.post(table_url, {
+                'action': 'add_item', 'dish_id': self.rng.choice(self.dish_ids), 'quantity': 1})
+        if name == 'table_order.complete':
+            return self.client.post(table_url, {'action': 'complete_order'})
+        if name == 'orders_list':
+            return self.client.get(reverse('orders'))
+        if name == 'dish_list':
+            return self.client.get(reverse('menu'))
+        if name == 'add_portions':
+            return self.client.post(reverse('add_portions', args=[self.rng.choice(self.dish_ids)]),
+                                    {'portions': 1})
+        raise ValueError(name)
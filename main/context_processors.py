@@ -0,0 +1,9 @@
+"""
+Контекст шаблонов проекта.
+"""
+from django.conf import settings
+
+
+def live_events(request):
+    """SSE-поток только под ASGI: под WSGI страницы опрашивают ленту событий"""
+    return {'events_stream': settings.ASYNC_VIEWS}
@@ -0,0 +1,49 @@
+"""
+Настройка соединений с БД.
+
+Для SQLite при создании каждого соединения выполняются PRAGMA из
+settings.SQLITE_PRAGMAS (WAL, synchronous=NORMAL, busy_timeout, mmap, cache).
+Они включаются только в процессе сервера (Cafe/wsgi.py, Cafe/asgi.py,
+runserver): journal_mode=WAL переписывает файл базы, и обычные команды
+manage.py его не трогают.
+
+Транзакции SQLite по умолчанию DEFERRED: чтения не берут блокировку записи.
+Пути записи открываются через write_atomic() — BEGIN IMMEDIATE сразу берёт
+блокировку, и транзакция, начавшаяся с чтения, не получит SQLITE_BUSY при
+повышении блокировки.
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or not getattr(settings, 'SQLITE_TUNING', False):
+        return
+    # In-memory база (тесты) не поддерживает WAL и mmap — пропускаем
+    if connection.is_in_memory_db():
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+@contextmanager
+def write_atomic(using=DEFAULT_DB_ALIAS):
+    """transaction.atomic() для путей записи; внешняя транзакция SQLite — BEGIN IMMEDIATE"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+    # transaction_mode читается из настроек при подключении — подключаемся заранее
+    connection.ensure_connection()
+    previous = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            connection.transaction_mode = previous
+            yield
+    finally:
+        connection.transaction_mode = previous
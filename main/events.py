@@ -0,0 +1,100 @@
+"""
+Push-канал изменений (заказы, столы, порции).
+
+Изменения записываются в таблицу Event после коммита транзакции, клиенты
+читают их через SSE (`events/stream/`) или JSON (`events/`) и продолжают
+с последнего полученного id.
+"""
+import asyncio
+import json
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Event
+
+EVENTS_BATCH_SIZE = 100
+STREAM_POLL_INTERVAL = 1.0     # секунды между проверками новых событий
+STREAM_HEARTBEAT_INTERVAL = 15.0
+FLOOR_KINDS = ('table', 'order')  # события, меняющие план зала (floor.state)
+
+
+def publish(kind, action, object_id=None, **data):
+    """Опубликовать событие после успешного коммита текущей транзакции"""
+    if kind in FLOOR_KINDS:
+        from . import floor
+        floor.bump()
+    transaction.on_commit(lambda: Event.objects.create(
+        kind=kind, action=action, object_id=object_id, data=data,
+    ))
+
+
+def publish_many(kind, action, items):
+    """Опубликовать пачку событий одним INSERT после коммита; items — [(object_id, data)]"""
+    items = list(items)
+    if not items:
+        return
+    if kind in FLOOR_KINDS:
+        from . import floor
+        floor.bump()
+    transaction.on_commit(lambda: Event.objects.bulk_create([
+        Event(kind=kind, action=action, object_id=object_id, data=data) for object_id, data in items
+    ]))
+
+
+async def apublish(kind, action, object_id=None, **data):
+    """publish() для async view: запись события выполняется в потоке"""
+    await sync_to_async(publish)(kind, action, object_id, **data)
+
+
+def latest_cursor():
+    last = Event.objects.order_by('-id').values_list('id', flat=True).first()
+    return last or 0
+
+
+def events_since(cursor, limit=EVENTS_BATCH_SIZE, kinds=None):
+    events = Event.objects.filter(id__gt=cursor).order_by('id')
+    if kinds:
+        events = events.filter(kind__in=kinds)
+    return [event.as_dict() for event in events[:limit]]
+
+
+async def aevents_since(cursor, limit=EVENTS_BATCH_SIZE, kinds=None):
+    events = Event.objects.filter(id__gt=cursor).order_by('id')
+    if kinds:
+        events = events.filter(kind__in=kinds)
+    return [event.as_dict() async for event in events[:limit]]
+
+
+def format_sse(event):
+    payload = json.dumps(event, ensure_ascii=False)
+    return f"id: {event['id']}\nevent: {event['kind']}\ndata: {payload}\n\n"
+
+
+async def stream(cursor, kinds=None):
+    """Асинхронный генератор SSE-сообщений начиная с курсора"""
+    # Подсказка клиенту, через сколько переподключаться
+    yield "retry: 3000\n\n"
+    idle = 0.0
+    while True:
+        events = await aevents_since(cursor, kinds=kinds)
+        for event in events:
+            cursor = event['id']
+            yield format_sse(event)
+        if events:
+            idle = 0.0
+            continue
+
+        await asyncio.sleep(STREAM_POLL_INTERVAL)
+        idle += STREAM_POLL_INTERVAL
+        if idle >= STREAM_HEARTBEAT_INTERVAL:
+            idle = 0.0
+            yield ": ping\n\n"
+
+
+def prune(older_than=timedelta(days=1)):
+    """Удалить старые события; возвращает количество удалённых"""
+    deleted, _ = Event.objects.filter(created_at__lt=timezone.now() - older_than).delete()
+    return deleted
@@ -0,0 +1,328 @@
+"""
+Потоковый импорт и экспорт справочников и истории заказов.
+
+Импорт читает CSV или JSON Lines построчно, проверяет поля теми же
+валидаторами модели и пишет пачками по CHUNK_SIZE строк: одна выборка
+существующих записей по названию, затем bulk_create и bulk_update в одной
+транзакции. Побочные эффекты save() повторяются на пачку целиком: движения
+склада в журнале, пересчёт себестоимости блюд, сброс кэша меню. Строки с
+ошибками пропускаются и возвращаются списком.
+
+Экспорт — генераторы строк поверх .iterator(), которые отдаются через
+StreamingHttpResponse: память не зависит от размера выгрузки. Под ASGI ответ
+получает асинхронный итератор astream(): синхронный итератор Django там сначала
+собрал бы в список всю выгрузку.
+"""
+import csv
+import io
+import json
+from collections import namedtuple
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+
+from . import ledger, menu_cache, units
+from .db import write_atomic
+from .models import Dish, DishIngredient, Order, OrderItem, Product, StockMovement
+
+CHUNK_SIZE = 500
+UPDATE_BATCH_SIZE = 100  # bulk_update строит CASE по строкам: короткие пачки дешевле на SQLite
+EXPORT_CHUNK_SIZE = 2000
+FORMATS = ('csv', 'jsonl')
+
+ImportResult = namedtuple('ImportResult', ['created', 'updated', 'errors'])
+
+
+class RowError(Exception):
+    pass
+
+
+def read_rows(stream, fmt):
+    """Строки файла как словари: (номер строки, данные); stream — бинарный"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        for line, row in enumerate(csv.DictReader(text), start=2):
+            yield line, row
+        return
+    for line, raw in enumerate(text, start=1):
+        if not raw.strip():
+            continue
+        try:
+            row = json.loads(raw)
+        except ValueError as exc:
+            yield line, RowError(f'Некорректный JSON: {exc}')
+            continue
+        yield line, row if isinstance(row, dict) else RowError('Ожидался объект JSON')
+
+
+def _clean(model, row, fields, required):
+    """Значения полей строки, проверенные полями модели"""
+    values = {}
+    for name in fields:
+        raw = row.get(name)
+        if isinstance(raw, str):
+            raw = raw.strip()
+        if raw in (None, ''):
+            if name in required:
+                raise RowError(f'Не заполнено поле {name}')
+            continue
+        try:
+            values[name] = model._meta.get_field(name).clean(raw, None)
+        except ValidationError as exc:
+            raise RowError(f"{name}: {'; '.join(exc.messages)}")
+    return values
+
+
+def _by_name(model, names):
+    """{название: запись}; при одинаковых названиях берётся самая старая"""
+    found = {}
+    for obj in model.objects.filter(name__in=names).order_by('-pk'):
+        found[obj.name] = obj
+    return found
+
+
+def _import_products(rows):
+    by_name = _by_name(Product, [row['name'] for row in rows])
+    loaded = {product.pk: product.quantity for product in by_name.values()}
+    new, changed, unit_changed, adjustments = [], {}, [], {}
+    for row in rows:
+        row = dict(row)
+        product = by_name.get(row['name'])
+        if product is None:
+            row.setdefault('quantity', 0)
+            if 'unit' not in row or 'purchase_price' not in row:
+                raise RowError('Для нового продукта нужны unit и purchase_price')
+            product = by_name[row['name']] = Product(**row)
+            new.append(product)
+            continue
+        if product.pk is None:
+            # Повтор названия в той же пачке: последняя строка побеждает
+            for name, value in row.items():
+                setattr(product, name, value)
+            continue
+        if 'unit' in row and row['unit'] != product.unit:
+            unit_changed.append((product, row))
+            continue
+        delta = row.pop('quantity', loaded[product.pk]) - loaded[product.pk]
+        price = row.get('purchase_price', product.purchase_price)
+        if not delta and price == product.purchase_price and product.pk not in changed:
+            continue
+        # Остаток меняем на разницу через F(), как Product.save(): списания не теряются
+        adjustments[product.pk] = (delta, 0)
+        product.quantity = F('quantity') + delta
+        product.purchase_price = price
+        changed[product.pk] = product
+
+    Product.objects.bulk_create(new)
+    ledger.record(StockMovement.RECEIPT, {product.pk: (product.quantity, 0) for product in new})
+    Product.objects.bulk_update(changed.values(), ['quantity', 'purchase_price'], batch_size=UPDATE_BATCH_SIZE)
+    ledger.record(StockMovement.ADJUSTMENT, adjustments)
+    Dish.objects.filter(pk__in=DishIngredient.objects.filter(product__in=list(changed)).values('dish_id')).refresh_costs()
+    # Смена единицы пересчитывает рецепты — редкий случай, идёт через save()
+    for product, row in unit_changed:
+        for name, value in row.items():
+            setattr(product, name, value)
+        product.save()
+    return len(new), len(changed) + len(unit_changed)
+
+
+def _import_dishes(rows):
+    by_name = _by_name(Dish, [row['name'] for row in rows])
+    new, changed = [], {}
+    for row in rows:
+        dish = by_name.get(row['name'])
+        if dish is None:
+            if 'price' not in row:
+                raise RowError('Для нового блюда нужна цена')
+            dish = by_name[row['name']] = Dish(**row)
+            new.append(dish)
+            continue
+        if dish.pk and all(getattr(dish, name) == value for name, value in row.items()):
+            continue
+        for name, value in row.items():
+            setattr(dish, name, value)
+        if dish.pk:
+            changed[dish.pk] = dish
+    Dish.objects.bulk_create(new)
+    Dish.objects.bulk_update(changed.values(), ['description', 'price'], batch_size=UPDATE_BATCH_SIZE)
+    Dish.objects.filter(pk__in=[dish.pk for dish in new] + list(changed)).refresh_costs()
+    return len(new), len(changed)
+
+
+def _import_ingredients(rows):
+    dishes = _by_name(Dish, [row['dish'] for row in rows])
+    products = _by_name(Product, [row['product'] for row in rows])
+    for row in rows:
+        if row['dish'] not in dishes:
+            raise RowError(f"Нет блюда «{row['dish']}»")
+        if row['product'] not in products:
+            raise RowError(f"Нет продукта «{row['product']}»")
+
+    existing = {
+        (ingredient.dish_id, ingredient.product_id): ingredient
+        for ingredient in DishIngredient.objects.filter(
+            dish__in=dishes.values(), product__in=products.values()).order_by('-pk')
+    }
+    new, changed = {}, {}
+    for row in rows:
+        dish, product = dishes[row['dish']], products[row['product']]
+        key = (dish.pk, product.pk)
+        ingredient = existing.get(key) or new.get(key)
+        if ingredient is None:
+            ingredient = new[key] = DishIngredient(dish=dish, product=product)
+        elif ingredient.pk:
+            changed[key] = ingredient
+        ingredient.quantity = row['quantity']
+        ingredient.unit = row.get('unit') or ingredient.unit
+        ingredient.base_quantity = units.convert(ingredient.quantity, ingredient.unit, product.unit)
+    DishIngredient.objects.bulk_create(new.values())
+    DishIngredient.objects.bulk_update(changed.values(), ['quantity', 'unit', 'base_quantity'],
+                                       batch_size=UPDATE_BATCH_SIZE)
+    Dish.objects.filter(pk__in={dish_id for dish_id, _ in list(new) + list(changed)}).refresh_costs()
+    return len(new), len(changed)
+
+
+# Вид -> (модель, поля, обязательные, запись пачки)
+IMPORTS = {
+    'products': (Product, ('name', 'unit', 'quantity', 'purchase_price'), ('name',), _import_products),
+    'dishes': (Dish, ('name', 'description', 'price'), ('name',), _import_dishes),
+    'ingredients': (DishIngredient, ('dish', 'product', 'quantity', 'unit'), ('dish', 'product', 'quantity'),
+                    _import_ingredients),
+}
+
+# Поля-ссылки в рецептах задаются названиями, проверяем их как строки
+NAME_FIELD = Dish._meta.get_field('name')
+
+
+def _clean_row(kind, row):
+    model, fields, required, _ = IMPORTS[kind]
+    if kind != 'ingredients':
+        return _clean(model, row, fields, required)
+    values = _clean(model, row, ('quantity', 'unit'), required)
+    for name in ('dish', 'product'):
+        raw = str(row.get(name) or '').strip()
+        if not raw:
+            raise RowError(f'Не заполнено поле {name}')
+        values[name] = NAME_FIELD.clean(raw, None)
+    return values
+
+
+def import_rows(kind, rows):
+    """Импортировать (номер строки, данные) пачками; возвращает ImportResult"""
+    write = IMPORTS[kind][3]
+    created = updated = 0
+    errors = []
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        valid = []
+        for line, row in chunk:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                valid.append((line, _clean_row(kind, row)))
+            except RowError as exc:
+                errors.append((line, str(exc)))
+        try:
+            with write_atomic():
+                chunk_created, chunk_updated = write([row for _, row in valid])
+        except RowError:
+            # Ошибка, видная только на фоне базы: повторяем пачку по строке
+            chunk_created = chunk_updated = 0
+            for line, row in valid:
+                try:
+                    with write_atomic():
+                        row_created, row_updated = write([row])
+                except RowError as exc:
+                    errors.append((line, str(exc)))
+                else:
+                    chunk_created += row_created
+                    chunk_updated += row_updated
+        created += chunk_created
+        updated += chunk_updated
+    if created or updated:
+        menu_cache.bump()
+    return ImportResult(created, updated, sorted(errors))
+
+
+def import_file(kind, stream, fmt):
+    return import_rows(kind, read_rows(stream, fmt))
+
+
+# Вид -> (заголовок, функция строк); порядок колонок импорта совпадает
+EXPORTS = {
+    'products': (
+        ('name', 'unit', 'quantity', 'purchase_price'),
+        lambda start, end: Product.objects.order_by('pk').values_list(
+            'name', 'unit', 'quantity', 'purchase_price'),
+    ),
+    'dishes': (
+        ('name', 'description', 'price'),
+        lambda start, end: Dish.objects.order_by('pk').values_list('name', 'description', 'price'),
+    ),
+    'ingredients': (
+        ('dish', 'product', 'quantity', 'unit'),
+        lambda start, end: DishIngredient.objects.order_by('pk').values_list(
+            'dish__name', 'product__name', 'quantity', 'unit'),
+    ),
+    'orders': (
+        ('id', 'created_at', 'completed_at', 'order_type', 'table', 'customer_name', 'is_completed', 'subtotal'),
+        lambda start, end: _period(Order.objects.with_subtotal(), 'created_at', start, end)
+        .order_by('pk').values_list('id', 'created_at', 'completed_at', 'order_type', 'table__number',
+                                    'customer_name', 'is_completed', 'subtotal'),
+    ),
+    'order_lines': (
+        ('order_id', 'created_at', 'dish', 'quantity', 'price', 'total'),
+        lambda start, end: _period(OrderItem.objects, 'order__created_at', start, end)
+        .order_by('order_id', 'pk').annotate(total=F('quantity') * F('dish__price'))
+        .values_list('order_id', 'order__created_at', 'dish__name', 'quantity', 'dish__price', 'total'),
+    ),
+}
+
+
+def _period(queryset, field, start, end):
+    if start is not None:
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{f'{field}__lt': end})
+    return queryset
+
+
+def export_rows(kind, start=None, end=None):
+    """Заголовок, затем строки выгрузки, читаемые из БД порциями"""
+    header, rows = EXPORTS[kind]
+    yield header
+    yield from rows(start, end).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: write() возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def stream(kind, fmt, start=None, end=None):
+    """Генератор строк файла выгрузки в формате csv или jsonl"""
+    rows = export_rows(kind, start, end)
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        for row in rows:
+            yield writer.writerow(row)
+        return
+    header = next(rows)
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+async def astream(kind, fmt, start=None, end=None):
+    """stream() для ASGI: строки забираются пачками по EXPORT_CHUNK_SIZE в потоке"""
+    lines = stream(kind, fmt, start, end)
+    take = sync_to_async(lambda: ''.join(islice(lines, EXPORT_CHUNK_SIZE)))
+    while chunk := await take():
+        yield chunk
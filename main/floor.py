@@ -0,0 +1,149 @@
+"""
+Состояние столов (план зала).
+
+Занятость стола меняется только здесь и только условными UPDATE, связанными
+с открытым заказом: seat() создаёт открытый заказ (его единственность держит
+ограничение one_open_order_per_table) и занимает свободный стол, release()
+освобождает занятый стол в транзакции закрытия заказа. Из двух официантов,
+сажающих гостей за один стол, заказ создаёт ровно один, второй получает тот же
+заказ.
+
+state() собирает план зала одним запросом (стол, статус, открытый заказ, сумма,
+время посадки) и кэширует его по версии. Версия меняется после коммита любого
+события столов и заказов (events.publish); в ETag входит и версия меню, так как
+сумма считается по текущим ценам блюд.
+"""
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, FilteredRelation, Max, Min, Q, Sum
+
+from . import menu_cache
+from .db import write_atomic
+from .models import Order, Table
+
+VERSION_KEY = 'floor:version'
+STATE_KEY = 'floor:state:{version}'
+STATE_TTL = 300
+
+FREE = 'free'
+OCCUPIED = 'occupied'
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = time.time()
+        cache.add(VERSION_KEY, version, timeout=None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def bump():
+    """Сменить версию после коммита текущей транзакции"""
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, time.time(), timeout=None))
+
+
+def seat(table):
+    """
+    Открыть заказ за столом и занять стол. Возвращает (заказ, создан ли он);
+    если открытый заказ уже есть (в том числе созданный параллельно) — его.
+    """
+    from . import events
+    order = Order.objects.filter(table=table, is_completed=False).first()
+    if order:
+        return order, False
+    try:
+        with write_atomic():
+            order = Order.objects.create(table=table)
+            Table.objects.filter(pk=table.pk, is_occupied=False).update(is_occupied=True)
+    except IntegrityError:
+        # Стол только что занял другой официант — работаем с его заказом
+        return Order.objects.get(table=table, is_completed=False), False
+    table.is_occupied = True
+    events.publish('table', 'seated', table.pk, number=table.number, is_occupied=True, order_id=order.pk)
+    return order, True
+
+
+def release(table_id):
+    """Освободить стол; вызывается в транзакции закрытия или удаления заказа"""
+    from . import events
+    if Table.objects.filter(pk=table_id, is_occupied=True).update(is_occupied=False):
+        events.publish('table', 'released', table_id, is_occupied=False)
+        return True
+    return False
+
+
+def vacate(table):
+    """
+    Освободить стол вручную: пустой открытый заказ удаляется, заказ с блюдами
+    нужно сначала завершить. Возвращает (успех, сообщение).
+    """
+    from . import events
+    with write_atomic():
+        order = Order.objects.select_for_update().filter(table=table, is_completed=False).first()
+        if order is not None:
+            if order.order_items.exists():
+                return False, f'За столом {table.number} открыт заказ #{order.pk}: сначала завершите его'
+            order_id = order.pk
+            order.delete()
+            events.publish('order', 'deleted', order_id)
+        if not release(table.pk):
+            return False, f'Стол {table.number} уже свободен'
+    table.is_occupied = False
+    return True, f'Стол #{table.number} теперь свободен'
+
+
+def toggle(table):
+    """Переключить стол из списка: свободный — посадить, занятый — освободить"""
+    if table.is_occupied:
+        return vacate(table)
+    order, created = seat(table)
+    if not created:
+        return False, f'Стол {table.number} уже занят (заказ #{order.pk})'
+    return True, f'Стол #{table.number} теперь занят'
+
+
+def _query():
+    # Соединение только с открытым заказом: история столов в выборку не попадает
+    return (Table.objects.order_by('number')
+            .annotate(open_order=FilteredRelation('order', condition=Q(order__is_completed=False)))
+            .values('id', 'number', 'seats', 'is_occupied')
+            .annotate(
+                order_id=Max('open_order__id'),
+                seated_since=Min('open_order__created_at'),
+                total=Sum(F('open_order__order_items__quantity') * F('open_order__order_items__dish__price'),
+                          output_field=DecimalField(max_digits=12, decimal_places=2)),
+            ))
+
+
+def state_version():
+    return f'{get_version()!r}-{menu_cache.get_version()!r}'
+
+
+def state():
+    """План зала: {'version': ..., 'tables': [...]}; один запрос на версию"""
+    version = state_version()
+    key = STATE_KEY.format(version=version)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        tables = []
+        for row in _query():
+            tables.append({
+                'id': row['id'],
+                'number': row['number'],
+                'seats': row['seats'],
+                'status': OCCUPIED if row['is_occupied'] or row['order_id'] else FREE,
+                'order_id': row['order_id'],
+                'total': row['total'] or Decimal('0'),
+                'seated_since': row['seated_since'],
+            })
+        snapshot = {'version': version, 'tables': tables}
+        cache.set(key, snapshot, STATE_TTL)
+    return snapshot
+
+
+def etag(request, *args, **kwargs):
+    return f'floor-{state_version()}'
@@ -0,0 +1,134 @@
+"""
+Прогноз расхода продуктов и подсказки по закупке.
+
+Дневной расход продукта = продажи блюд за день (дневные строки DishSalesRollup)
+x расход продукта на порцию (DishIngredient.base_quantity): произведение
+разреженных матриц "день x блюдо" и "блюдо x продукт" за один проход по строкам.
+По каждому продукту хранится экспоненциальное среднее и дисперсия расхода
+(ProductForecast) и последний учтённый день, поэтому ночной refresh() досчитывает
+только новые дни. Запас в днях и размер заказа считаются по текущему остатку.
+"""
+import math
+from collections import namedtuple
+from datetime import timedelta
+
+from django.utils import timezone
+
+from . import analytics
+from .db import write_atomic
+from .models import DishIngredient, DishSalesRollup, Product, ProductForecast, SalesRollup
+
+SPAN_DAYS = 14        # окно сглаживания: alpha = 2 / (SPAN_DAYS + 1)
+HISTORY_DAYS = 90     # сколько дней истории учитывать при первом расчёте
+LEAD_DAYS = 2         # дней от заказа до поставки
+TARGET_DAYS = 7       # на сколько дней закупать
+SERVICE_Z = 1.65      # страховой запас на ~95% дней без дефицита
+
+ALPHA = 2 / (SPAN_DAYS + 1)
+
+Suggestion = namedtuple('Suggestion', ['product', 'daily_rate', 'available', 'days_of_cover',
+                                       'reorder_point', 'quantity'])
+
+
+def recipe_rows():
+    """{dish_id: {product_id: расход на порцию}}"""
+    rows = {}
+    for dish_id, product_id, amount in DishIngredient.objects.values_list('dish_id', 'product_id', 'base_quantity'):
+        row = rows.setdefault(dish_id, {})
+        row[product_id] = row.get(product_id, 0) + amount
+    return rows
+
+
+def daily_consumption(start, end):
+    """{день: {product_id: расход}} за дни start..end включительно"""
+    lower, upper = analytics.date_range(start, end)
+    recipes = recipe_rows()
+    consumption = {}
+    sales = DishSalesRollup.objects.filter(period=SalesRollup.PERIOD_DAY, bucket__gte=lower, bucket__lt=upper)
+    for bucket, dish_id, quantity in sales.values_list('bucket', 'dish_id', 'quantity').iterator():
+        day = consumption.setdefault(timezone.localtime(bucket).date(), {})
+        for product_id, amount in recipes.get(dish_id, {}).items():
+            day[product_id] = day.get(product_id, 0) + quantity * amount
+    return consumption
+
+
+def _fold(rate, variance, value):
+    """Один шаг экспоненциального среднего и дисперсии"""
+    delta = value - rate
+    rate += ALPHA * delta
+    variance = (1 - ALPHA) * (variance + ALPHA * delta * delta)
+    return rate, variance
+
+
+def refresh(through=None, rebuild=False):
+    """
+    Учесть в прогнозах все дни до through включительно (по умолчанию — вчера).
+    Возвращает (продуктов обновлено, дней учтено).
+    """
+    through = through or timezone.localdate() - timedelta(days=1)
+    first_day = through - timedelta(days=HISTORY_DAYS - 1)
+    with write_atomic():
+        if rebuild:
+            ProductForecast.objects.all().delete()
+        forecasts = {forecast.product_id: forecast for forecast in ProductForecast.objects.select_for_update()}
+        created = [
+            ProductForecast(product_id=product_id, last_day=first_day - timedelta(days=1))
+            for product_id in Product.objects.exclude(pk__in=list(forecasts)).values_list('pk', flat=True)
+        ]
+        forecasts.update((forecast.product_id, forecast) for forecast in created)
+        if not forecasts:
+            return 0, 0
+
+        start = min(forecast.last_day for forecast in forecasts.values()) + timedelta(days=1)
+        start = max(start, first_day)
+        if start > through:
+            ProductForecast.objects.bulk_create(created)
+            return 0, 0
+
+        consumption = daily_consumption(start, through)
+        now = timezone.now()
+        days = (through - start).days + 1
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            used = consumption.get(day, {})
+            for product_id, forecast in forecasts.items():
+                if forecast.last_day < day:
+                    forecast.daily_rate, forecast.variance = _fold(
+                        forecast.daily_rate, forecast.variance, used.get(product_id, 0))
+                    forecast.last_day = day
+                    forecast.updated_at = now
+
+        ProductForecast.objects.bulk_create(created, batch_size=500)
+        existing = [forecast for forecast in forecasts.values() if forecast.pk]
+        ProductForecast.objects.bulk_update(existing, ['daily_rate', 'variance', 'last_day', 'updated_at'],
+                                            batch_size=500)
+    return len(forecasts), days
+
+
+def suggest(product, forecast):
+    """Запас в днях и предлагаемая закупка для продукта по его прогнозу"""
+    available = product.available_quantity()
+    rate = forecast.daily_rate
+    safety = SERVICE_Z * math.sqrt(max(forecast.variance, 0) * LEAD_DAYS)
+    reorder_point = rate * LEAD_DAYS + safety
+    quantity = 0.0
+    if rate > 0 and available <= reorder_point:
+        quantity = rate * (LEAD_DAYS + TARGET_DAYS) + safety - available
+    return Suggestion(
+        product=product,
+        daily_rate=rate,
+        available=available,
+        days_of_cover=available / rate if rate > 0 else None,
+        reorder_point=reorder_point,
+        quantity=max(quantity, 0.0),
+    )
+
+
+def suggestions(only_reorder=False):
+    """Прогноз по всем продуктам, самые срочные сначала"""
+    result = [suggest(product, product.forecast) for product in Product.objects.select_related('forecast')
+              .filter(forecast__isnull=False)]
+    if only_reorder:
+        result = [suggestion for suggestion in result if suggestion.quantity > 0]
+    result.sort(key=lambda s: (s.days_of_cover is None, s.days_of_cover or 0, s.product.name))
+    return result
@@ -1,5 +1,6 @@
 from django import forms
 from .models import *
+from . import images, jobs
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 
 
@@ -83,6 +84,20 @@ class DishForm(forms.ModelForm):
             }),
         }
 
+    def save(self, commit=True):
+        image = self.cleaned_data.get('image')
+        image_uploaded = 'image' in self.changed_data and bool(image)
+        if image_uploaded:
+            # Храним оригинал под хэшем содержимого, одинаковые файлы — один раз
+            self.instance.image = images.store_original(image)
+        if 'image' in self.changed_data:
+            self.instance.image_widths = []
+        dish = super().save(commit)
+        if commit and image_uploaded:
+            # Уменьшенные копии готовит обработчик фоновых задач
+            jobs.enqueue('dish.process_image', priority=Job.PRIORITY_HIGH, dish_id=dish.pk)
+        return dish
+
 class DishIngredientForm(forms.ModelForm):
     class Meta:
         model = DishIngredient
@@ -103,11 +118,10 @@ DishIngredientFormSet = forms.inlineformset_factory(
 class TableForm(forms.ModelForm):
     class Meta:
         model = Table
-        fields = ['number', 'seats', 'is_occupied']
+        fields = ['number', 'seats']
         widgets = {
             'number': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Номер стола'}),
             'seats': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Количество мест'}),
-            'is_occupied': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
     
     def clean_number(self):
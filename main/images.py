@@ -0,0 +1,85 @@
+"""
+Обработка изображений блюд.
+
+Оригинал сохраняется под именем из SHA-256 содержимого (одинаковые файлы
+хранятся один раз), рядом создаются уменьшенные варианты в WebP и JPEG для
+`srcset`: dishes/<hash>.<ext> -> dishes/variants/<hash>-<ширина>.<webp|jpg>.
+"""
+import hashlib
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+UPLOAD_DIR = 'dishes'
+VARIANTS_DIR = 'dishes/variants'
+VARIANT_WIDTHS = (320, 640, 960)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hashed_name(data, original_name):
+    ext = os.path.splitext(original_name)[1].lower() or '.jpg'
+    return f"{UPLOAD_DIR}/{content_hash(data)}{ext}"
+
+
+def store_original(file):
+    """Сохраняет загруженный файл без дублей и возвращает имя в хранилище"""
+    file.seek(0)
+    data = file.read()
+    name = hashed_name(data, file.name)
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    return name
+
+
+def variant_name(name, width, ext):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return f"{VARIANTS_DIR}/{stem}-{width}.{ext}"
+
+
+def _encode(image, ext):
+    pil_format, options = FORMATS[ext]
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG без прозрачности: кладём на белый фон
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def generate_variants(name):
+    """Создаёт недостающие варианты; возвращает список ширин, доступных для srcset"""
+    with default_storage.open(name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'P') else 'RGB')
+
+    widths = [width for width in VARIANT_WIDTHS if width < image.width] or [image.width]
+    for width in widths:
+        resized = None
+        for ext in FORMATS:
+            target = variant_name(name, width, ext)
+            if default_storage.exists(target):
+                continue
+            if resized is None:
+                height = round(image.height * width / image.width)
+                resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+            default_storage.save(target, ContentFile(_encode(resized, ext)))
+    return widths
+
+
+def srcset(name, widths, ext):
+    return ', '.join(f"{default_storage.url(variant_name(name, width, ext))} {width}w" for width in widths)
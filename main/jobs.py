@@ -0,0 +1,152 @@
+"""
+Фоновые задачи на таблице Job, без внешнего брокера.
+
+View ставит задачу через enqueue() и сразу отвечает; задача записывается в той
+же транзакции, что и остальные изменения, и видна обработчику только после
+коммита. Обработчик (`python manage.py run_jobs`) забирает задачи пачками по
+приоритету: на PostgreSQL через SELECT ... FOR UPDATE SKIP LOCKED, на SQLite —
+условным UPDATE (запись в SQLite и так идёт по одной транзакции за раз).
+Упавшая задача повторяется с экспоненциальной задержкой до max_attempts раз;
+задачи, зависшие в статусе running (обработчик умер), возвращаются в очередь.
+"""
+import logging
+import os
+import socket
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from . import analytics, forecast, ledger
+from .db import write_atomic
+from .models import Dish, Job
+
+logger = logging.getLogger('main.jobs')
+
+CLAIM_BATCH_SIZE = 10
+RETRY_DELAY = 30               # секунды до первого повтора, дальше удваивается
+STALE_AFTER = timedelta(minutes=15)
+
+TASKS = {}
+
+
+def task(name):
+    """Зарегистрировать функцию как задачу: аргументы — ключи payload"""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, priority=Job.PRIORITY_NORMAL, delay=None, max_attempts=3, **payload):
+    """Поставить задачу в очередь; возвращает Job"""
+    if name not in TASKS:
+        raise ValueError(f'Неизвестная задача: {name}')
+    return Job.objects.create(
+        name=name, payload=payload, priority=priority, max_attempts=max_attempts,
+        run_after=timezone.now() + (delay or timedelta()),
+    )
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def claim(worker, limit=CLAIM_BATCH_SIZE):
+    """Забрать до limit готовых задач для обработчика worker"""
+    now = timezone.now()
+    ready = (Job.objects.filter(status=Job.PENDING, run_after__lte=now)
+             .order_by('-priority', 'run_after', 'id'))
+    with write_atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(ready.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+        else:
+            ids = list(ready.values_list('pk', flat=True)[:limit])
+        if not ids:
+            return []
+        # Условие по статусу: задачу, которую уже взял другой обработчик, не трогаем
+        Job.objects.filter(pk__in=ids, status=Job.PENDING).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+        )
+        return list(Job.objects.filter(pk__in=ids, status=Job.RUNNING, locked_by=worker)
+                    .order_by('-priority', 'run_after', 'id'))
+
+
+def run(job):
+    """Выполнить взятую задачу и записать результат; возвращает True при успехе"""
+    try:
+        result = TASKS[job.name](**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Задача %s #%s упала (попытка %s): %s', job.name, job.pk, job.attempts, error)
+        update = {'last_error': error, 'locked_by': '', 'locked_at': None}
+        if job.attempts < job.max_attempts:
+            delay = timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+            update.update(status=Job.PENDING, run_after=timezone.now() + delay)
+        else:
+            update.update(status=Job.FAILED, finished_at=timezone.now())
+        Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(**update)
+        return False
+
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status=Job.DONE, result=result, last_error='', finished_at=timezone.now(),
+    )
+    return True
+
+
+def work(worker, limit=CLAIM_BATCH_SIZE):
+    """Одна итерация обработчика; возвращает (выполнено, упало)"""
+    done = failed = 0
+    for job in claim(worker, limit):
+        if run(job):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+def requeue_stale(older_than=STALE_AFTER):
+    """Вернуть в очередь задачи, которые слишком долго висят в running"""
+    return Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - older_than).update(
+        status=Job.PENDING, locked_by='', locked_at=None,
+    )
+
+
+def prune(older_than=timedelta(days=7)):
+    """Удалить выполненные задачи старше older_than; возвращает количество"""
+    deleted, _ = Job.objects.filter(status=Job.DONE, finished_at__lt=timezone.now() - older_than).delete()
+    return deleted
+
+
+@task('dish.process_image')
+def process_dish_image(dish_id):
+    dish = Dish.objects.filter(pk=dish_id).only('image', 'image_widths').first()
+    if dish is None:
+        return None
+    dish.process_image()
+    return {'widths': dish.image_widths}
+
+
+@task('dish.refresh_costs')
+def refresh_dish_costs():
+    return {'dishes': Dish.objects.all().refresh_costs()}
+
+
+@task('stock.snapshot')
+def snapshot_stock():
+    return {'products': ledger.take_snapshot()}
+
+
+@task('stock.forecast')
+def refresh_forecasts():
+    products, days = forecast.refresh()
+    return {'products': products, 'days': days}
+
+
+@task('sales.rebuild')
+def rebuild_sales():
+    orders, dishes = analytics.rebuild()
+    return {'orders': orders, 'dishes': dishes}
@@ -0,0 +1,135 @@
+"""
+Журнал движения склада и снимки остатков.
+
+Каждая складская операция дописывает строки StockMovement одним bulk INSERT
+в той же транзакции, что и условный UPDATE продукта (он остаётся проверкой
+"хватает ли остатка"). Снимки StockSnapshot фиксируют остатки на последнее
+движение; остаток на любой момент = последний снимок до него + сумма
+движений после снимка.
+"""
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .db import write_atomic
+from .models import Product, StockMovement, StockSnapshot
+
+# Знаки изменений (остаток, резерв) для операций над технологической картой
+DELTAS = {
+    StockMovement.RECEIPT: (1, 0),
+    StockMovement.DEDUCTION: (-1, 0),
+    StockMovement.RESERVE: (0, 1),
+    StockMovement.RELEASE: (0, -1),
+    StockMovement.COMMIT: (-1, -1),
+}
+
+# Расхождение журнала и остатков продукта, которое считаем ошибкой округления
+TOLERANCE = 1e-6
+
+
+def record(kind, changes):
+    """Дописать движения: changes — {product_id: (изменение остатка, изменение резерва)}"""
+    now = timezone.now()
+    movements = [
+        StockMovement(product_id=product_id, kind=kind, quantity_delta=quantity, reserved_delta=reserved,
+                      created_at=now)
+        for product_id, (quantity, reserved) in sorted(changes.items())
+        if quantity or reserved
+    ]
+    StockMovement.objects.bulk_create(movements)
+    return movements
+
+
+def record_bom(kind, bom):
+    """Дописать движения для карты product_id -> количество по знакам операции"""
+    quantity_sign, reserved_sign = DELTAS[kind]
+    return record(kind, {
+        product_id: (quantity_sign * amount, reserved_sign * amount)
+        for product_id, amount in bom.items()
+    })
+
+
+def _latest_snapshots(product_ids, moment=None):
+    """{product_id: последний снимок не позже moment}"""
+    snapshots = StockSnapshot.objects.all()
+    if product_ids is not None:
+        snapshots = snapshots.filter(product_id__in=product_ids)
+    if moment is not None:
+        snapshots = snapshots.filter(taken_at__lte=moment)
+    latest = {}
+    for snapshot in snapshots.order_by('product_id', '-taken_at', '-movement_id'):
+        latest.setdefault(snapshot.product_id, snapshot)
+    return latest
+
+
+def balances(product_ids=None, moment=None, until_movement=None):
+    """
+    Остатки по журналу: {product_id: (остаток, резерв)} на момент moment
+    (по умолчанию — текущие) или до движения until_movement включительно.
+    """
+    if product_ids is None:
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+    snapshots = _latest_snapshots(product_ids, moment)
+    result = {}
+    since = {}
+    for product_id in product_ids:
+        snapshot = snapshots.get(product_id)
+        if snapshot:
+            result[product_id] = (snapshot.quantity, snapshot.reserved_quantity)
+            since[product_id] = snapshot.movement_id
+        else:
+            result[product_id] = (0.0, 0.0)
+            since[product_id] = 0
+
+    # Один агрегат по движениям после самого раннего из снимков; лишнее отсекаем ниже
+    movements = StockMovement.objects.filter(product_id__in=product_ids, id__gt=min(since.values(), default=0))
+    if moment is not None:
+        movements = movements.filter(created_at__lte=moment)
+    if until_movement is not None:
+        movements = movements.filter(id__lte=until_movement)
+    if len(set(since.values())) > 1:
+        rows = movements.values_list('product_id', 'id', 'quantity_delta', 'reserved_delta')
+        for product_id, movement_id, quantity, reserved in rows.iterator():
+            if movement_id > since[product_id]:
+                current_quantity, current_reserved = result[product_id]
+                result[product_id] = (current_quantity + quantity, current_reserved + reserved)
+    else:
+        sums = movements.values('product_id').annotate(quantity=Sum('quantity_delta'), reserved=Sum('reserved_delta'))
+        for row in sums:
+            current_quantity, current_reserved = result[row['product_id']]
+            result[row['product_id']] = (current_quantity + row['quantity'], current_reserved + row['reserved'])
+    return result
+
+
+def balance_as_of(product_id, moment):
+    """(остаток, резерв) одного продукта на момент moment"""
+    return balances([product_id], moment)[product_id]
+
+
+def take_snapshot():
+    """Снимок остатков всех продуктов по журналу; возвращает число снимков"""
+    with write_atomic():
+        # Движение пишется в транзакции, которая меняет строку продукта. Блокировка всех
+        # продуктов дожидается коммита таких транзакций, поэтому все движения до водяного
+        # знака уже видны: при READ COMMITTED движение с меньшим id не закоммитится позже
+        product_ids = list(Product.objects.select_for_update().order_by('pk').values_list('pk', flat=True))
+        last_movement = StockMovement.objects.aggregate(last=Max('id'))['last'] or 0
+        taken_at = timezone.now()
+        current = balances(product_ids, until_movement=last_movement)
+        StockSnapshot.objects.bulk_create([
+            StockSnapshot(product_id=product_id, movement_id=last_movement, taken_at=taken_at,
+                          quantity=quantity, reserved_quantity=reserved)
+            for product_id, (quantity, reserved) in current.items()
+        ])
+    return len(current)
+
+
+def discrepancies():
+    """Продукты, у которых остатки в таблице расходятся с журналом"""
+    current = balances()
+    report = []
+    for product_id, name, quantity, reserved in Product.objects.values_list(
+            'pk', 'name', 'quantity', 'reserved_quantity'):
+        ledger_quantity, ledger_reserved = current.get(product_id, (0.0, 0.0))
+        if abs(ledger_quantity - quantity) > TOLERANCE or abs(ledger_reserved - reserved) > TOLERANCE:
+            report.append((product_id, name, quantity - ledger_quantity, reserved - ledger_reserved))
+    return report
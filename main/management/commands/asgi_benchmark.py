@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.middleware.csrf import CSRF_SECRET_LENGTH, _get_new_csrf_string
+from django.test import Client
+from django.urls import reverse
+
+from main import benchmarks
+from main.models import Dish, Table, User
+
+BENCH_USER = '__bench__asgi'
+
+
+class Command(BaseCommand):
+    help = ('Сравнение WSGI (синхронные view, N потоков) и ASGI (async view, один цикл событий) '
+            'при одинаковом числе рабочих потоков и одной и той же смеси запросов: панель, '
+            'список заказов, стол, добавление блюда, заготовка порций. Каждый режим '
+            'запускается в отдельном процессе. Запускайте на отдельной базе (CAFE_DB_NAME).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=['wsgi', 'asgi'], help='Прогнать только один режим (JSON)')
+        parser.add_argument('--workers', type=int, default=4, help='Рабочих потоков на процесс')
+        parser.add_argument('--clients', type=int, default=32, help='Одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=20, help='Запросов на клиента')
+        parser.add_argument('--dishes', type=int, default=100)
+        parser.add_argument('--orders', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['server']:
+            result = run(options['server'], options)
+            self.stdout.write(json.dumps(result))
+            return
+
+        benchmarks.cleanup()
+        benchmarks.seed(dishes=options['dishes'], orders=options['orders'], tables=options['clients'])
+        try:
+            results = {server: self.spawn(server, options) for server in ('wsgi', 'asgi')}
+        finally:
+            benchmarks.cleanup()
+            User.objects.filter(username=BENCH_USER).delete()
+
+        self.stdout.write(f"Потоков: {options['workers']}, клиентов: {options['clients']}, "
+                          f"запросов на клиента: {options['requests']}")
+        for server, result in results.items():
+            self.stdout.write(f"{server.upper()}: {result['throughput']:.1f} запр/с, "
+                              f"ошибок: {result['errors']}, время: {result['elapsed']:.2f} с")
+            for name, summary in sorted(result['views'].items()):
+                self.stdout.write('  ' + benchmarks.format_summary(name, summary))
+        gain = results['asgi']['throughput'] / results['wsgi']['throughput'] if results['wsgi']['throughput'] else 0
+        self.stdout.write(self.style.SUCCESS(f'ASGI / WSGI по пропускной способности: {gain:.2f}x'))
+
+    def spawn(self, server, options):
+        env = dict(os.environ, CAFE_ASYNC_VIEWS='1' if server == 'asgi' else '0')
+        command = [sys.executable, sys.argv[0], 'asgi_benchmark', '--server', server]
+        for option in ('workers', 'clients', 'requests'):
+            command += [f'--{option}', str(options[option])]
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+
+def _session(user):
+    client = Client(SERVER_NAME=benchmarks._host())
+    client.force_login(user)
+    return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+
+def _requests(client, table_id, dish_ids, count):
+    """Смесь запросов одного клиента: (имя, метод, путь, тело формы)"""
+    table_url = reverse('table_order', args=[table_id])
+    cycle = [
+        ('table_order.open', 'GET', table_url, None),
+        ('table_order.add_item', 'POST', table_url, {'action': 'add_item', 'quantity': 1}),
+        ('orders_list', 'GET', reverse('orders'), None),
+        ('index', 'GET', reverse('index'), None),
+        ('add_portions', 'POST', None, {'portions': 1}),
+    ]
+    for i in range(count):
+        name, method, path, form = cycle[i % len(cycle)]
+        dish_id = dish_ids[(client + i) % len(dish_ids)]
+        if name == 'table_order.add_item':
+            form = dict(form, dish_id=dish_id)
+        if name == 'add_portions':
+            path = reverse('add_portions', args=[dish_id])
+        yield name, method, path, urlencode(form).encode() if form else b''
+
+
+def _headers(session_key, csrf_token, body):
+    cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}; {settings.CSRF_COOKIE_NAME}={csrf_token}'
+    headers = [(b'host', benchmarks._host().encode()), (b'cookie', cookie.encode()),
+               (b'x-csrftoken', csrf_token.encode())]
+    if body:
+        headers += [(b'content-type', b'application/x-www-form-urlencoded'),
+                    (b'content-length', str(len(body)).encode())]
+    return headers
+
+
+def run(server, options):
+    user, _ = User.objects.get_or_create(username=BENCH_USER, defaults={'email': 'bench-asgi@example.com'})
+    session_key = _session(user)
+    csrf_token = _get_new_csrf_string()
+    assert len(csrf_token) == CSRF_SECRET_LENGTH
+    dish_ids = list(Dish.objects.filter(name__startswith=benchmarks.BENCH_PREFIX).values_list('pk', flat=True))
+    table_ids = list(Table.objects.filter(number__gte=benchmarks.BENCH_TABLE_BASE)
+                     .order_by('number').values_list('pk', flat=True))
+    connections.close_all()
+
+    plans = [list(_requests(client, table_ids[client % len(table_ids)], dish_ids, options['requests']))
+             for client in range(options['clients'])]
+    latencies, errors = {}, []
+    lock = threading.Lock()
+
+    def record(name, started, status):
+        with lock:
+            latencies.setdefault(name, []).append(time.perf_counter() - started)
+            if status >= 400:
+                errors.append(f'{name}: {status}')
+
+    started = time.perf_counter()
+    if server == 'wsgi':
+        _run_wsgi(plans, options['workers'], session_key, csrf_token, record)
+    else:
+        asyncio.run(_run_asgi(plans, options['workers'], session_key, csrf_token, record))
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        'elapsed': elapsed,
+        'throughput': total / elapsed if elapsed else 0.0,
+        'errors': len(errors),
+        'views': {name: benchmarks.summarize(values, elapsed) for name, values in latencies.items()},
+    }
+
+
+def _run_wsgi(plans, workers, session_key, csrf_token, record):
+    """WSGI-сервер с пулом из `workers` потоков; клиенты ждут в очереди, как у gunicorn gthread"""
+    handler = WSGIHandler()
+
+    def call(method, path, body):
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+            'SERVER_NAME': benchmarks._host(), 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.input': BytesIO(body), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+            'CONTENT_LENGTH': str(len(body)),
+        }
+        for name, value in _headers(session_key, csrf_token, body):
+            key = name.decode().upper().replace('-', '_')
+            environ[key if key in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{key}'] = value.decode()
+        status = []
+        response = handler(environ, lambda code, headers, exc_info=None: status.append(code))
+        b''.join(response)
+        response.close()
+        return int(status[0].split()[0])
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+
+    def client(plan):
+        for name, method, path, body in plan:
+            started = time.perf_counter()
+            record(name, started, pool.submit(call, method, path, body).result())
+
+    threads = [threading.Thread(target=client, args=(plan,)) for plan in plans]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.shutdown()
+
+
+async def _run_asgi(plans, workers, session_key, csrf_token, record):
+    """ASGI-сервер: один цикл событий, синхронные участки — в пуле из `workers` потоков"""
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+    handler = ASGIHandler()
+
+    async def call(method, path, body):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': method, 'path': path, 'raw_path': path.encode(), 'root_path': '',
+            'scheme': 'http', 'query_string': b'', 'headers': _headers(session_key, csrf_token, body),
+            'client': ('127.0.0.1', 0), 'server': (benchmarks._host(), 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()  # клиент не отключается
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await handler(scope, receive, send)
+        return status[0]
+
+    async def client(plan):
+        for name, method, path, body in plan:
+            started = time.perf_counter()
+            record(name, started, await call(method, path, body))
+
+    await asyncio.gather(*(client(plan) for plan in plans))
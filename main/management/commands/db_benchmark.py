@@ -0,0 +1,55 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from main.benchmarks import BENCH_PREFIX, format_summary, run_concurrently, summarize
+from main.models import Dish, Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = ('Замер БД под параллельной нагрузкой (создание заказов, строки, завершение, список). '
+            'Сравнение профилей: CAFE_DB=sqlite / CAFE_DB=postgres, CAFE_SQLITE_TUNING=1 (PRAGMA сервера). '
+            'Запускайте на отдельной базе (CAFE_DB_NAME).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные замером данные')
+
+    def handle(self, *args, **options):
+        dishes = [
+            Dish.objects.create(name=f'{BENCH_PREFIX}{i}', price=Decimal('10000'), portions=10 ** 9)
+            for i in range(5)
+        ]
+
+        def operation(worker, i):
+            if i % 4 == 3:
+                list(Order.objects.with_subtotal().order_by('-created_at', '-id')[:50])
+                return 'orders_list'
+            order = Order.objects.create(order_type='takeaway', customer_name=BENCH_PREFIX)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, dish=dish, quantity=1 + (worker + i) % 3) for dish in dishes[:3]
+            ])
+            order.complete()
+            return 'order_cycle'
+
+        latencies, elapsed, errors = run_concurrently(operation, options['workers'], options['iterations'])
+
+        with connection.cursor() as cursor:
+            journal = None
+            if connection.vendor == 'sqlite':
+                cursor.execute('PRAGMA journal_mode')
+                journal = cursor.fetchone()[0]
+        self.stdout.write(f"Профиль: {settings.DB_PROFILE} ({connection.vendor}"
+                          f"{', journal_mode=' + journal if journal else ''}), "
+                          f"потоков: {options['workers']}, время: {elapsed:.2f} с")
+        for name, values in sorted(latencies.items()):
+            self.stdout.write(format_summary(name, summarize(values, elapsed)))
+        if errors:
+            self.stdout.write(self.style.WARNING(f'Ошибок: {len(errors)} (первая: {errors[0]!r})'))
+
+        if not options['keep']:
+            Order.objects.filter(customer_name=BENCH_PREFIX).delete()
+            Dish.objects.filter(name__startswith=BENCH_PREFIX).delete()
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main import exchange
+
+
+class Command(BaseCommand):
+    help = 'Импортирует продукты, блюда или рецепты из CSV / JSON Lines (обновляет по названию)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(exchange.IMPORTS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=exchange.FORMATS,
+                            help='По умолчанию — по расширению файла')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.lower().endswith(('.jsonl', '.json')) else 'csv')
+        try:
+            stream = open(path, 'rb')
+        except OSError as exc:
+            raise CommandError(str(exc))
+        with stream:
+            result = exchange.import_file(options['kind'], stream, fmt)
+        for line, error in result.errors:
+            self.stderr.write(f'Строка {line}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {result.created}, обновлено: {result.updated}, ошибок: {len(result.errors)}'))
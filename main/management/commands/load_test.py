@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from main import benchmarks
+from main.models import Dish, Table, User
+
+BENCH_USER = '__bench__waiter'
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный сценарий официанта через настоящие view: стол -> add_item xN -> '
+            'complete_order, список заказов, меню, заготовка порций. Печатает p50/p95/p99, '
+            'пропускную способность и максимум SQL-запросов против бюджета. '
+            'Запускайте на отдельной базе (CAFE_DB_NAME).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dishes', type=int, default=300)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--cycles', type=int, default=10, help='Циклов сценария на официанта')
+        parser.add_argument('--items', type=int, default=4, help='Блюд в одном заказе')
+        parser.add_argument('--no-seed', action='store_true', help='Использовать уже засеянные данные')
+        parser.add_argument('--keep', action='store_true', help='Не удалять данные замера')
+
+    def handle(self, *args, **options):
+        if not options['no_seed']:
+            benchmarks.cleanup()
+            summary = benchmarks.seed(dishes=options['dishes'], orders=options['orders'],
+                                      tables=max(30, options['workers']))
+            self.stdout.write(f"Данные: {summary}")
+
+        user, _ = User.objects.get_or_create(username=BENCH_USER, defaults={'email': 'bench@example.com'})
+        dish_ids = list(Dish.objects.filter(name__startswith=benchmarks.BENCH_PREFIX).values_list('pk', flat=True))
+        table_ids = list(Table.objects.filter(number__gte=benchmarks.BENCH_TABLE_BASE)
+                         .order_by('number').values_list('pk', flat=True))
+        waiters = [
+            benchmarks.Waiter(user, table_ids[number], dish_ids, items=options['items'], seed_value=number)
+            for number in range(options['workers'])
+        ]
+        connection.close()
+
+        steps = len(waiters[0].steps) * options['cycles']
+        latencies, elapsed, errors = benchmarks.run_concurrently(
+            lambda worker, i: waiters[worker].step(), options['workers'], steps)
+
+        self.stdout.write(f"Официантов: {options['workers']}, циклов: {options['cycles']}, время: {elapsed:.2f} с")
+        for name, values in sorted(latencies.items()):
+            self.stdout.write(benchmarks.format_summary(name, benchmarks.summarize(values, elapsed)))
+
+        over_budget = False
+        for name, budget in benchmarks.QUERY_BUDGETS.items():
+            used = max(waiter.queries.get(name, 0) for waiter in waiters)
+            line = f"{name:<28} SQL: {used} (бюджет {budget})"
+            if used > budget:
+                over_budget = True
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if errors:
+            self.stdout.write(self.style.WARNING(f'Ошибок: {len(errors)} (первая: {errors[0]!r})'))
+
+        if not options['keep']:
+            benchmarks.cleanup()
+            User.objects.filter(username=BENCH_USER).delete()
+        if over_budget:
+            raise SystemExit(1)
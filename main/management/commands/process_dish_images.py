@@ -0,0 +1,46 @@
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from main import images
+from main.models import Dish
+
+
+class Command(BaseCommand):
+    help = 'Переносит изображения блюд в хранилище по хэшу и создаёт уменьшенные WebP/JPEG копии'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-originals', action='store_true',
+                            help='Удалить старые файлы, на которые больше не ссылается ни одно блюдо')
+
+    def handle(self, *args, **options):
+        replaced = set()
+        processed = 0
+        for dish in Dish.objects.exclude(image='').exclude(image__isnull=True).only('image', 'image_widths'):
+            old_name = dish.image.name
+            if not default_storage.exists(old_name):
+                self.stderr.write(f'Файл не найден: {old_name} (блюдо #{dish.pk})')
+                continue
+
+            with default_storage.open(old_name, 'rb') as source:
+                data = source.read()
+            name = images.hashed_name(data, old_name)
+            if name != old_name:
+                if not default_storage.exists(name):
+                    default_storage.save(name, ContentFile(data))
+                Dish.objects.filter(pk=dish.pk).update(image=name)
+                dish.image = name
+                replaced.add(old_name)
+
+            dish.process_image()
+            processed += 1
+
+        deleted = 0
+        if options['delete_originals']:
+            in_use = set(Dish.objects.filter(image__in=replaced).values_list('image', flat=True))
+            for old_name in replaced - in_use:
+                default_storage.delete(old_name)
+                deleted += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано блюд: {processed}, перенесено файлов: {len(replaced)}, удалено: {deleted}'))
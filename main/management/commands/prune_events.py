@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from main import events
+
+
+class Command(BaseCommand):
+    help = 'Удаляет старые события push-канала'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Хранить события за последние N часов')
+
+    def handle(self, *args, **options):
+        deleted = events.prune(timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f'Удалено событий: {deleted}'))
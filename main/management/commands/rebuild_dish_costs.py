@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Dish
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает себестоимость и маржу всех блюд'
+
+    def handle(self, *args, **options):
+        updated = Dish.objects.all().refresh_costs()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано блюд: {updated}'))
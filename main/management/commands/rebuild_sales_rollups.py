@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main import analytics
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает сводные таблицы продаж из истории заказов'
+
+    def handle(self, *args, **options):
+        orders, dishes = analytics.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Строк по заказам: {orders}, по блюдам: {dishes}'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковые индексы блюд и продуктов'
+
+    def handle(self, *args, **options):
+        rebuilt = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Перестроены индексы: {', '.join(rebuilt) or 'нет'}"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main import forecast
+
+
+class Command(BaseCommand):
+    help = 'Досчитывает прогноз расхода продуктов по продажам за прошедшие дни (запускать раз в сутки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help=f'Пересчитать с нуля за последние {forecast.HISTORY_DAYS} дней')
+
+    def handle(self, *args, **options):
+        products, days = forecast.refresh(rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f'Обновлено продуктов: {products}, учтено дней: {days}'))
@@ -0,0 +1,38 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from main import jobs
+
+
+class Command(BaseCommand):
+    help = 'Обработчик фоновых задач: забирает задачи из очереди пачками и выполняет их'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и выйти')
+        parser.add_argument('--batch', type=int, default=jobs.CLAIM_BATCH_SIZE, help='Задач за одну выборку')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Пауза при пустой очереди, секунды')
+        parser.add_argument('--keep-days', type=int, default=7, help='Хранить выполненные задачи N дней')
+
+    def handle(self, *args, **options):
+        worker = jobs.worker_name()
+        total_done = total_failed = 0
+        self.stdout.write(f'Обработчик {worker} запущен')
+        jobs.prune(timedelta(days=options['keep_days']))
+        try:
+            while True:
+                close_old_connections()
+                jobs.requeue_stale()
+                done, failed = jobs.work(worker, options['batch'])
+                total_done += done
+                total_failed += failed
+                if done or failed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {total_done}, с ошибкой: {total_failed}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from main import ledger
+
+
+class Command(BaseCommand):
+    help = 'Снимок складских остатков по журналу движений и проверка расхождений'
+
+    def handle(self, *args, **options):
+        count = ledger.take_snapshot()
+        self.stdout.write(self.style.SUCCESS(f'Снимков остатков: {count}'))
+        for product_id, name, quantity_diff, reserved_diff in ledger.discrepancies():
+            self.stdout.write(self.style.WARNING(
+                f'{name} (#{product_id}): расхождение с журналом {quantity_diff:+g}, резерв {reserved_diff:+g}'))
@@ -0,0 +1,51 @@
+"""
+Версия меню для кэширования страниц и фрагментов.
+
+Версия — отметка времени последнего изменения блюд, рецептов, порций или
+складских остатков. Она входит в ключи фрагментного кэша и в ETag, а также
+служит Last-Modified для страницы меню.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'menu:version'
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = time.time()
+        cache.add(VERSION_KEY, version, timeout=None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def bump():
+    """Сменить версию после коммита текущей транзакции"""
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, time.time(), timeout=None))
+
+
+def last_modified(request, *args, **kwargs):
+    if len(messages.get_messages(request)):
+        return None
+    return datetime.fromtimestamp(int(get_version()), tz=dt_timezone.utc)
+
+
+def client_key(request):
+    """Ключ клиента: страница содержит CSRF-токен, привязанный к его cookie"""
+    secret = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    return hashlib.sha1(f"{user_id}:{secret}".encode()).hexdigest()[:16]
+
+
+def etag(request, *args, **kwargs):
+    # Непоказанные сообщения есть только в полной отрисовке — без ETag
+    if len(messages.get_messages(request)):
+        return None
+    return f"menu-{get_version()!r}-{client_key(request)}"
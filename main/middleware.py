@@ -0,0 +1,101 @@
+import json
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import performance
+
+logger = logging.getLogger('main.performance')
+
+
+class PerformanceMiddleware:
+    """
+    Замер каждого запроса: число и время SQL, время шаблонов, полная задержка.
+
+    Пишет структурированный лог (WARNING для медленных запросов и повторяющихся
+    SQL) и пополняет гистограммы по имени URL. Заголовок Server-Timing, как и
+    perf/, видят только персонал или все при DEBUG.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'PERF_SLOW_REQUEST_MS', 500)
+        self.repeat_threshold = getattr(settings, 'PERF_REPEATED_QUERY_THRESHOLD', 10)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = performance.RequestMetrics()
+        token = performance.current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            performance.current.reset(token)
+        self.finish(request, response, metrics, self.show_timing(getattr(request, 'user', None)))
+        return response
+
+    async def __acall__(self, request):
+        metrics = performance.RequestMetrics()
+        token = performance.current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            performance.current.reset(token)
+        user = None
+        if not settings.DEBUG and hasattr(request, 'auser'):
+            # request.user в async-контексте загрузил бы пользователя синхронно
+            user = await request.auser()
+        self.finish(request, response, metrics, self.show_timing(user))
+        return response
+
+    @staticmethod
+    def show_timing(user):
+        return settings.DEBUG or bool(user is not None and user.is_active and user.is_staff)
+
+    def finish(self, request, response, metrics, show_timing):
+        elapsed_ms = metrics.elapsed() * 1000
+        db_ms = metrics.db_time * 1000
+        template_ms = metrics.template_time * 1000
+        if show_timing:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={db_ms:.1f};desc="{metrics.queries} queries"',
+                f'tpl;dur={template_ms:.1f}',
+                f'total;dur={elapsed_ms:.1f}',
+            ])
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        performance.histograms.observe(view, elapsed_ms, metrics.queries, db_ms)
+
+        duplicates = metrics.duplicates()
+        repeated = metrics.repeated(self.repeat_threshold)
+        slow = elapsed_ms >= self.slow_ms
+        level = logging.WARNING if slow or duplicates or repeated else logging.INFO
+        if not logger.isEnabledFor(level):
+            return
+        record = {
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(elapsed_ms, 2),
+            'db_ms': round(db_ms, 2),
+            'queries': metrics.queries,
+            'template_ms': round(template_ms, 2),
+        }
+        if slow:
+            record['slow'] = True
+        if duplicates:
+            record['duplicate_queries'] = [
+                {'sql': sql[:300], 'count': count} for sql, count in duplicates[:5]
+            ]
+        if repeated:
+            record['repeated_queries'] = [
+                {'sql': sql[:300], 'count': count} for sql, count in repeated[:5]
+            ]
+        logger.log(level, json.dumps(record, ensure_ascii=False))
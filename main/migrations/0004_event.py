@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_product_reserved_quantity_alter_dish_portions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('order', 'Заказ'), ('table', 'Стол'), ('dish', 'Блюдо')], max_length=20)),
+                ('action', models.CharField(max_length=30)),
+                ('object_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='dish',
+            name='portions',
+            field=models.PositiveIntegerField(default=0, verbose_name='Доступные порции'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+# Коэффициенты заморожены на момент миграции (см. main/units.py)
+UNIT_FACTORS = {
+    'kg': ('mass', 1.0), 'g': ('mass', 0.001), 'pieces': ('mass', 0.1),
+    'liters': ('volume', 1.0), 'ml': ('volume', 0.001),
+}
+
+
+def fill_base_quantity(apps, schema_editor):
+    DishIngredient = apps.get_model('main', 'DishIngredient')
+    ingredients = list(DishIngredient.objects.select_related('product'))
+    for ingredient in ingredients:
+        source = UNIT_FACTORS.get(ingredient.unit)
+        target = UNIT_FACTORS.get(ingredient.product.unit)
+        rate = 1.0
+        if source and target and ingredient.unit != ingredient.product.unit and source[0] == target[0]:
+            rate = round(source[1] / target[1], 9)
+        ingredient.base_quantity = ingredient.quantity * rate
+    DishIngredient.objects.bulk_update(ingredients, ['base_quantity'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dishingredient',
+            name='base_quantity',
+            field=models.FloatField(default=0, editable=False, verbose_name='Количество в единицах продукта'),
+        ),
+        migrations.RunPython(fill_base_quantity, migrations.RunPython.noop),
+    ]
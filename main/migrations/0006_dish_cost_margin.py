@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:10
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_costs(apps, schema_editor):
+    Dish = apps.get_model('main', 'Dish')
+    DishIngredient = apps.get_model('main', 'DishIngredient')
+    ingredients_cost = (
+        DishIngredient.objects.filter(dish=OuterRef('pk'))
+        .values('dish')
+        .annotate(total=Sum(F('base_quantity') * F('product__purchase_price'),
+                            output_field=models.DecimalField(max_digits=12, decimal_places=2)))
+        .values('total')
+    )
+    cost = Coalesce(Subquery(ingredients_cost), Value(Decimal('0')),
+                    output_field=models.DecimalField(max_digits=12, decimal_places=2))
+    Dish.objects.update(cost=cost, margin=F('price') - cost)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_dishingredient_base_quantity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dish',
+            name='cost',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='Себестоимость'),
+        ),
+        migrations.AddField(
+            model_name='dish',
+            name='margin',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='Маржа'),
+        ),
+        migrations.RunPython(fill_costs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_dish_cost_margin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dish',
+            name='image_widths',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
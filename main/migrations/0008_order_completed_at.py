@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:15
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_completed_at(apps, schema_editor):
+    # Для старых заказов точное время завершения неизвестно — берём время создания
+    Order = apps.get_model('main', 'Order')
+    Order.objects.filter(is_completed=True, completed_at__isnull=True).update(completed_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_dish_image_widths'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_completed_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:16
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def deduplicate(apps, schema_editor):
+    """Подготовка данных к уникальным ограничениям"""
+    Order = apps.get_model('main', 'Order')
+    OrderItem = apps.get_model('main', 'OrderItem')
+
+    # Повторяющиеся строки одного блюда в заказе сливаем в первую
+    duplicates = (OrderItem.objects.values('order_id', 'dish_id')
+                  .annotate(lines=Count('id'), first_id=Min('id'), total=Sum('quantity'))
+                  .filter(lines__gt=1))
+    for row in duplicates:
+        OrderItem.objects.filter(pk=row['first_id']).update(quantity=row['total'])
+        OrderItem.objects.filter(order_id=row['order_id'], dish_id=row['dish_id']).exclude(
+            pk=row['first_id']).delete()
+
+    # Лишние открытые заказы стола (кроме самого раннего) отвязываем от стола, не удаляя
+    tables = (Order.objects.filter(is_completed=False, table__isnull=False)
+              .values('table_id').annotate(orders=Count('id'), first_id=Min('id'))
+              .filter(orders__gt=1))
+    for row in tables:
+        Order.objects.filter(table_id=row['table_id'], is_completed=False).exclude(
+            pk=row['first_id']).update(table=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_order_completed_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-created_at', '-id'], name='order_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['is_completed', '-created_at', '-id'], name='order_status_history_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_completed', False)), fields=('table',), name='one_open_order_per_table'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'dish'), name='one_line_per_dish'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Час'), ('day', 'День')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('order_type', models.CharField(choices=[('dine_in', 'В зале'), ('takeaway', 'Навынос'), ('delivery', 'Доставка')], max_length=20)),
+                ('table_number', models.PositiveIntegerField(default=0)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('items', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket', 'order_type', 'table_number'), name='sales_rollup_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DishSalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Час'), ('day', 'День')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('dish', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='main.dish')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket', 'dish'), name='dish_sales_rollup_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:21
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def opening_balances(apps, schema_editor):
+    # Текущие остатки становятся первой корректировкой журнала
+    Product = apps.get_model('main', 'Product')
+    StockMovement = apps.get_model('main', 'StockMovement')
+    now = django.utils.timezone.now()
+    StockMovement.objects.bulk_create([
+        StockMovement(product_id=product_id, kind='adjustment', quantity_delta=quantity,
+                      reserved_delta=reserved, created_at=now)
+        for product_id, quantity, reserved in Product.objects.values_list('pk', 'quantity', 'reserved_quantity')
+        if quantity or reserved
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Поступление'), ('deduction', 'Списание на заготовку'), ('reserve', 'Резерв'), ('release', 'Снятие резерва'), ('commit', 'Списание из резерва'), ('adjustment', 'Корректировка')], max_length=20)),
+                ('quantity_delta', models.FloatField(default=0)),
+                ('reserved_delta', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='main.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'id'], name='stock_movement_product_idx'), models.Index(fields=['created_at', 'id'], name='stock_movement_time_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_id', models.PositiveBigIntegerField()),
+                ('taken_at', models.DateTimeField()),
+                ('quantity', models.FloatField()),
+                ('reserved_quantity', models.FloatField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='main.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-taken_at'], name='stock_snapshot_product_idx')],
+            },
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('daily_rate', models.FloatField(default=0)),
+                ('variance', models.FloatField(default=0)),
+                ('last_day', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='forecast', to='main.product')),
+            ],
+        ),
+    ]
@@ -1,9 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.core.validators import MinValueValidator
 from decimal import Decimal
+from collections import namedtuple
 from django.core.validators import RegexValidator
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
+from django.core.files.storage import default_storage
+from . import menu_cache, units
+from .db import write_atomic
 
 # Create your models here.
 class User(AbstractUser):
@@ -29,6 +35,12 @@ class User(AbstractUser):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='waiter')
     date_joined = models.DateTimeField(auto_now_add=True)
 
+    def get_session_auth_hash(self):
+        # Пользователь из кэша аутентификации (main/auth.py) приходит без пароля,
+        # но с готовым хэшем сессии; после set_password хэш считается заново
+        if 'password' not in self.__dict__ and '_session_auth_hash' in self.__dict__:
+            return self._session_auth_hash
+        return super().get_session_auth_hash()
 
     def save(self, *args, **kwargs):
         if self.phone:
@@ -70,7 +82,37 @@ class User(AbstractUser):
         swappable = 'AUTH_USER_MODEL'
      
         
-class Product(models.Model):
+class LoadedValuesMixin:
+    """Запоминает загруженные из БД значения, чтобы save() видел изменённые поля"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def _field_changed(self, name):
+        loaded = getattr(self, '_loaded_values', {}).get(name, models.DEFERRED)
+        return loaded is not models.DEFERRED and loaded != getattr(self, name)
+
+    def _changed_fields(self):
+        """Изменённые поля; без данных о загрузке (или для незагруженного поля) — все заданные"""
+        loaded = getattr(self, '_loaded_values', {})
+        return [
+            field.attname for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname in self.__dict__
+            and (loaded.get(field.attname, models.DEFERRED) is models.DEFERRED
+                 or loaded[field.attname] != self.__dict__[field.attname])
+        ]
+
+    def _remember_loaded_values(self):
+        self._loaded_values = {
+            field.attname: self.__dict__.get(field.attname, models.DEFERRED)
+            for field in self._meta.concrete_fields
+        }
+
+
+class Product(LoadedValuesMixin, models.Model):
     name = models.CharField(max_length=100)
     unit = models.CharField(max_length=20, choices=[
         ('kg', 'кг'), ('liters', 'л'), ('pieces', 'шт'), ('g', 'г')
@@ -81,6 +123,46 @@ class Product(models.Model):
 
     def __str__(self):
         return f"{self.name} ({self.quantity} {self.unit})"
+
+    def save(self, *args, **kwargs):
+        from . import ledger
+        unit_changed = self._field_changed('unit')
+        price_changed = self._field_changed('purchase_price')
+        adding = self._state.adding
+        # Правка остатка из формы — это корректировка на разницу, а не перезапись:
+        # параллельные списания между открытием и отправкой формы не теряются
+        quantity_delta = 0
+        if self._field_changed('quantity'):
+            quantity_delta = self.quantity - self._loaded_values['quantity']
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = [field.attname for field in self._meta.concrete_fields
+                                           if not field.primary_key]
+            kwargs['update_fields'] = [name for name in kwargs['update_fields'] if name != 'quantity']
+
+        with write_atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                ledger.record(StockMovement.RECEIPT, {self.pk: (self.quantity, self.reserved_quantity)})
+            elif quantity_delta:
+                Product.objects.filter(pk=self.pk).update(quantity=F('quantity') + quantity_delta)
+                self.refresh_from_db(fields=['quantity'])
+                ledger.record(StockMovement.ADJUSTMENT, {self.pk: (quantity_delta, 0)})
+        if unit_changed:
+            # Пересчитываем базовые количества ингредиентов под новую единицу
+            for ingredient_unit in units.UNITS:
+                self.dishingredient_set.filter(unit=ingredient_unit).update(
+                    base_quantity=F('quantity') * units.rate(ingredient_unit, self.unit))
+        if unit_changed or price_changed:
+            Dish.objects.filter(pk__in=self.dishingredient_set.values('dish_id')).refresh_costs()
+        menu_cache.bump()
+        self._remember_loaded_values()
+
+    def delete(self, *args, **kwargs):
+        dish_ids = list(self.dishingredient_set.values_list('dish_id', flat=True))
+        result = super().delete(*args, **kwargs)
+        Dish.objects.filter(pk__in=dish_ids).refresh_costs()
+        menu_cache.bump()
+        return result
     
     def available_quantity(self):
         """Доступное количество (общее - зарезервированное)"""
@@ -88,65 +170,155 @@ class Product(models.Model):
     
     def reserve(self, amount):
         """Зарезервировать количество"""
-        if amount <= 0:
-            return True
-            
-        if self.available_quantity() >= amount:
-            self.reserved_quantity += amount
-            self.save()
-            return True
-        return False
+        from . import stock
+        result = stock.reserve({self.pk: amount})
+        self.refresh_from_db(fields=['quantity', 'reserved_quantity'])
+        return result.ok
     
     def release_reservation(self, amount):
         """Освободить резервирование"""
-        self.reserved_quantity = max(0, self.reserved_quantity - amount)
-        self.save()
+        from . import stock
+        stock.release({self.pk: amount})
+        self.refresh_from_db(fields=['quantity', 'reserved_quantity'])
     
     def commit_reservation(self, amount):
         """Подтвердить резервирование - списать продукты"""
-        if amount <= self.reserved_quantity:
-            self.quantity -= amount
-            self.reserved_quantity -= amount
-            self.save()
-            return True
-        return False
-
-class Dish(models.Model):
+        from . import stock
+        result = stock.commit({self.pk: amount})
+        self.refresh_from_db(fields=['quantity', 'reserved_quantity'])
+        return result.ok
+
+class DishQuerySet(models.QuerySet):
+    def refresh_costs(self):
+        """Пересчитать себестоимость и маржу выбранных блюд одним UPDATE"""
+        ingredients_cost = (
+            DishIngredient.objects.filter(dish=OuterRef('pk'))
+            .values('dish')
+            .annotate(total=Sum(F('base_quantity') * F('product__purchase_price'),
+                                output_field=DecimalField(max_digits=12, decimal_places=2)))
+            .values('total')
+        )
+        cost = Coalesce(Subquery(ingredients_cost), Value(Decimal('0')),
+                        output_field=DecimalField(max_digits=12, decimal_places=2))
+        return self.update(cost=cost, margin=F('price') - cost)
+
+
+class Dish(LoadedValuesMixin, models.Model):
     image = models.ImageField(upload_to='dishes/', blank=True, null=True)
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     portions = models.PositiveIntegerField(default=0, verbose_name='Доступные порции')
+    # Ширины готовых уменьшенных копий изображения (см. main/images.py)
+    image_widths = models.JSONField(default=list, blank=True, editable=False)
+    # Кэш себестоимости и маржи, обновляется при изменении цен и рецептов
+    cost = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False, verbose_name='Себестоимость')
+    margin = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False, db_index=True, verbose_name='Маржа')
+
+    objects = DishQuerySet.as_manager()
     
     def __str__(self):
         return f"{self.name} - {self.price} сум."
+
+    # Поля, которые меняют только условные UPDATE и пересчёт себестоимости:
+    # обычный save() устаревшего экземпляра не должен их перезаписывать
+    COMPUTED_FIELDS = ('portions', 'cost', 'margin')
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        portions_delta = 0
+        if not adding:
+            # Правка порций из формы — корректировка на разницу, как у остатка продукта
+            if self._field_changed('portions'):
+                portions_delta = self.portions - self._loaded_values['portions']
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = self._changed_fields()
+            kwargs['update_fields'] = [name for name in kwargs['update_fields'] if name not in self.COMPUTED_FIELDS]
+            if not (kwargs['update_fields'] or portions_delta):
+                return
+        price_changed = adding or 'price' in kwargs['update_fields']
+
+        with write_atomic():
+            super().save(*args, **kwargs)
+            if portions_delta:
+                Dish.objects.filter(pk=self.pk).update(portions=Greatest(F('portions') + portions_delta, 0))
+            if price_changed:
+                Dish.objects.filter(pk=self.pk).refresh_costs()
+        refresh = (['portions'] if portions_delta else []) + (['cost', 'margin'] if price_changed else [])
+        if refresh:
+            self.refresh_from_db(fields=refresh)
+        menu_cache.bump()
+        self._remember_loaded_values()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        menu_cache.bump()
+        return result
+
+    def process_image(self):
+        """Создать уменьшенные WebP/JPEG копии изображения и запомнить их ширины"""
+        from . import images
+        self.image_widths = images.generate_variants(self.image.name) if self.image else []
+        Dish.objects.filter(pk=self.pk).update(image_widths=self.image_widths)
+
+    def image_srcset(self):
+        from . import images
+        return images.srcset(self.image.name, self.image_widths, 'webp') if self.image_widths else ''
+
+    def image_jpeg_srcset(self):
+        from . import images
+        return images.srcset(self.image.name, self.image_widths, 'jpg') if self.image_widths else ''
+
+    def image_src(self):
+        """Самая маленькая JPEG-копия как запасной src, иначе оригинал"""
+        from . import images
+        if self.image_widths:
+            return default_storage.url(images.variant_name(self.image.name, self.image_widths[0], 'jpg'))
+        return self.image.url if self.image else ''
+
+    @property
+    def markup(self):
+        """Коэффициент наценки: цена / себестоимость"""
+        return self.price / self.cost if self.cost else 0
     
+    def bill_of_materials(self, portions=1):
+        """Потребность в продуктах на указанное число порций: {product_id: количество}"""
+        bom = {}
+        for product_id, base_quantity in self.ingredients.values_list('product_id', 'base_quantity'):
+            bom[product_id] = bom.get(product_id, 0) + base_quantity * portions
+        return bom
+
     def add_portions(self, quantity):
         """Добавить порции и списать продукты со склада"""
-        # Проверяем хватает ли продуктов
-        for ingredient in self.ingredients.all():
-            required_quantity = ingredient.get_quantity_in_product_units() * quantity
-            if ingredient.product.quantity < required_quantity:
-                return False, f"Недостаточно {ingredient.product.name}"
-        
-        # Списываем продукты
-        for ingredient in self.ingredients.all():
-            required_quantity = ingredient.get_quantity_in_product_units() * quantity
-            ingredient.product.quantity -= required_quantity
-            ingredient.product.save()
-        
-        # Добавляем порции
-        self.portions += quantity
-        self.save()
-        return True, "Успешно"
+        from . import stock
+        with write_atomic():
+            # Списываем все продукты одной транзакцией, по одному UPDATE на продукт
+            result = stock.deduct(self.bill_of_materials(quantity))
+            if not result.ok:
+                return False, result.message
+            
+            # Добавляем порции
+            Dish.objects.filter(pk=self.pk).update(portions=F('portions') + quantity)
+            menu_cache.bump()
+        self.refresh_from_db(fields=['portions'])
+        return True, result.message
     
+    def get_available_portions(self):
+        """Сколько порций можно приготовить из текущего склада (None — без ограничений)"""
+        from . import availability
+        return availability.producible_portions([self.pk])[self.pk]
+
+    def get_available_planned_portions(self):
+        """Уже приготовленные (запланированные) порции"""
+        return self.portions
+
     def use_portions(self, quantity):
         """Использовать порции для заказа"""
-        if self.portions >= quantity:
-            self.portions -= quantity
-            self.save()
-            return True
-        return False
+        updated = Dish.objects.filter(pk=self.pk, portions__gte=quantity).update(portions=F('portions') - quantity)
+        if updated:
+            self.refresh_from_db(fields=['portions'])
+            menu_cache.bump()
+        return bool(updated)
 
 class DishIngredient(models.Model):
     UNIT_CHOICES = [
@@ -157,27 +329,27 @@ class DishIngredient(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.FloatField(default=0)
     unit = models.CharField(max_length=20, choices=UNIT_CHOICES, default='g')
+    base_quantity = models.FloatField(default=0, editable=False, verbose_name='Количество в единицах продукта')
     
     def __str__(self):
         return f"{self.product.name} - {self.quantity} {self.get_unit_display()}"
     
     def get_quantity_in_product_units(self):
         """Конвертирует количество в единицы измерения продукта на складе"""
-        if self.unit == self.product.unit:
-            return self.quantity
-        
-        conversion_rates = {
-            ('kg', 'g'): 1000, ('g', 'kg'): 0.001,
-            ('liters', 'ml'): 1000, ('ml', 'liters'): 0.001,
-            ('pieces', 'kg'): 0.1, ('kg', 'pieces'): 10,
-            ('pieces', 'g'): 100, ('g', 'pieces'): 0.01,
-        }
-        
-        rate = conversion_rates.get((self.unit, self.product.unit))
-        if rate:
-            return self.quantity * rate
-        else:
-            return self.quantity
+        return units.convert(self.quantity, self.unit, self.product.unit)
+
+    def save(self, *args, **kwargs):
+        # Храним количество уже в единицах продукта, чтобы расчёты шли без конвертации
+        self.base_quantity = self.get_quantity_in_product_units()
+        super().save(*args, **kwargs)
+        Dish.objects.filter(pk=self.dish_id).refresh_costs()
+        menu_cache.bump()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        Dish.objects.filter(pk=self.dish_id).refresh_costs()
+        menu_cache.bump()
+        return result
 
 
 class Table(models.Model):
@@ -189,6 +361,20 @@ class Table(models.Model):
         return f"Стол {self.number}"
 
 
+PortionShortage = namedtuple('PortionShortage', ['dish_id', 'name', 'required', 'available'])
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_subtotal(self):
+        """Сумма заказа (quantity * dish.price) одним агрегатом на стороне БД"""
+        return self.annotate(subtotal=Coalesce(
+            Sum(F('order_items__quantity') * F('order_items__dish__price'),
+                output_field=DecimalField(max_digits=12, decimal_places=2)),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ))
+
+
 class Order(models.Model):
     ORDER_TYPES = [
         ('dine_in', 'В зале'),
@@ -204,12 +390,88 @@ class Order(models.Model):
     dishes = models.ManyToManyField(Dish, through='OrderItem')
     created_at = models.DateTimeField(auto_now_add=True)
     is_completed = models.BooleanField(default=False)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    def complete(self):
+        """
+        Завершить заказ одной транзакцией: списать порции условными UPDATE,
+        отметить заказ завершённым и освободить стол.
+
+        Возвращает (успех, список PortionShortage). Если заказ уже завершён,
+        возвращает (False, []).
+        """
+        from . import analytics, events, floor
+        failed = []
+        with write_atomic():
+            now = timezone.now()
+            if not Order.objects.filter(pk=self.pk, is_completed=False).update(is_completed=True, completed_at=now):
+                return False, []
+
+            # Строки читаются после отметки о завершении, в той же транзакции:
+            # изменённая в промежутке строка не пройдёт мимо списания и аналитики
+            lines = list(self.order_items.values_list('dish_id', 'quantity', 'dish__price'))
+            needed = {}
+            for dish_id, quantity, _ in lines:
+                needed[dish_id] = needed.get(dish_id, 0) + quantity
+
+            for dish_id, quantity in sorted(needed.items()):
+                if not Dish.objects.filter(pk=dish_id, portions__gte=quantity).update(
+                        portions=F('portions') - quantity):
+                    failed.append(dish_id)
+
+            if failed:
+                transaction.set_rollback(True)
+            else:
+                if self.table_id:
+                    floor.release(self.table_id)
+                analytics.record_order(self, lines, now)
+                portions = list(Dish.objects.filter(pk__in=needed).values_list('pk', 'portions'))
+
+        if failed:
+            return False, [
+                PortionShortage(dish_id, name, needed[dish_id], available)
+                for dish_id, name, available in
+                Dish.objects.filter(pk__in=failed).order_by('pk').values_list('pk', 'name', 'portions')
+            ]
+
+        self.is_completed, self.completed_at = True, now
+        menu_cache.bump()
+        events.publish_many('dish', 'portions_changed', [(dish_id, {'portions': left}) for dish_id, left in portions])
+        events.publish('order', 'completed', self.pk)
+        return True, []
+
+    class Meta:
+        indexes = [
+            # История заказов и список с фильтром по статусу — в порядке (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='order_history_idx'),
+            models.Index(fields=['is_completed', '-created_at', '-id'], name='order_status_history_idx'),
+        ]
+        constraints = [
+            # Один открытый заказ на стол; частичный индекс обслуживает и поиск открытого заказа
+            models.UniqueConstraint(fields=['table'], condition=models.Q(is_completed=False),
+                                    name='one_open_order_per_table'),
+        ]
     
     def total_price(self):
-        total = Decimal('0')
-        for item in self.order_items.all():
-            total += item.dish.price * item.quantity
-        return total
+        # Если сумма уже посчитана через with_subtotal(), не ходим в БД повторно
+        if hasattr(self, 'subtotal'):
+            total = self.subtotal
+        else:
+            total = self.order_items.aggregate(total=self._lines_total())['total']
+        return Decimal(total or 0).quantize(Decimal('0.01'))
+
+    async def atotal_price(self):
+        if hasattr(self, 'subtotal'):
+            total = self.subtotal
+        else:
+            total = (await self.order_items.aaggregate(total=self._lines_total()))['total']
+        return Decimal(total or 0).quantize(Decimal('0.01'))
+
+    @staticmethod
+    def _lines_total():
+        return Sum(F('quantity') * F('dish__price'), output_field=DecimalField(max_digits=12, decimal_places=2))
     
     def __str__(self):
         if self.table:
@@ -228,6 +490,207 @@ class OrderItem(models.Model):
     @property
     def total(self):
         return self.dish.price * self.quantity
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'dish'], name='one_line_per_dish'),
+        ]
     
     def __str__(self):
         return f"{self.dish.name} x{self.quantity}"
+
+
+class SalesRollup(models.Model):
+    """Продажи за час или день в разрезе типа заказа и стола (обновляются при завершении заказа)"""
+    PERIOD_HOUR = 'hour'
+    PERIOD_DAY = 'day'
+    PERIODS = [
+        (PERIOD_HOUR, 'Час'),
+        (PERIOD_DAY, 'День'),
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIODS)
+    bucket = models.DateTimeField()  # начало часа/дня по местному времени
+    order_type = models.CharField(max_length=20, choices=Order.ORDER_TYPES)
+    table_number = models.PositiveIntegerField(default=0)  # 0 — заказ без стола
+    orders = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'order_type', 'table_number'],
+                                    name='sales_rollup_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.bucket:%Y-%m-%d %H:%M} {self.order_type} #{self.table_number}"
+
+
+class DishSalesRollup(models.Model):
+    """Продажи блюда за час или день"""
+    period = models.CharField(max_length=4, choices=SalesRollup.PERIODS)
+    bucket = models.DateTimeField()
+    dish = models.ForeignKey(Dish, on_delete=models.CASCADE, related_name='sales_rollups')
+    orders = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'dish'], name='dish_sales_rollup_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.bucket:%Y-%m-%d %H:%M} {self.dish_id} x{self.quantity}"
+
+
+class StockMovement(models.Model):
+    """Журнал движения продуктов: только добавление, строки не изменяются"""
+    RECEIPT = 'receipt'
+    DEDUCTION = 'deduction'
+    RESERVE = 'reserve'
+    RELEASE = 'release'
+    COMMIT = 'commit'
+    ADJUSTMENT = 'adjustment'
+    KIND_CHOICES = [
+        (RECEIPT, 'Поступление'),
+        (DEDUCTION, 'Списание на заготовку'),
+        (RESERVE, 'Резерв'),
+        (RELEASE, 'Снятие резерва'),
+        (COMMIT, 'Списание из резерва'),
+        (ADJUSTMENT, 'Корректировка'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='movements')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity_delta = models.FloatField(default=0)
+    reserved_delta = models.FloatField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'id'], name='stock_movement_product_idx'),
+            models.Index(fields=['created_at', 'id'], name='stock_movement_time_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Движение склада нельзя изменить: добавьте корректировку')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.kind} {self.product_id}: {self.quantity_delta:+g} / {self.reserved_delta:+g}"
+
+
+class StockSnapshot(models.Model):
+    """Остатки продукта с учётом всех движений до movement_id включительно"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='snapshots')
+    movement_id = models.PositiveBigIntegerField()
+    taken_at = models.DateTimeField()
+    quantity = models.FloatField()
+    reserved_quantity = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-taken_at'], name='stock_snapshot_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} @ {self.taken_at:%Y-%m-%d %H:%M}: {self.quantity:g}"
+
+
+class ProductForecast(models.Model):
+    """Сглаженный дневной расход продукта по продажам блюд (см. main/forecast.py)"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='forecast')
+    daily_rate = models.FloatField(default=0)  # экспоненциальное среднее расхода в день
+    variance = models.FloatField(default=0)    # экспоненциальная дисперсия дневного расхода
+    last_day = models.DateField()              # последний учтённый день
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.product_id}: {self.daily_rate:g}/день до {self.last_day}"
+
+
+class Event(models.Model):
+    """Журнал изменений для push-канала; id служит курсором для клиентов"""
+    KIND_CHOICES = [
+        ('order', 'Заказ'),
+        ('table', 'Стол'),
+        ('dish', 'Блюдо'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    action = models.CharField(max_length=30)
+    object_id = models.PositiveBigIntegerField(null=True, blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'action': self.action,
+            'object_id': self.object_id,
+            'data': self.data,
+            'created_at': self.created_at.isoformat(),
+        }
+
+    def __str__(self):
+        return f"#{self.id} {self.kind}.{self.action} ({self.object_id})"
+
+
+class Job(models.Model):
+    """Фоновая задача (см. main/jobs.py); выполняется командой run_jobs"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    # Чем больше приоритет, тем раньше задачу возьмёт обработчик
+    PRIORITY_HIGH = 10
+    PRIORITY_NORMAL = 0
+    PRIORITY_LOW = -10
+
+    name = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=PRIORITY_NORMAL)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Выборка обработчиком: только задачи в очереди, по приоритету и времени
+            models.Index(fields=['-priority', 'run_after', 'id'], condition=Q(status='pending'),
+                         name='job_pending_idx'),
+            models.Index(fields=['status', 'locked_at'], name='job_status_idx'),
+        ]
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'attempts': self.attempts,
+            'result': self.result,
+            'error': self.last_error.strip().splitlines()[-1] if self.last_error else '',
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __str__(self):
+        return f"#{self.id} {self.name} ({self.status})"
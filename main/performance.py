@@ -0,0 +1,174 @@
+"""
+Метрики производительности запросов.
+
+Текущий замер хранится в contextvar, поэтому его видят и синхронный код, и
+потоки sync_to_async. SQL учитывается обёрткой execute_wrapper, которая ставится
+на каждое новое соединение (без замера она просто вызывает запрос), время
+шаблонов — бэкендом main.templating. Гистограммы копятся в памяти процесса и
+раз в PERF_FLUSH_INTERVAL секунд сбрасываются в кэш, где их сводит perf_stats.
+"""
+import contextvars
+import os
+import socket
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Границы корзин гистограммы задержек, мс
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+PROCESSES_KEY = 'perf:processes'
+PROCESS_KEY = f"perf:process:{socket.gethostname()}:{os.getpid()}"
+PROCESS_TTL = 3600
+
+# Управление транзакциями повторяется законно — в поиске дублей не участвует
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+current = contextvars.ContextVar('perf_request', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'queries', 'db_time', 'template_time', 'template_depth', 'statements', 'shapes')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()
+        self.shapes = Counter()
+
+    def duplicates(self):
+        """[(sql, сколько раз)] для запросов, выполненных больше одного раза с теми же параметрами"""
+        return [(sql, count) for (sql, _), count in self.statements.most_common() if count > 1]
+
+    def repeated(self, threshold):
+        """[(sql, сколько раз)] для одинаковых запросов с разными параметрами — признак N+1"""
+        return [(sql, count) for sql, count in self.shapes.most_common() if count >= threshold]
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper: считает запросы текущего замера"""
+    metrics = current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - started
+        metrics.queries += 1
+        if not many and not sql.startswith(TRANSACTION_STATEMENTS):
+            metrics.statements[sql, repr(params)] += 1
+            metrics.shapes[sql] += 1
+
+
+def install(sender, connection, **kwargs):
+    """connection_created: подключить обёртку к соединению один раз"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histograms:
+    """Гистограммы задержек по имени URL в памяти процесса"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.flushed = time.monotonic()
+
+    def observe(self, name, duration_ms, queries, db_ms):
+        with self.lock:
+            entry = self.data.get(name)
+            if entry is None:
+                entry = self.data[name] = {
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'queries': 0, 'db_ms': 0.0,
+                    'buckets': [0] * (len(BUCKETS) + 1),
+                }
+            entry['count'] += 1
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            entry['queries'] += queries
+            entry['db_ms'] += db_ms
+            entry['buckets'][_bucket(duration_ms)] += 1
+            due = time.monotonic() - self.flushed >= getattr(settings, 'PERF_FLUSH_INTERVAL', 10)
+            if due:
+                self.flushed = time.monotonic()
+                snapshot = {name: dict(entry, buckets=list(entry['buckets'])) for name, entry in self.data.items()}
+        if due:
+            flush(snapshot)
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(entry, buckets=list(entry['buckets'])) for name, entry in self.data.items()}
+
+
+def _bucket(duration_ms):
+    for index, bound in enumerate(BUCKETS):
+        if duration_ms <= bound:
+            return index
+    return len(BUCKETS)
+
+
+histograms = Histograms()
+
+
+def flush(snapshot):
+    """Записать гистограммы процесса в кэш и отметиться в списке процессов"""
+    cache.set(PROCESS_KEY, snapshot, PROCESS_TTL)
+    processes = cache.get(PROCESSES_KEY) or []
+    if PROCESS_KEY not in processes:
+        cache.set(PROCESSES_KEY, processes + [PROCESS_KEY], None)
+
+
+def collect():
+    """Сводные гистограммы всех процессов (текущий — из памяти)"""
+    snapshots = [histograms.snapshot()]
+    processes = [key for key in cache.get(PROCESSES_KEY) or [] if key != PROCESS_KEY]
+    stored = cache.get_many(processes)
+    snapshots.extend(stored.values())
+    if len(stored) != len(processes):
+        # Процессы, чьи данные истекли, убираем из списка
+        cache.set(PROCESSES_KEY, list(stored) + [PROCESS_KEY], None)
+
+    merged = {}
+    for snapshot in snapshots:
+        for name, entry in snapshot.items():
+            total = merged.setdefault(name, {
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'queries': 0, 'db_ms': 0.0,
+                'buckets': [0] * (len(BUCKETS) + 1),
+            })
+            for field in ('count', 'total_ms', 'queries', 'db_ms'):
+                total[field] += entry[field]
+            total['max_ms'] = max(total['max_ms'], entry['max_ms'])
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], entry['buckets'])]
+
+    for name, total in merged.items():
+        count = total['count'] or 1
+        total['avg_ms'] = round(total['total_ms'] / count, 2)
+        total['avg_queries'] = round(total['queries'] / count, 2)
+        total['avg_db_ms'] = round(total['db_ms'] / count, 2)
+        total['p50_ms'] = _percentile(total['buckets'], total['count'], 50)
+        total['p95_ms'] = _percentile(total['buckets'], total['count'], 95)
+        total['p99_ms'] = _percentile(total['buckets'], total['count'], 99)
+    return {'buckets_ms': list(BUCKETS), 'processes': len(snapshots), 'views': merged}
+
+
+def _percentile(buckets, count, pct):
+    """Верхняя граница корзины, в которую попадает перцентиль (None — за последней границей)"""
+    if not count:
+        return None
+    rank = pct / 100 * count
+    seen = 0
+    for index, amount in enumerate(buckets):
+        seen += amount
+        if seen >= rank:
+            return BUCKETS[index] if index < len(BUCKETS) else None
+    return None
@@ -0,0 +1,111 @@
+"""
+Пакетное планирование заготовки: весь план дня (dish_id -> порции) проверяется
+по суммарной потребности в продуктах и применяется одной транзакцией.
+"""
+import math
+
+from django.db.models import Case, F, IntegerField, Value, When
+
+from . import availability, events, menu_cache, stock
+from .db import write_atomic
+from .models import Dish
+
+MODE_EXACT = 'exact'
+MODE_MAX_PORTIONS = 'max_portions'
+MODE_MAX_VALUE = 'max_value'
+MODES = [MODE_EXACT, MODE_MAX_PORTIONS, MODE_MAX_VALUE]
+
+
+class PlanError(ValueError):
+    """План ссылается на несуществующие блюда"""
+
+    def __init__(self, unknown):
+        self.unknown = sorted(unknown)
+        super().__init__('Неизвестные блюда: ' + ', '.join(f'#{dish_id}' for dish_id in self.unknown))
+
+
+def check_dishes(plan):
+    """Проверить, что все блюда плана существуют (один запрос); иначе PlanError"""
+    unknown = set(plan) - set(Dish.objects.filter(pk__in=plan.keys()).values_list('pk', flat=True))
+    if unknown:
+        raise PlanError(unknown)
+
+
+def clean_plan(plan):
+    """Оставляет только положительные целые количества"""
+    return {int(dish_id): int(portions) for dish_id, portions in plan.items() if int(portions) > 0}
+
+
+def demand(plan, matrix):
+    """Суммарная потребность плана в продуктах {product_id: количество}"""
+    total = {}
+    for dish_id, portions in plan.items():
+        for product_id, amount in matrix.get(dish_id, {}).items():
+            total[product_id] = total.get(product_id, 0) + amount * portions
+    return total
+
+
+def apply_plan(plan):
+    """
+    Применить план атомарно: списать продукты и добавить порции.
+
+    Возвращает stock.StockResult; при нехватке ничего не меняется. Неизвестные
+    блюда — PlanError до любых изменений.
+    """
+    plan = clean_plan(plan)
+    if not plan:
+        return stock.StockResult()
+    check_dishes(plan)
+
+    matrix, _ = availability.recipe_matrix(plan.keys())
+    with write_atomic():
+        result = stock.deduct(demand(plan, matrix))
+        if not result.ok:
+            return result
+
+        # Один UPDATE на все блюда плана
+        Dish.objects.filter(pk__in=plan.keys()).update(portions=F('portions') + Case(
+            *[When(pk=dish_id, then=Value(portions)) for dish_id, portions in plan.items()],
+            default=Value(0), output_field=IntegerField(),
+        ))
+        menu_cache.bump()
+        for dish_id, portions in Dish.objects.filter(pk__in=plan.keys()).values_list('pk', 'portions'):
+            events.publish('dish', 'portions_changed', dish_id, portions=portions)
+    return result
+
+
+def optimize_plan(caps, mode=MODE_MAX_PORTIONS):
+    """
+    Подобрать план в пределах склада, максимизируя порции или выручку.
+
+    `caps` — верхние границы порций по блюдам. Жадная эвристика: блюда берутся
+    по убыванию отдачи (1 или цена порции) на долю узкого места склада,
+    каждому выделяется максимум, который позволяет оставшийся остаток.
+    """
+    caps = clean_plan(caps)
+    if not caps:
+        return {}
+
+    matrix, remaining = availability.recipe_matrix(caps.keys())
+    prices = dict(Dish.objects.filter(pk__in=caps.keys()).values_list('pk', 'price'))
+
+    def weight(dish_id):
+        row = matrix.get(dish_id, {})
+        # Доля самого дефицитного продукта, которую съедает одна порция
+        usage = max((amount / remaining[product_id] if remaining.get(product_id, 0) > 0 else math.inf
+                     for product_id, amount in row.items() if amount > 0), default=0)
+        gain = float(prices.get(dish_id, 0)) if mode == MODE_MAX_VALUE else 1.0
+        if usage == 0:
+            return math.inf
+        return gain / usage
+
+    plan = {}
+    for dish_id in sorted(caps, key=weight, reverse=True):
+        limit = availability.max_portions(matrix.get(dish_id, {}), remaining)
+        portions = caps[dish_id] if limit is None else min(caps[dish_id], limit)
+        if portions <= 0:
+            continue
+        plan[dish_id] = portions
+        for product_id, amount in matrix.get(dish_id, {}).items():
+            remaining[product_id] -= amount * portions
+    return plan
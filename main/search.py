@@ -0,0 +1,140 @@
+"""
+Поиск блюд и продуктов по названию и описанию.
+
+На SQLite — таблицы FTS5 с внешним содержимым (main_dish_fts, main_product_fts),
+которые синхронизируют триггеры на исходных таблицах; запрос ищет по префиксам
+слов и ранжирует по bm25 (совпадение в названии весит больше описания). На
+PostgreSQL — GIN-индексы pg_trgm по UPPER(колонки): icontains идёт по индексу,
+порядок — по сходству названия. На прочих базах — обычный icontains.
+
+install() вызывается после каждого migrate: перестройка таблицы в миграциях
+SQLite удаляет триггеры, и тогда индекс создаётся заново.
+"""
+import re
+from collections import namedtuple
+
+from django.db import connection, connections
+from django.db.models import Q
+
+from .models import Dish, Product
+
+SearchIndex = namedtuple('SearchIndex', ['model', 'table', 'columns', 'weights'])
+
+INDEXES = {
+    'dish': SearchIndex(Dish, 'main_dish_fts', ('name', 'description'), (10.0, 1.0)),
+    'product': SearchIndex(Product, 'main_product_fts', ('name',), (1.0,)),
+}
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+TOKEN = re.compile(r'\w+')
+
+
+def _fts_statements(index):
+    source = index.model._meta.db_table
+    columns = ', '.join(index.columns)
+    new = ', '.join(f'new.{column}' for column in index.columns)
+    old = ', '.join(f'old.{column}' for column in index.columns)
+    insert = f"INSERT INTO {index.table}(rowid, {columns}) VALUES (new.id, {new});"
+    delete = f"INSERT INTO {index.table}({index.table}, rowid, {columns}) VALUES ('delete', old.id, {old});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index.table} USING fts5({columns}, content='{source}', "
+        f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {index.table}_ai AFTER INSERT ON {source} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {index.table}_ad AFTER DELETE ON {source} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {index.table}_au AFTER UPDATE OF {columns} ON {source} "
+        f"BEGIN {delete} {insert} END",
+    ]
+
+
+def _trigram_statements(index):
+    # icontains на PostgreSQL — UPPER(col::text) LIKE UPPER(...): индекс строится по тому же выражению
+    source = index.model._meta.db_table
+    statements = ['CREATE EXTENSION IF NOT EXISTS pg_trgm']
+    for column in index.columns:
+        statements += [
+            f'DROP INDEX IF EXISTS {source}_{column}_trgm',
+            f'CREATE INDEX IF NOT EXISTS {source}_{column}_upper_trgm ON {source} '
+            f'USING gin ((UPPER({column}::text)) gin_trgm_ops)',
+        ]
+    return statements
+
+
+def install(using='default', **kwargs):
+    """Создать индексы поиска, если их нет (post_migrate); возвращает перестроенные"""
+    db = connections[using]
+    rebuilt = []
+    with db.cursor() as cursor:
+        for kind, index in INDEXES.items():
+            if db.vendor == 'postgresql':
+                for statement in _trigram_statements(index):
+                    cursor.execute(statement)
+            elif db.vendor == 'sqlite':
+                cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s "
+                               "AND name LIKE %s", [index.model._meta.db_table, f'{index.table}_%'])
+                if cursor.fetchone()[0] == 3:
+                    continue
+                for statement in _fts_statements(index):
+                    cursor.execute(statement)
+                cursor.execute(f"INSERT INTO {index.table}({index.table}) VALUES ('rebuild')")
+                rebuilt.append(kind)
+    return rebuilt
+
+
+def rebuild():
+    """Полностью перестроить FTS-индексы по текущим данным"""
+    if connection.vendor != 'sqlite':
+        return install()
+    with connection.cursor() as cursor:
+        for index in INDEXES.values():
+            cursor.execute(f"INSERT INTO {index.table}({index.table}) VALUES ('rebuild')")
+    return list(INDEXES)
+
+
+def fts_query(text):
+    """Строка пользователя -> запрос FTS5: все слова, каждое как префикс"""
+    return ' '.join(f'"{token}"*' for token in TOKEN.findall(text))
+
+
+def search_ids(kind, text, limit=DEFAULT_LIMIT):
+    """id найденных объектов в порядке релевантности"""
+    index = INDEXES[kind]
+    text = text.strip()
+    if not text:
+        return []
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    if connection.vendor == 'sqlite':
+        query = fts_query(text)
+        if not query:
+            return []
+        weights = ', '.join(str(weight) for weight in index.weights)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {index.table} WHERE {index.table} MATCH %s "
+                f"ORDER BY bm25({index.table}, {weights}), rowid LIMIT %s",
+                [query, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    matches = Q()
+    for column in index.columns:
+        matches |= Q(**{f'{column}__icontains': text})
+    objects = index.model.objects.filter(matches)
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        objects = objects.annotate(rank=TrigramWordSimilarity(text, 'name')).order_by('-rank', 'name', 'pk')
+    else:
+        objects = objects.order_by('name', 'pk')
+    return list(objects.values_list('pk', flat=True)[:limit])
+
+
+def search(kind, text, limit=DEFAULT_LIMIT, only=None):
+    """Найденные объекты в порядке релевантности"""
+    ids = search_ids(kind, text, limit)
+    objects = INDEXES[kind].model.objects.all()
+    if only:
+        objects = objects.only(*only)
+    found = objects.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
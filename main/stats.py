@@ -0,0 +1,63 @@
+"""
+Показатели панели управления одним SQL-запросом (скалярные подзапросы).
+Заказы и выручка за сегодня читаются из дневной строки SalesRollup: выручка
+там зафиксирована по ценам на момент завершения заказа.
+"""
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from .models import Dish, Order, Product, SalesRollup, Table
+
+CACHE_KEY = 'dashboard:stats'
+CACHE_TTL = 5  # секунд: настенные экраны опрашивают часто, данные почти живые
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _today_start():
+    now = timezone.localtime()
+    return timezone.make_aware(datetime.combine(now.date(), time.min))
+
+
+def _query():
+    dish, product, table = _table(Dish), _table(Product), _table(Table)
+    order, rollup = _table(Order), _table(SalesRollup)
+    sql = f"""
+        SELECT
+            (SELECT COUNT(*) FROM {dish}),
+            (SELECT COALESCE(SUM(portions), 0) FROM {dish}),
+            (SELECT COUNT(*) FROM {product}),
+            (SELECT COUNT(*) FROM {table}),
+            (SELECT COUNT(*) FROM {table} WHERE is_occupied = %s),
+            (SELECT COUNT(*) FROM {order} WHERE is_completed = %s),
+            (SELECT COALESCE(SUM(orders), 0) FROM {rollup} WHERE period = %s AND bucket = %s),
+            (SELECT COALESCE(SUM(revenue), 0) FROM {rollup} WHERE period = %s AND bucket = %s)
+    """
+    today = connection.ops.adapt_datetimefield_value(_today_start())
+    day = SalesRollup.PERIOD_DAY
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [True, False, day, today, day, today])
+        row = cursor.fetchone()
+
+    (dishes_count, portions_left, products_count, tables_count, open_tables,
+     active_orders_count, completed_today, revenue_today) = row
+    return {
+        'dishes_count': dishes_count,
+        'portions_left': int(portions_left),
+        'products_count': products_count,
+        'tables_count': tables_count,
+        'open_tables_count': open_tables,
+        'active_orders_count': active_orders_count,
+        'completed_today_count': completed_today,
+        'revenue_today': Decimal(str(revenue_today)).quantize(Decimal('0.01')),
+    }
+
+
+def dashboard_stats():
+    return cache.get_or_set(CACHE_KEY, _query, CACHE_TTL)
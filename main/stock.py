@@ -0,0 +1,146 @@
+"""
+Складской движок: резервирование, освобождение, подтверждение и списание
+продуктов сразу для целой технологической карты (product_id -> количество).
+
+Каждая операция выполняется в одной транзакции: по одному условному UPDATE
+на продукт через F()-выражения, без чтения строки в Python. Если хотя бы
+одного продукта не хватает, транзакция откатывается целиком, а результат
+перечисляет все недостающие продукты. Успешная операция дописывает движения
+в журнал склада (ledger) одним INSERT.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from . import ledger, menu_cache
+from .db import write_atomic
+from .models import Product, StockMovement
+
+# Количества хранятся во FloatField: допуск против ошибок округления (0.3 - 0.1 - 0.2)
+EPSILON = 1e-9
+
+Shortage = namedtuple('Shortage', ['product_id', 'name', 'required', 'available'])
+
+
+class StockResult:
+    def __init__(self, shortages=()):
+        self.shortages = list(shortages)
+
+    @property
+    def ok(self):
+        return not self.shortages
+
+    def __bool__(self):
+        return self.ok
+
+    @property
+    def message(self):
+        if self.ok:
+            return "Успешно"
+        return "Недостаточно " + ", ".join(
+            f"{s.name} (нужно: {s.required:g}, доступно: {s.available:g})"
+            for s in self.shortages
+        )
+
+    def __repr__(self):
+        return f"StockResult(ok={self.ok}, shortages={self.shortages!r})"
+
+
+def normalize(bom):
+    """Объединяет повторы и отбрасывает нулевые количества"""
+    totals = {}
+    items = bom.items() if hasattr(bom, 'items') else bom
+    for product_id, amount in items:
+        if amount > 0:
+            totals[product_id] = totals.get(product_id, 0) + amount
+    return totals
+
+
+def _shortages(bom, product_ids, available):
+    """Отчёт о нехватке: один запрос за именами и остатками"""
+    products = Product.objects.filter(pk__in=product_ids).values_list(
+        'pk', 'name', 'quantity', 'reserved_quantity')
+    rows = {pk: (name, quantity, reserved) for pk, name, quantity, reserved in products}
+    report = []
+    for product_id in sorted(product_ids):
+        name, quantity, reserved = rows.get(product_id, (f"#{product_id}", 0, 0))
+        report.append(Shortage(product_id, name, bom[product_id], max(0, available(quantity, reserved))))
+    return report
+
+
+def _apply(bom, kind, condition, **changes):
+    """
+    Применяет условный UPDATE к каждому продукту карты в одной транзакции.
+
+    `condition(amount)` возвращает фильтр, `changes` — функции amount -> выражение,
+    `kind` — вид движения для журнала. Возвращает список product_id, для которых
+    условие не выполнилось.
+    """
+    failed = []
+    with write_atomic():
+        # Фиксированный порядок блокировок исключает взаимные блокировки
+        for product_id, amount in sorted(bom.items()):
+            updated = Product.objects.filter(pk=product_id, **condition(amount)).update(
+                **{field: change(amount) for field, change in changes.items()})
+            if not updated:
+                failed.append(product_id)
+        if failed:
+            transaction.set_rollback(True)
+        elif bom:
+            ledger.record_bom(kind, bom)
+            # Остатки влияют на "сколько порций можно приготовить" в меню
+            menu_cache.bump()
+    return failed
+
+
+def reserve(bom):
+    """Зарезервировать продукты, если хватает свободного (не зарезервированного) остатка"""
+    bom = normalize(bom)
+    failed = _apply(
+        bom, StockMovement.RESERVE,
+        lambda amount: {'quantity__gte': F('reserved_quantity') + (amount - EPSILON)},
+        reserved_quantity=lambda amount: F('reserved_quantity') + amount,
+    )
+    return StockResult(_shortages(bom, failed, lambda q, r: q - r) if failed else ())
+
+
+def release(bom):
+    """Освободить резервирование (не уходит ниже нуля)"""
+    bom = normalize(bom)
+    with write_atomic():
+        # В журнал пишем фактически снятый резерв, поэтому читаем его под блокировкой
+        reserved = dict(Product.objects.select_for_update().filter(pk__in=bom)
+                        .values_list('pk', 'reserved_quantity'))
+        bom = {product_id: min(amount, reserved[product_id])
+               for product_id, amount in bom.items() if reserved.get(product_id, 0) > 0}
+        _apply(
+            bom, StockMovement.RELEASE,
+            lambda amount: {},
+            reserved_quantity=lambda amount: Greatest(F('reserved_quantity') - amount, Value(0.0)),
+        )
+    return StockResult()
+
+
+def commit(bom):
+    """Подтвердить резервирование: списать продукты из зарезервированного количества"""
+    bom = normalize(bom)
+    failed = _apply(
+        bom, StockMovement.COMMIT,
+        lambda amount: {'reserved_quantity__gte': amount - EPSILON},
+        quantity=lambda amount: F('quantity') - amount,
+        reserved_quantity=lambda amount: F('reserved_quantity') - amount,
+    )
+    return StockResult(_shortages(bom, failed, lambda q, r: r) if failed else ())
+
+
+def deduct(bom):
+    """Списать продукты напрямую из свободного остатка (например, при заготовке порций)"""
+    bom = normalize(bom)
+    failed = _apply(
+        bom, StockMovement.DEDUCTION,
+        lambda amount: {'quantity__gte': F('reserved_quantity') + (amount - EPSILON)},
+        quantity=lambda amount: F('quantity') - amount,
+    )
+    return StockResult(_shortages(bom, failed, lambda q, r: q - r) if failed else ())
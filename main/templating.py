@@ -0,0 +1,33 @@
+"""
+Бэкенд шаблонов Django с замером времени отрисовки для main.performance.
+"""
+import time
+
+from django.template.backends.django import DjangoTemplates, Template
+
+from . import performance
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = performance.current.get()
+        if metrics is None:
+            return super().render(context, request)
+        # Вложенная отрисовка (render_to_string внутри шаблона) уже учтена внешней
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
@@ -1,3 +1,1151 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from types import ModuleType
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import F, QuerySet
+from django.template import engines
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from PIL import Image
+
+from . import (analytics, auth, availability, benchmarks, exchange, floor, forecast, images, jobs, ledger,
+               menu_cache, performance, production, search, stats, stock)
+from .db import write_atomic
+from .forms import DishForm
+from .models import (Dish, DishIngredient, DishSalesRollup, Event, Job, Order, OrderItem, OrderQuerySet, Product,
+                     ProductForecast, SalesRollup, StockMovement, StockSnapshot, Table, User)
+from .templating import TimedTemplate
+
+
+class HotQueryPlanTests(TestCase):
+    """Горячие запросы должны идти по индексам, без полного сканирования и сортировки"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.table = Table.objects.create(number=1)
+        cls.dish = Dish.objects.create(name='Plov', price=20000)
+        cls.order = Order.objects.create(table=cls.table)
+        OrderItem.objects.create(order=cls.order, dish=cls.dish)
+        # История в основном из закрытых заказов — статистика для планировщика
+        Order.objects.bulk_create(Order(is_completed=True) for _ in range(200))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index_name='USING'):
+        if connection.vendor != 'sqlite':
+            self.skipTest('План проверяется для SQLite')
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        return plan
+
+    def test_open_order_for_table(self):
+        self.assertUsesIndex(
+            Order.objects.filter(table=self.table, is_completed=False),
+            'one_open_order_per_table',
+        )
+
+    def test_order_history(self):
+        self.assertUsesIndex(
+            Order.objects.order_by('-created_at', '-id')[:50],
+            'order_history_idx',
+        )
+
+    def test_completed_orders_history(self):
+        # Какой из двух индексов истории выберет планировщик, зависит от статистики;
+        # важно, что страница читается в порядке индекса без сортировки
+        self.assertUsesIndex(
+            Order.objects.filter(is_completed=True).order_by('-created_at', '-id')[:50],
+        )
+
+    def test_open_orders(self):
+        # Открытые заказы читаются из частичного индекса, а не из всей истории
+        self.assertUsesIndex(
+            Order.objects.filter(is_completed=False).values('pk'),
+            'one_open_order_per_table',
+        )
+
+    def test_order_line_by_dish(self):
+        # Безусловная уникальность в SQLite становится автоиндексом таблицы
+        plan = self.assertUsesIndex(
+            OrderItem.objects.filter(order=self.order, dish=self.dish),
+            'sqlite_autoindex_main_orderitem',
+        )
+        self.assertIn('order_id=? AND dish_id=?', plan)
+
+
+class HotPathConstraintTests(TestCase):
+    def test_one_open_order_per_table(self):
+        table = Table.objects.create(number=2)
+        Order.objects.create(table=table)
+        Order.objects.create(table=table, is_completed=True)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(table=table)
+
+    def test_one_line_per_dish(self):
+        order = Order.objects.create()
+        dish = Dish.objects.create(name='Shurpa', price=30000)
+        OrderItem.objects.create(order=order, dish=dish)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OrderItem.objects.create(order=order, dish=dish)
+
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    """Профили БД, PRAGMA SQLite и BEGIN IMMEDIATE только на путях записи"""
+    alias = 'sqlite_file'
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        settings_dict = dict(connection.settings_dict, NAME=self.path, TEST={})
+        self.db = DatabaseWrapper(settings_dict, alias=self.alias)
+        connections[self.alias] = self.db
+
+    def tearDown(self):
+        self.db.close()
+        del connections[self.alias]
+        os.remove(self.path)
+
+    def journal_mode(self):
+        with self.db.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_only_when_tuning_enabled(self):
+        with override_settings(SQLITE_TUNING=False):
+            self.assertEqual(self.journal_mode(), 'delete')
+        self.db.close()
+        with override_settings(SQLITE_TUNING=True):
+            self.assertEqual(self.journal_mode(), 'wal')
+
+    def test_pragmas_skip_in_memory_db(self):
+        memory = DatabaseWrapper(dict(connection.settings_dict, NAME=':memory:', TEST={}), alias='sqlite_memory')
+        with override_settings(SQLITE_TUNING=True), mock.patch.object(memory, 'cursor') as cursor:
+            connection_created.send(sender=DatabaseWrapper, connection=memory)
+        cursor.assert_not_called()
+
+    def test_write_atomic_begins_immediate(self):
+        with CaptureQueriesContext(self.db) as queries:
+            with write_atomic(using=self.alias):
+                with write_atomic(using=self.alias):
+                    pass
+            with transaction.atomic(using=self.alias):
+                pass
+        begins = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('BEGIN')]
+        self.assertEqual(begins, ['BEGIN IMMEDIATE', 'BEGIN'])
+        self.assertEqual(self.db.transaction_mode, None)
+
+    def test_profile_switch(self):
+        import Cafe.settings as project_settings
+        self.addCleanup(importlib.reload, project_settings)
+        with mock.patch.dict(os.environ, {'CAFE_DB': 'postgres', 'CAFE_DB_NAME': 'cafe_bench'}):
+            importlib.reload(project_settings)
+        database = project_settings.DATABASES['default']
+        self.assertEqual(database['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(database['NAME'], 'cafe_bench')
+        with mock.patch.dict(os.environ, {'CAFE_DB': 'sqlite', 'CAFE_SQLITE_TUNING': '0'}):
+            importlib.reload(project_settings)
+        database = project_settings.DATABASES['default']
+        self.assertEqual(database['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertNotIn('transaction_mode', database['OPTIONS'])
+        self.assertFalse(project_settings.SQLITE_TUNING)
+
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AuthCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='admin', password='admin', email='admin@example.com',
+                                             is_staff=True, role='admin')
+        self.client.force_login(self.user)
+        self.client.get('/perf/')
+
+    def current_user(self):
+        return self.client.get('/perf/').wsgi_request.user
+
+    def test_cached_request_runs_no_identity_queries(self):
+        entry = cache.get(auth.user_cache_key(self.user.pk))
+        self.assertNotIn('password', entry['fields'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/perf/').status_code, 200)
+
+    def test_cached_user_keeps_password_on_save(self):
+        user = auth.load_user(cache.get(auth.user_cache_key(self.user.pk)))
+        user.full_name = 'Admin'
+        user.save()
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('admin'))
+
+    def test_role_change_drops_cached_user(self):
+        self.user.role = 'cook'
+        self.user.save()
+        self.assertIsNone(cache.get(auth.user_cache_key(self.user.pk)))
+        self.assertEqual(self.current_user().role, 'cook')
+
+    def test_deactivation_logs_out(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(self.current_user().is_authenticated)
+
+    def test_password_change_logs_out(self):
+        self.user.set_password('new-secret')
+        self.user.save()
+        self.assertFalse(self.current_user().is_authenticated)
+
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PerformanceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.histograms = performance.Histograms()
+        patcher = mock.patch.object(performance, 'histograms', self.histograms)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_server_timing_only_for_staff(self):
+        self.assertNotIn('Server-Timing', self.client.get('/login/'))
+        waiter = User.objects.create_user(username='waiter', password='waiter', email='waiter@example.com')
+        self.client.force_login(waiter)
+        self.assertNotIn('Server-Timing', self.client.get('/login/'))
+        admin = User.objects.create_user(username='admin', password='admin', email='admin@example.com', is_staff=True)
+        self.client.force_login(admin)
+        response = self.client.get('/perf/')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+        with override_settings(DEBUG=True):
+            self.client.logout()
+            self.assertIn('Server-Timing', self.client.get('/login/'))
+
+    def test_requests_fill_histograms(self):
+        self.client.get('/login/')
+        self.client.get('/login/')
+        entry = self.histograms.snapshot()['login']
+        self.assertEqual(entry['count'], 2)
+        self.assertEqual(sum(entry['buckets']), 2)
+
+    def test_collect_merges_processes(self):
+        self.histograms.observe('menu', 3, 2, 1.0)
+        self.histograms.observe('menu', 300, 4, 5.0)
+        performance.flush({'menu': dict(self.histograms.snapshot()['menu'], max_ms=7000.0)})
+        cache.set(performance.PROCESSES_KEY, ['perf:process:other', performance.PROCESS_KEY], None)
+        cache.set('perf:process:other', {'menu': self.histograms.snapshot()['menu']}, None)
+        summary = performance.collect()
+        menu = summary['views']['menu']
+        self.assertEqual((summary['processes'], menu['count'], menu['queries']), (2, 4, 12))
+        self.assertEqual(menu['buckets'][performance._bucket(3)], 2)
+        self.assertEqual((menu['p50_ms'], menu['p99_ms']), (5, 500))
+        # Данные истёкшего процесса убираются из списка
+        cache.delete('perf:process:other')
+        self.assertEqual(performance.collect()['processes'], 1)
+        self.assertEqual(cache.get(performance.PROCESSES_KEY), [performance.PROCESS_KEY])
+
+    def test_template_time_counted_once(self):
+        engine = engines.all()[0]
+        self.assertIsInstance(engine.from_string(''), TimedTemplate)
+        inner = engine.from_string('{{ value }}')
+        outer = engine.from_string('{{ nested }}')
+        metrics = performance.RequestMetrics()
+        token = performance.current.set(metrics)
+        try:
+            with mock.patch('main.templating.time.perf_counter', side_effect=[0.0, 1.0, 4.0]):
+                outer.render({'nested': _LazyRender(inner)})
+        finally:
+            performance.current.reset(token)
+        # Внешняя отрисовка 0 -> 4 с; вложенная (с 1 с) уже внутри неё и не прибавляется
+        self.assertEqual((metrics.template_time, metrics.template_depth), (4.0, 0))
+
+
+class _LazyRender:
+    """Отрисовка вложенного шаблона в момент вывода внешнего"""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __str__(self):
+        return self.template.render({'value': 1})
+
+
+class OrderCompleteTests(TestCase):
+    def test_line_added_before_completion_is_deducted(self):
+        order = Order.objects.create()
+        plov = Dish.objects.create(name='Plov', price=20000, portions=5)
+        somsa = Dish.objects.create(name='Somsa', price=8000, portions=5)
+        OrderItem.objects.create(order=order, dish=plov, quantity=1)
+        update = OrderQuerySet.update
+
+        def add_line_then_update(queryset, **kwargs):
+            # Официант добавил блюдо, пока кассир закрывает заказ
+            if kwargs.get('is_completed'):
+                OrderItem.objects.create(order=order, dish=somsa, quantity=2)
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(OrderQuerySet, 'update', add_line_then_update):
+            self.assertEqual(order.complete(), (True, []))
+        self.assertEqual(dict(Dish.objects.values_list('name', 'portions')), {'Plov': 4, 'Somsa': 3})
+
+
+class DishSaveTests(TestCase):
+    def setUp(self):
+        product = Product.objects.create(name='Un', unit='kg', quantity=10, purchase_price=5000)
+        dish = Dish.objects.create(name='Non', price=3000, portions=5)
+        DishIngredient.objects.create(dish=dish, product=product, quantity=100, unit='g')
+        self.dish = Dish.objects.get(pk=dish.pk)
+
+    def test_unchanged_save_is_free(self):
+        with self.assertNumQueries(0):
+            self.dish.save()
+
+    def test_save_keeps_concurrent_portions(self):
+        Dish.objects.filter(pk=self.dish.pk).update(portions=F('portions') - 2)
+        self.dish.description = 'Tandir noni'
+        with CaptureQueriesContext(connection) as captured:
+            self.dish.save()
+        updates = [query['sql'] for query in captured if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('portions', updates[0])
+        self.dish.portions += 4
+        self.dish.save()
+        self.assertEqual(Dish.objects.values_list('portions', flat=True).get(pk=self.dish.pk), 7)
+
+    def test_price_change_refreshes_margin(self):
+        self.assertEqual((self.dish.cost, self.dish.margin), (500, 2500))
+        self.dish.price = 4000
+        self.dish.save()
+        self.assertEqual(self.dish.margin, 3500)
+        self.assertEqual(Dish.objects.values_list('margin', flat=True).get(pk=self.dish.pk), 3500)
+
+    def test_detail_reads_stored_cost(self):
+        Dish.objects.filter(pk=self.dish.pk).update(cost=750, margin=2250)
+        response = self.client.get(f'/menu/{self.dish.pk}/')
+        self.assertEqual((response.context['cost'], response.context['profit']), (750, 2250))
+        self.assertEqual(response.context['dish_price_ratio'], 4)
+
+
+
+class StockEngineTests(TestCase):
+    def setUp(self):
+        self.flour = Product.objects.create(name='Un', unit='kg', quantity=10, purchase_price=5000)
+        self.meat = Product.objects.create(name="Go'sht", unit='kg', quantity=2, purchase_price=90000)
+        self.rice = Product.objects.create(name='Guruch', unit='kg', quantity=1, purchase_price=15000)
+
+    def levels(self):
+        return {pk: (quantity, reserved) for pk, quantity, reserved
+                in Product.objects.values_list('pk', 'quantity', 'reserved_quantity')}
+
+    def test_shortage_lists_every_missing_product(self):
+        result = stock.reserve({self.flour.pk: 1, self.meat.pk: 3, self.rice.pk: 5})
+        self.assertFalse(result)
+        self.assertEqual([(s.product_id, s.required, s.available) for s in result.shortages],
+                         [(self.meat.pk, 3, 2), (self.rice.pk, 5, 1)])
+        self.assertIn("Go'sht", result.message)
+        self.assertIn('Guruch', result.message)
+
+    def test_failed_reserve_rolls_back_partial_updates(self):
+        before = self.levels()
+        movements = StockMovement.objects.count()
+        # Мука резервируется первой и должна откатиться вместе с остальным
+        self.assertFalse(stock.reserve({self.flour.pk: 4, self.meat.pk: 3}))
+        self.assertEqual(self.levels(), before)
+        self.assertEqual(StockMovement.objects.count(), movements)
+
+    def test_release_is_capped_at_reserved(self):
+        self.assertTrue(stock.reserve({self.meat.pk: 1.5}))
+        stock.release({self.meat.pk: 5})
+        self.assertEqual(self.levels()[self.meat.pk], (2, 0))
+        movement = StockMovement.objects.filter(kind=StockMovement.RELEASE).get()
+        self.assertEqual(movement.reserved_delta, -1.5)
+
+    def test_commit_turns_reservation_into_deduction(self):
+        self.assertTrue(stock.reserve({self.flour.pk: 3, self.meat.pk: 1}))
+        self.assertTrue(stock.commit({self.flour.pk: 3, self.meat.pk: 1}))
+        levels = self.levels()
+        self.assertEqual((levels[self.flour.pk], levels[self.meat.pk]), ((7, 0), (1, 0)))
+        self.assertEqual(ledger.discrepancies(), [])
+        # Подтвердить больше, чем зарезервировано, нельзя
+        result = stock.commit({self.flour.pk: 1})
+        self.assertEqual([(s.product_id, s.available) for s in result.shortages], [(self.flour.pk, 0)])
+
+
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        self.flour = Product.objects.create(name='Un', unit='kg', quantity=0.3, purchase_price=5000)
+        self.meat = Product.objects.create(name="Go'sht", unit='kg', quantity=2, reserved_quantity=1.5,
+                                           purchase_price=90000)
+        self.oil = Product.objects.create(name="Yog'", unit='liters', quantity=0, purchase_price=20000)
+        self.non = Dish.objects.create(name='Non', price=3000)
+        self.somsa = Dish.objects.create(name='Somsa', price=8000)
+        self.chuchvara = Dish.objects.create(name='Chuchvara', price=25000)
+        self.tea = Dish.objects.create(name='Choy', price=5000)
+        DishIngredient.objects.create(dish=self.non, product=self.flour, quantity=100, unit='g')
+        DishIngredient.objects.create(dish=self.somsa, product=self.flour, quantity=50, unit='g')
+        DishIngredient.objects.create(dish=self.somsa, product=self.meat, quantity=200, unit='g')
+        DishIngredient.objects.create(dish=self.chuchvara, product=self.meat, quantity=100, unit='g')
+        DishIngredient.objects.create(dish=self.chuchvara, product=self.oil, quantity=10, unit='ml')
+
+    def test_portions_limited_by_scarcest_ingredient(self):
+        with self.assertNumQueries(2):
+            portions = availability.producible_portions()
+        self.assertEqual(portions, {
+            self.non.pk: 3,           # 0.3 кг / 0.1 кг без ошибки округления
+            self.somsa.pk: 2,         # свободно 0.5 кг мяса из 2, резерв не считается
+            self.chuchvara.pk: 0,     # масла нет совсем
+            self.tea.pk: None,        # без рецепта склад не ограничивает
+        })
+
+    def test_missing_ingredient_gives_zero(self):
+        Product.objects.filter(pk=self.meat.pk).update(reserved_quantity=2)
+        portions = availability.producible_portions([self.non.pk, self.somsa.pk])
+        self.assertEqual(portions, {self.non.pk: 3, self.somsa.pk: 0})
+        dishes = availability.annotate_dishes(Dish.objects.filter(pk__in=[self.somsa.pk, self.tea.pk]))
+        self.assertEqual({dish.pk: dish.producible for dish in dishes}, {self.somsa.pk: 0, self.tea.pk: None})
+
+
+
+class DishImageTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.media = media.name
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 600), (200, 120, 40)).save(buffer, 'JPEG')
+        self.photo = buffer.getvalue()
+
+    def upload(self, name, filename):
+        form = DishForm(data={'name': name, 'description': '', 'price': 30000, 'portions': 0},
+                        files={'image': SimpleUploadedFile(filename, self.photo, content_type='image/jpeg')})
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.save()
+
+    def stored_files(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.media)
+                      for root, _, names in os.walk(self.media) for name in names)
+
+    def test_identical_upload_is_stored_once(self):
+        first = self.upload('Osh', 'osh.jpg')
+        second = self.upload('Osh (katta)', 'IMG_0001.JPG')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image.name, f'dishes/{images.content_hash(self.photo)}.jpg')
+        self.assertEqual(Job.objects.filter(name='dish.process_image').count(), 2)
+
+        jobs.process_dish_image(first.pk)
+        files = self.stored_files()
+        with mock.patch.object(default_storage, 'save', wraps=default_storage.save) as save:
+            jobs.process_dish_image(second.pk)
+        save.assert_not_called()
+        self.assertEqual(self.stored_files(), files)
+        self.assertEqual(len(files), 1 + len(images.FORMATS) * 2)
+        second.refresh_from_db()
+        self.assertEqual(second.image_widths, [320, 640])
+        self.assertIn('-320.webp 320w', second.image_srcset())
+
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MenuCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dish = Dish.objects.create(name='Osh', price=35000, portions=5)
+
+    def test_repeat_request_revalidates_until_dish_changes(self):
+        # Первый ответ ставит CSRF-cookie, которая входит в ключ клиента
+        self.client.get('/menu/')
+        response = self.client.get('/menu/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/menu/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dish.price = 38000
+            self.dish.save()
+        response = self.client.get('/menu/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Osh')
+        self.assertEqual(self.client.get('/menu/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_stock_change_bumps_version(self):
+        version = menu_cache.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(stock.deduct({}))
+        self.assertEqual(menu_cache.get_version(), version)
+        product = Product.objects.create(name='Guruch', unit='kg', quantity=5, purchase_price=12000)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(stock.deduct({product.pk: 1}))
+        self.assertNotEqual(menu_cache.get_version(), version)
+
+
+
+@mock.patch('main.views.ORDERS_PAGE_SIZE', 3)
+class OrderPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        orders = [Order.objects.create() for _ in range(7)]
+        # Три заказа с одинаковым временем: граница страницы проходит внутри них
+        moments = [now - timedelta(minutes=minutes) for minutes in (1, 2, 3, 3, 3, 4, 5)]
+        for order, moment in zip(orders, moments):
+            Order.objects.filter(pk=order.pk).update(created_at=moment)
+        cls.expected = list(Order.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+
+    def page(self, **params):
+        response = self.client.get('/orders/', params)
+        self.assertEqual(response.status_code, 200)
+        return [order.pk for order in response.context['orders']], response.context['next_cursor']
+
+    def test_pages_cover_every_order_once(self):
+        seen, cursor, pages = [], None, 0
+        while True:
+            ids, cursor = self.page(**({'after': cursor} if cursor else {}))
+            seen.extend(ids)
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(pages, 3)
+
+    def test_garbage_cursor_falls_back_to_first_page(self):
+        first, _ = self.page()
+        for cursor in ('abc', '_', '2024-13-01T00:00:00_5', '2024-01-01T00:00:00_x', '5'):
+            ids, _ = self.page(after=cursor)
+            self.assertEqual(ids, first)
+
+
+class ProductionPlanTests(TestCase):
+    def setUp(self):
+        self.flour = Product.objects.create(name='Un', unit='kg', quantity=1, purchase_price=5000)
+        self.non = Dish.objects.create(name='Non', price=3000, portions=0)
+        self.somsa = Dish.objects.create(name='Somsa', price=8000, portions=0)
+        DishIngredient.objects.create(dish=self.non, product=self.flour, quantity=100, unit='g')
+        DishIngredient.objects.create(dish=self.somsa, product=self.flour, quantity=200, unit='g')
+        user = User.objects.create_user(username='cook', password='cook', email='cook@example.com')
+        self.client.force_login(user)
+
+    def post(self, payload):
+        return self.client.post('/menu/plan/', json.dumps(payload), content_type='application/json')
+
+    def portions(self):
+        return dict(Dish.objects.values_list('name', 'portions'))
+
+    def test_plan_deducts_and_adds_portions(self):
+        response = self.post({'plan': {self.non.pk: 2, self.somsa.pk: 3}})
+        self.assertEqual(response.json()['applied'], True)
+        self.assertEqual(self.portions(), {'Non': 2, 'Somsa': 3})
+        self.assertAlmostEqual(Product.objects.get().quantity, 0.2)
+
+    def test_shortage_changes_nothing(self):
+        response = self.post({'plan': {self.non.pk: 2, self.somsa.pk: 5}})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['shortages'][0]['product_id'], self.flour.pk)
+        self.assertEqual(self.portions(), {'Non': 0, 'Somsa': 0})
+        self.assertEqual(Product.objects.get().quantity, 1)
+
+    def test_unknown_dish_is_rejected(self):
+        missing = self.somsa.pk + 100
+        response = self.post({'plan': {self.non.pk: 2, missing: 1}})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['unknown'], [missing])
+        self.assertEqual(self.portions(), {'Non': 0, 'Somsa': 0})
+        with self.assertRaises(production.PlanError):
+            production.apply_plan({missing: 1})
+
+    def test_optimized_plan_fits_stock(self):
+        plan = production.optimize_plan({self.non.pk: 20, self.somsa.pk: 20}, production.MODE_MAX_VALUE)
+        self.assertEqual(plan, {self.somsa.pk: 5})
+        plan = production.optimize_plan({self.non.pk: 4, self.somsa.pk: 20}, production.MODE_MAX_PORTIONS)
+        self.assertEqual(plan, {self.non.pk: 4, self.somsa.pk: 3})
+        self.assertTrue(production.apply_plan(plan))
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        Product.objects.create(name='Un', unit='kg', quantity=10, purchase_price=5000)
+        self.product = Product.objects.get()
+        self.yesterday = timezone.now() - timedelta(days=1)
+        StockMovement.objects.update(created_at=self.yesterday - timedelta(days=1))
+
+    def adjust(self, quantity):
+        product = Product.objects.get(pk=self.product.pk)
+        product.quantity = quantity
+        product.save()
+
+    def test_balances_follow_movements(self):
+        self.adjust(15)
+        self.assertEqual(ledger.balances(), {self.product.pk: (15, 0)})
+        self.assertEqual(ledger.balance_as_of(self.product.pk, self.yesterday), (10, 0))
+        self.assertEqual(ledger.discrepancies(), [])
+
+    def test_snapshot_plus_later_movements(self):
+        self.adjust(15)
+        self.assertEqual(ledger.take_snapshot(), 1)
+        snapshot = StockSnapshot.objects.get()
+        self.assertEqual(snapshot.movement_id, StockMovement.objects.latest('id').pk)
+        self.assertEqual(snapshot.quantity, 15)
+
+        self.adjust(12)
+        StockMovement.objects.filter(id__lte=snapshot.movement_id).delete()
+        # Движения до снимка больше не читаются: остаток = снимок + движения после него
+        self.assertEqual(ledger.balances(), {self.product.pk: (12, 0)})
+        self.assertEqual(ledger.balance_as_of(self.product.pk, timezone.now()), (12, 0))
+
+
+class OrderLinesApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plov = Dish.objects.create(name='Plov', price=20000)
+        cls.somsa = Dish.objects.create(name='Somsa', price=8000)
+
+    def setUp(self):
+        self.order = Order.objects.create()
+        self.url = f'/orders/{self.order.pk}/lines/'
+
+    def post(self, payload):
+        return self.client.post(self.url, json.dumps(payload), content_type='application/json')
+
+    def quantities(self):
+        return dict(self.order.order_items.values_list('dish__name', 'quantity'))
+
+    def test_add_set_remove(self):
+        response = self.post({'ops': [{'op': 'add', 'dish_id': self.plov.pk, 'quantity': 2},
+                                      {'op': 'add', 'dish_id': self.somsa.pk, 'quantity': '3'},
+                                      {'op': 'add', 'dish_id': self.plov.pk}]})
+        self.assertTrue(response.json()['ok'])
+        self.assertEqual(self.quantities(), {'Plov': 3, 'Somsa': 3})
+        self.assertEqual(response.json()['totals']['subtotal'], '84000.00')
+
+        plov = self.order.order_items.get(dish=self.plov)
+        somsa = self.order.order_items.get(dish=self.somsa)
+        response = self.post([{'op': 'set', 'item_id': plov.pk, 'quantity': 5}, {'op': 'remove', 'item_id': somsa.pk}])
+        self.assertTrue(response.json()['ok'])
+        self.assertEqual(self.quantities(), {'Plov': 5})
+        self.assertIn({'id': somsa.pk, 'removed': True}, response.json()['lines'])
+
+    def test_remove_then_add_same_dish(self):
+        line = OrderItem.objects.create(order=self.order, dish=self.plov, quantity=4)
+        response = self.post({'ops': [{'op': 'remove', 'item_id': line.pk},
+                                      {'op': 'add', 'dish_id': self.plov.pk, 'quantity': 1}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {'Plov': 1})
+
+    def test_bad_payloads(self):
+        line = OrderItem.objects.create(order=self.order, dish=self.plov, quantity=2)
+        for payload, error in (
+            ('"ops"', 'Ожидается объект {"ops": [...]} или список операций'),
+            ({'ops': {'op': 'add'}}, 'Операции должны быть списком'),
+            ({'ops': []}, 'Пустой список операций'),
+            ([{'op': 'add', 'dish_id': self.plov.pk, 'quantity': 1.7}], 'Некорректное количество'),
+            ([{'op': 'set', 'item_id': line.pk, 'quantity': 'abc'}], 'Некорректное количество'),
+            ([{'op': 'add', 'dish_id': 0}], 'Блюдо #0 не найдено'),
+            ([{'op': 'drop', 'item_id': line.pk}], 'Неизвестная операция: drop'),
+        ):
+            with self.subTest(payload=payload):
+                body = payload if isinstance(payload, str) else json.dumps(payload)
+                response = self.client.post(self.url, body, content_type='application/json')
+                self.assertEqual((response.status_code, response.json()['error']), (400, error))
+        self.assertEqual(self.client.post(self.url, '{', content_type='application/json').status_code, 400)
+        self.assertEqual(self.quantities(), {'Plov': 2})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class QueryBudgetTests(TestCase):
+    """Сценарий официанта укладывается в бюджеты SQL-запросов (ловит N+1)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Больше строк, чем помещается на страницу: N+1 сразу выходит за бюджет
+        benchmarks.seed(dishes=30, orders=200, tables=2)
+        cls.user = User.objects.create_user(username='waiter', password='waiter', email='waiter@example.com')
+        cls.dish_ids = list(Dish.objects.values_list('pk', flat=True))
+        cls.table_id = Table.objects.order_by('number').values_list('pk', flat=True)[0]
+
+    def test_waiter_flow_within_budgets(self):
+        waiter = benchmarks.Waiter(self.user, self.table_id, self.dish_ids, items=4)
+        for _ in range(len(waiter.steps) * 2):
+            waiter.step()
+        self.assertEqual(set(waiter.queries), set(benchmarks.QUERY_BUDGETS))
+        for name, budget in benchmarks.QUERY_BUDGETS.items():
+            with self.subTest(view=name):
+                self.assertLessEqual(waiter.queries[name], budget)
+
+    def complete_queries(self, dish_ids):
+        order = Order.objects.create()
+        OrderItem.objects.bulk_create(OrderItem(order=order, dish_id=dish_id) for dish_id in dish_ids)
+        Dish.objects.filter(pk__in=dish_ids).update(portions=10)
+        with CaptureQueriesContext(connection) as captured, self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(order.complete()[0])
+        return len(captured)
+
+    def test_complete_does_not_fan_out_per_dish(self):
+        # Первый проход создаёт строки сводок, второй прибавляет к ним: оба пути не растут с числом блюд
+        per_dish = benchmarks.PER_DISH_QUERIES['table_order.complete']
+        for rollups in ('new', 'existing'):
+            single = self.complete_queries(self.dish_ids[:1])
+            many = self.complete_queries(self.dish_ids[1:9])
+            with self.subTest(rollups=rollups):
+                self.assertLessEqual(many - single, 7 * per_dish)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        tasks = mock.patch.dict(jobs.TASKS, {'test.echo': self.echo, 'test.fail': self.fail_task})
+        tasks.start()
+        self.addCleanup(tasks.stop)
+
+    def echo(self, value):
+        self.calls.append(value)
+        return {'value': value}
+
+    def fail_task(self):
+        raise RuntimeError('boom')
+
+    def test_claims_by_priority_once(self):
+        low = jobs.enqueue('test.echo', priority=Job.PRIORITY_LOW, value='low')
+        high = jobs.enqueue('test.echo', priority=Job.PRIORITY_HIGH, value='high')
+        jobs.enqueue('test.echo', delay=timedelta(hours=1), value='later')
+
+        claimed = jobs.claim('worker-1', limit=1)
+        self.assertEqual([job.pk for job in claimed], [high.pk])
+        self.assertEqual([job.pk for job in jobs.claim('worker-2')], [low.pk])
+        self.assertEqual(jobs.claim('worker-3'), [])
+
+        self.assertTrue(jobs.run(claimed[0]))
+        high.refresh_from_db()
+        self.assertEqual((high.status, high.result, high.attempts), (Job.DONE, {'value': 'high'}, 1))
+        self.assertEqual(self.calls, ['high'])
+
+    def test_failed_job_retries_then_fails(self):
+        job = jobs.enqueue('test.fail', max_attempts=2)
+        with self.assertLogs('main.jobs', 'WARNING'):
+            self.assertEqual(jobs.work('worker'), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('boom', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs('main.jobs', 'WARNING'):
+            self.assertEqual(jobs.work('worker'), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_stale_running_job_is_requeued(self):
+        job = jobs.enqueue('test.echo', value=1)
+        jobs.claim('dead-worker')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - jobs.STALE_AFTER * 2)
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.work('worker'), (1, 0))
+        self.assertEqual(self.calls, [1])
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plov = Dish.objects.create(name='Osh (plov)', price=35000, description='Guruch, sabzi, go\'sht')
+        cls.soup = Dish.objects.create(name='Sho\'rva', price=25000, description='Go\'shtli sho\'rva, osh ko\'ki bilan')
+        cls.salad = Dish.objects.create(name='Achichuk', price=10000)
+        Product.objects.create(name='Guruch', unit='kg', quantity=10, purchase_price=12000)
+
+    def test_prefix_match_ranks_name_above_description(self):
+        self.assertEqual(search.search_ids('dish', 'os'), [self.plov.pk, self.soup.pk])
+        self.assertEqual(search.search_ids('dish', 'guruch sab'), [self.plov.pk])
+        self.assertEqual(search.search_ids('dish', '"*) OR'), [])
+        self.assertEqual(search.search_ids('product', 'gur'), list(Product.objects.values_list('pk', flat=True)))
+
+    def test_index_follows_changes(self):
+        Dish.objects.filter(pk=self.salad.pk).update(name='Chuchvara')
+        self.assertEqual(search.search_ids('dish', 'chuch'), [self.salad.pk])
+        self.assertEqual(search.search_ids('dish', 'achi'), [])
+        self.plov.delete()
+        self.assertEqual(search.search_ids('dish', 'guruch'), [])
+
+    def test_typeahead_endpoint(self):
+        user = User.objects.create_user(username='waiter', password='waiter', email='waiter@example.com')
+        self.client.force_login(user)
+        response = self.client.get('/search/dish/', {'q': 'osh', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.plov.pk])
+        self.assertEqual(self.client.get('/search/table/', {'q': 'osh'}).status_code, 404)
+
+    def test_add_item_without_chosen_dish(self):
+        table = Table.objects.create(number=9)
+        response = self.client.post(f'/tables/{table.pk}/order/', {'action': 'add_item', 'dish_id': '', 'quantity': 1},
+                                    follow=True)
+        self.assertContains(response, 'Выберите блюдо из списка')
+        self.assertFalse(OrderItem.objects.exists())
+
+
+class TableOrderFormTests(TestCase):
+    def setUp(self):
+        self.table = Table.objects.create(number=7)
+        self.dish = Dish.objects.create(name='Lagmon', price=30000, portions=10)
+        self.url = f'/tables/{self.table.pk}/order/'
+
+    def add(self, quantity):
+        return self.client.post(self.url, {'action': 'add_item', 'dish_id': self.dish.pk, 'quantity': quantity},
+                                follow=True)
+
+    def test_bad_quantity_is_rejected(self):
+        for quantity in ('abc', '1.5', '0', '-2'):
+            self.assertContains(self.add(quantity), 'Введите корректное число!')
+        self.assertFalse(OrderItem.objects.exists())
+        self.add(1)
+        item = OrderItem.objects.get()
+        response = self.client.post(self.url, {'action': 'update_quantity', 'order_item_id': item.pk,
+                                               'quantity': 'abc'}, follow=True)
+        self.assertContains(response, 'Введите корректное число!')
+        self.assertEqual(OrderItem.objects.get().quantity, 1)
+
+    def test_repeat_add_increments_in_database(self):
+        self.add(2)
+        with CaptureQueriesContext(connection) as captured:
+            self.add(3)
+        updates = [query['sql'] for query in captured if query['sql'].startswith('UPDATE "main_orderitem"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"quantity" + ', updates[0])
+        self.assertEqual(OrderItem.objects.get().quantity, 5)
+
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.table = Table.objects.create(number=4, seats=4)
+        self.plov = Dish.objects.create(name='Osh', price=35000, portions=50)
+        self.tea = Dish.objects.create(name='Choy', price=5000, portions=50)
+
+    def sell(self, *lines, table=None, order_type='dine_in'):
+        order = Order.objects.create(table=table, order_type=order_type)
+        for dish, quantity in lines:
+            OrderItem.objects.create(order=order, dish=dish, quantity=quantity)
+        self.assertEqual(order.complete(), (True, []))
+        return order
+
+    def rollups(self):
+        orders = set(SalesRollup.objects.values_list('period', 'bucket', 'order_type', 'table_number',
+                                                     'orders', 'items', 'revenue'))
+        dishes = set(DishSalesRollup.objects.values_list('period', 'bucket', 'dish_id', 'orders', 'quantity',
+                                                         'revenue'))
+        return orders, dishes
+
+    def test_complete_increments_hour_and_day(self):
+        first = self.sell((self.plov, 2), (self.tea, 1), table=self.table)
+        self.sell((self.plov, 1), table=self.table)
+        completed_at = Order.objects.get(pk=first.pk).completed_at
+        for period in (analytics.HOUR, analytics.DAY):
+            bucket = analytics.bucket_start(completed_at, period)
+            row = SalesRollup.objects.get(period=period, bucket=bucket)
+            self.assertEqual((row.order_type, row.table_number, row.orders, row.items, row.revenue),
+                             ('dine_in', 4, 2, 4, 110000))
+            dishes = {row.dish_id: (row.orders, row.quantity, row.revenue)
+                      for row in DishSalesRollup.objects.filter(period=period, bucket=bucket)}
+            self.assertEqual(dishes, {self.plov.pk: (2, 3, 105000), self.tea.pk: (1, 1, 5000)})
+
+    def test_rebuild_matches_incremental(self):
+        self.sell((self.plov, 2), (self.tea, 3), table=self.table)
+        self.sell((self.tea, 1), order_type='takeaway')
+        incremental = self.rollups()
+        call_command('rebuild_sales_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_report_reads_only_rollups(self):
+        user = User.objects.create_user(username='manager', password='manager', email='manager@example.com')
+        self.client.force_login(user)
+        self.sell((self.plov, 1), table=self.table)
+
+        def report_queries():
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(self.client.get('/reports/sales/').status_code, 200)
+            return [query['sql'] for query in captured]
+
+        report_queries()
+        before = report_queries()
+        self.assertFalse([sql for sql in before if '"main_order"' in sql or '"main_orderitem"' in sql])
+        for _ in range(3):
+            self.sell((self.plov, 1), (self.tea, 2), table=self.table)
+        # Число запросов не зависит от числа заказов
+        with self.assertNumQueries(len(before)):
+            self.client.get('/reports/sales/')
+
+    def test_dashboard_stats_read_today_rollup(self):
+        self.sell((self.plov, 2), table=self.table)
+        self.sell((self.tea, 1))
+        Order.objects.create(table=self.table)
+        # Выручка — по ценам на момент продажи
+        Dish.objects.filter(pk=self.plov.pk).update(price=40000)
+        with self.assertNumQueries(1):
+            dashboard = stats.dashboard_stats()
+        self.assertEqual((dashboard['completed_today_count'], dashboard['active_orders_count']), (2, 1))
+        self.assertEqual(dashboard['revenue_today'], Decimal('75000.00'))
+        with self.assertNumQueries(0):
+            stats.dashboard_stats()
+
+
+class ForecastTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rice = Product.objects.create(name='Guruch', unit='kg', quantity=5, purchase_price=12000)
+        cls.salt = Product.objects.create(name='Tuz', unit='kg', quantity=50, purchase_price=3000)
+        cls.plov = Dish.objects.create(name='Osh', price=35000)
+        DishIngredient.objects.create(dish=cls.plov, product=cls.rice, quantity=200, unit='g')
+        cls.today = timezone.localdate()
+
+    def sell(self, days_ago, quantity):
+        day = self.today - timedelta(days=days_ago)
+        DishSalesRollup.objects.create(period=analytics.DAY, bucket=analytics.date_range(day, day)[0],
+                                       dish=self.plov, orders=1, quantity=quantity, revenue=0)
+
+    def test_incremental_refresh_matches_rebuild(self):
+        for days_ago, quantity in ((5, 10), (3, 30), (2, 20)):
+            self.sell(days_ago, quantity)
+        self.assertEqual(forecast.refresh(through=self.today - timedelta(days=3)), (2, forecast.HISTORY_DAYS))
+        self.assertEqual(forecast.refresh(through=self.today - timedelta(days=1)), (2, 2))
+        self.assertEqual(forecast.refresh(through=self.today - timedelta(days=1)), (0, 0))
+        incremental = dict(ProductForecast.objects.values_list('product_id', 'daily_rate'))
+
+        forecast.refresh(through=self.today - timedelta(days=1), rebuild=True)
+        rebuilt = dict(ProductForecast.objects.values_list('product_id', 'daily_rate'))
+        self.assertAlmostEqual(incremental[self.rice.pk], rebuilt[self.rice.pk])
+        self.assertEqual(incremental[self.salt.pk], 0)
+
+        rate = 0.0
+        for value in (2, 0, 6, 4, 0):  # кг риса за дни -5..-1
+            rate += forecast.ALPHA * (value - rate)
+        self.assertAlmostEqual(rebuilt[self.rice.pk], rate)
+
+    def test_daily_folds_match_rebuild(self):
+        sales = [0, 15, 40, 0, 0, 25, 10, 35, 0, 20, 5, 30]
+        for days_ago, quantity in enumerate(reversed(sales), start=1):
+            if quantity:
+                self.sell(days_ago, quantity)
+        # Ночная задача: каждый день учитывается только вчерашний день
+        for days_ago in range(len(sales), 0, -1):
+            forecast.refresh(through=self.today - timedelta(days=days_ago))
+        incremental = {row[0]: row[1:] for row in
+                       ProductForecast.objects.values_list('product_id', 'daily_rate', 'variance', 'last_day')}
+
+        forecast.refresh(through=self.today - timedelta(days=1), rebuild=True)
+        for product_id, daily_rate, variance, last_day in ProductForecast.objects.values_list(
+                'product_id', 'daily_rate', 'variance', 'last_day'):
+            self.assertAlmostEqual(incremental[product_id][0], daily_rate)
+            self.assertAlmostEqual(incremental[product_id][1], variance)
+            self.assertEqual(incremental[product_id][2], last_day)
+        self.assertGreater(incremental[self.rice.pk][1], 0)
+
+    def test_reorder_suggestions(self):
+        for days_ago in range(1, 15):
+            self.sell(days_ago, 20)  # 4 кг риса в день
+        forecast.refresh()
+        suggestions = forecast.suggestions(only_reorder=True)
+        self.assertEqual([suggestion.product for suggestion in suggestions], [self.rice])
+        rice = suggestions[0]
+        self.assertAlmostEqual(rice.days_of_cover, 5 / rice.daily_rate)
+        self.assertGreater(rice.quantity, rice.daily_rate * forecast.TARGET_DAYS)
+
+
+class ExchangeTests(TestCase):
+    def setUp(self):
+        self.rice = Product.objects.create(name='Guruch', unit='kg', quantity=10, purchase_price=12000)
+
+    def test_product_import_upserts_by_name_in_chunks(self):
+        data = ('name,unit,quantity,purchase_price\n'
+                'Guruch,kg,25,15000\n'
+                'Sabzi,kg,8,4000\n'
+                'Piyoz,tonna,3,3000\n'
+                'Tuz,kg,2,\n').encode()
+        with mock.patch.object(exchange, 'CHUNK_SIZE', 2):
+            result = exchange.import_file('products', io.BytesIO(data), 'csv')
+        self.assertEqual((result.created, result.updated), (1, 1))
+        self.assertEqual([line for line, _ in result.errors], [4, 5])
+
+        self.rice.refresh_from_db()
+        self.assertEqual((self.rice.quantity, self.rice.purchase_price), (25, 15000))
+        self.assertEqual(Product.objects.get(name='Sabzi').quantity, 8)
+        self.assertEqual(ledger.discrepancies(), [])
+
+    def test_recipe_import_refreshes_costs(self):
+        dish = Dish.objects.create(name='Osh', price=35000)
+        data = ('{"dish": "Osh", "product": "Guruch", "quantity": 200, "unit": "g"}\n'
+                '{"dish": "Osh", "product": "Go\'sht", "quantity": 100}\n').encode()
+        result = exchange.import_file('ingredients', io.BytesIO(data), 'jsonl')
+        self.assertEqual((result.created, result.updated), (1, 0))
+        self.assertEqual(result.errors, [(2, "Нет продукта «Go'sht»")])
+        dish.refresh_from_db()
+        self.assertEqual(dish.cost, 2400)
+
+    def test_streaming_export_round_trips(self):
+        user = User.objects.create_user(username='admin', password='admin', email='admin@example.com', is_staff=True)
+        self.client.force_login(user)
+        response = self.client.get('/data/export/products.csv')
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content)
+        self.assertEqual(content.decode().splitlines()[0], 'name,unit,quantity,purchase_price')
+
+        result = exchange.import_file('products', io.BytesIO(content), 'csv')
+        self.assertEqual((result.created, result.updated, result.errors), (0, 0, []))
+        self.assertEqual(Product.objects.count(), 1)
+
+    @override_settings(ASYNC_VIEWS=True)
+    async def test_export_streams_under_asgi(self):
+        await Product.objects.abulk_create(
+            Product(name=f'Ziravor {i}', unit='g', quantity=i, purchase_price=100) for i in range(5))
+        user = await User.objects.acreate_user(username='admin', password='admin', email='admin@example.com',
+                                               is_staff=True)
+        await self.async_client.aforce_login(user)
+        with mock.patch.object(exchange, 'EXPORT_CHUNK_SIZE', 2):
+            response = await self.async_client.get('/data/export/products.jsonl')
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+        # Заголовок не пишется в jsonl: 6 строк пачками по 2
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len(b''.join(chunks).decode().splitlines()), 6)
+
+
+class FloorTests(TestCase):
+    def setUp(self):
+        self.table = Table.objects.create(number=5, seats=4)
+        self.dish = Dish.objects.create(name='Plov', price=20000, portions=10)
+
+    def test_seat_opens_one_order_per_table(self):
+        order, created = floor.seat(self.table)
+        self.assertTrue(created)
+        # Параллельный официант не увидел заказ и упёрся в ограничение
+        with mock.patch.object(QuerySet, 'first', return_value=None):
+            again, created = floor.seat(Table.objects.get(pk=self.table.pk))
+        self.assertEqual((again, created), (order, False))
+        self.assertEqual(Order.objects.filter(table=self.table, is_completed=False).count(), 1)
+        self.assertTrue(Table.objects.get(pk=self.table.pk).is_occupied)
+
+    def test_complete_releases_table(self):
+        order, _ = floor.seat(self.table)
+        OrderItem.objects.create(order=order, dish=self.dish, quantity=2)
+        self.assertFalse(floor.toggle(Table.objects.get(pk=self.table.pk))[0])
+
+        self.assertTrue(order.complete()[0])
+        self.assertFalse(Table.objects.get(pk=self.table.pk).is_occupied)
+        self.assertFalse(floor.release(self.table.pk))
+
+    def test_toggle_drops_empty_order(self):
+        order, _ = floor.seat(self.table)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(floor.toggle(Table.objects.get(pk=self.table.pk))[0])
+        self.assertTrue(Event.objects.filter(kind='order', action='deleted', object_id=order.pk).exists())
+        self.assertFalse(Order.objects.filter(table=self.table).exists())
+        self.assertFalse(Table.objects.get(pk=self.table.pk).is_occupied)
+
+    def test_state_endpoint_is_one_query_and_versioned(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order, _ = floor.seat(self.table)
+            OrderItem.objects.create(order=order, dish=self.dish, quantity=3)
+        with self.assertNumQueries(1):
+            response = self.client.get('/tables/state/')
+        table = response.json()['tables'][0]
+        self.assertEqual((table['status'], table['order_id'], float(table['total'])), ('occupied', order.pk, 60000))
+        self.assertIsNotNone(table['seated_since'])
+
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/tables/state/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.complete()
+        response = self.client.get('/tables/state/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['tables'][0]['status'], 'free')
+
+
+def asgi_urlconf():
+    """urlconf проекта с асинхронными горячими view, как под Cafe/asgi.py"""
+    from . import urls
+    with override_settings(ASYNC_VIEWS=True):
+        patterns = importlib.reload(urls).urlpatterns
+    importlib.reload(urls)
+    urlconf = ModuleType('asgi_urls')
+    urlconf.urlpatterns = [path('admin/', admin.site.urls), path('', include(patterns))]
+    return urlconf
+
+
+class AsyncViewTests(TestCase):
+    """Асинхронные версии горячих view (CAFE_ASYNC_VIEWS=1)"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.enterClassContext(override_settings(ROOT_URLCONF=asgi_urlconf(), ASYNC_VIEWS=True))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='waiter', password='waiter', email='waiter@example.com')
+        cls.table = Table.objects.create(number=3)
+        cls.dish = Dish.objects.create(name='Plov', price=20000, portions=5)
+
+    async def test_anonymous_is_redirected(self):
+        response = await self.async_client.post(f'/dish/{self.dish.pk}/add-portions/', {'portions': 3})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/login/', response['Location'])
+        await self.dish.arefresh_from_db()
+        self.assertEqual(self.dish.portions, 5)
+
+    async def test_add_item_and_complete(self):
+        await self.async_client.aforce_login(self.user)
+        url = f'/tables/{self.table.pk}/order/'
+        response = await self.async_client.post(url, {'action': 'add_item', 'dish_id': self.dish.pk, 'quantity': 2})
+        self.assertEqual(response.status_code, 302)
+        order = await Order.objects.aget(table=self.table, is_completed=False)
+        self.assertEqual(await order.order_items.values_list('quantity', flat=True).aget(), 2)
+
+        response = await self.async_client.post(url, {'action': 'complete_order'})
+        self.assertRedirects(response, '/orders/', fetch_redirect_response=False)
+        await order.arefresh_from_db()
+        await self.dish.arefresh_from_db()
+        self.assertTrue(order.is_completed)
+        self.assertEqual(self.dish.portions, 3)
+
+    async def test_add_item_without_chosen_dish(self):
+        await self.async_client.aforce_login(self.user)
+        url = f'/tables/{self.table.pk}/order/'
+        response = await self.async_client.post(url, {'action': 'add_item', 'dish_id': '', 'quantity': 1})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(await OrderItem.objects.aexists())
+
+    async def test_add_item_with_bad_quantity(self):
+        await self.async_client.aforce_login(self.user)
+        url = f'/tables/{self.table.pk}/order/'
+        response = await self.async_client.post(url, {'action': 'add_item', 'dish_id': self.dish.pk, 'quantity': 'abc'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(await OrderItem.objects.aexists())
+
+    async def test_add_portions(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(f'/dish/{self.dish.pk}/add-portions/', {'portions': 4})
+        self.assertRedirects(response, '/menu/', fetch_redirect_response=False)
+        await self.dish.arefresh_from_db()
+        self.assertEqual(self.dish.portions, 9)
+
+    async def test_events_stream_only_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/tables/')
+        self.assertContains(response, 'data-events-url="/events/stream/"')
+        with override_settings(ASYNC_VIEWS=False):
+            response = await self.async_client.get('/tables/')
+        self.assertNotContains(response, 'data-events-url')
+        self.assertContains(response, 'data-events-feed-url="/events/"')
@@ -0,0 +1,48 @@
+"""
+Реестр единиц измерения и коэффициентов пересчёта.
+
+Таблица коэффициентов для всех пар единиц строится один раз при импорте.
+Штука условно считается 100 г (как и раньше в DishIngredient). Единицы из
+разных групп (масса и объём) не пересчитываются: коэффициент 1.
+"""
+from itertools import product as _pairs
+
+KG = 'kg'
+G = 'g'
+LITERS = 'liters'
+ML = 'ml'
+PIECES = 'pieces'
+
+# Единица -> (группа, множитель к базовой единице группы)
+UNITS = {
+    KG: ('mass', 1.0),
+    G: ('mass', 0.001),
+    PIECES: ('mass', 0.1),
+    LITERS: ('volume', 1.0),
+    ML: ('volume', 0.001),
+}
+
+
+def _compile():
+    rates = {}
+    for source, target in _pairs(UNITS, repeat=2):
+        source_group, source_factor = UNITS[source]
+        target_group, target_factor = UNITS[target]
+        if source == target or source_group != target_group:
+            rates[source, target] = 1.0
+        else:
+            # round убирает хвосты вида 1000.0000000000001
+            rates[source, target] = round(source_factor / target_factor, 9)
+    return rates
+
+
+RATES = _compile()
+
+
+def rate(source, target):
+    """Коэффициент пересчёта из `source` в `target` (1 для неизвестных пар)"""
+    return RATES.get((source, target), 1.0)
+
+
+def convert(quantity, source, target):
+    return quantity * rate(source, target)
@@ -1,18 +1,33 @@
+from django.conf import settings
 from django.urls import path
 from .views import *
 
+
+def hot(sync_view, async_view):
+    """Горячие view: под ASGI — асинхронные версии (settings.ASYNC_VIEWS)"""
+    return async_view if settings.ASYNC_VIEWS else sync_view
+
+
 urlpatterns = [
-   path('', Index, name='index'),
+   path('', hot(Index, index_async), name='index'),
+    path('stats/', dashboard_stats, name='dashboard_stats'),
+    path('perf/', perf_stats, name='perf_stats'),
+    path('jobs/<int:job_id>/', job_status, name='job_status'),
+    path('jobs/run/<str:name>/', job_enqueue, name='job_enqueue'),
+    path('search/<str:kind>/', search_api, name='search_api'),
     
      # Продукты
     path('stock/', product_list, name='stock'),
     path('stock/add/', product_add, name='product_add'),
+    path('stock/reorder/', reorder_suggestions, name='reorder_suggestions'),
     path('stock/<int:product_id>/edit/', product_edit, name='product_edit'),
     path('stock/<int:product_id>/delete/', product_delete, name='product_delete'),
     
     # Блюда
     path('menu/', dish_list, name='menu'),
     path('menu/add/', dish_add, name='dish_add'),
+    path('menu/plan/', production_plan, name='production_plan'),
+    path('menu/margins/', dish_margins, name='dish_margins'),
     path('menu/<int:dish_id>/', dish_detail, name='dish_detail'),
     path('menu/<int:dish_id>/edit/', dish_edit, name='dish_edit'),
     path('menu/<int:dish_id>/delete/', dish_delete, name='dish_delete'),
@@ -20,36 +35,44 @@ urlpatterns = [
     # Столы
     path('tables/', tables_list, name='tables'),
     path('tables/add/', table_add, name='table_add'),
+    path('tables/state/', floor_state, name='floor_state'),
     path('tables/<int:table_id>/edit/', table_edit, name='table_edit'),
     path('tables/<int:table_id>/delete/', table_delete, name='table_delete'),
     path('tables/<int:table_id>/toggle/', table_toggle, name='table_toggle'), 
-    path('tables/<int:table_id>/order/', table_order, name='table_order'), 
+    path('tables/<int:table_id>/order/', hot(table_order, table_order_async), name='table_order'), 
     
     # Заказы
-    path('orders/', orders_list, name='orders'),
+    path('orders/', hot(orders_list, orders_list_async), name='orders'),
     path('orders/create/', order_create, name='order_create'),
-    path('orders/<int:order_id>/', table_order, name='table_order_by_id'), 
+    path('orders/<int:order_id>/', hot(table_order, table_order_async), name='table_order_by_id'), 
+    path('orders/<int:order_id>/lines/', order_lines_api, name='order_lines_api'),
     path('orders/<int:order_id>/delete/', order_delete, name='order_delete'),
     
+    # Отчёты
+    path('reports/sales/', sales_report, name='sales_report'),
+    path('reports/sales/<str:section>.csv', sales_report_csv, name='sales_report_csv'),
+    
+    # Импорт и экспорт
+    path('data/', data_exchange, name='data_exchange'),
+    path('data/export/<str:kind>.<str:fmt>', data_export, name='data_export'),
+    
     # Регистрация
     path('register/', register_view, name='register'),
     path('login/', login_view, name='login'),
     path('logout/', logout_view, name='logout'),
     
-    path('dish/<int:dish_id>/add-portions/', add_portions, name='add_portions'),
+    path('dish/<int:dish_id>/add-portions/', hot(add_portions, add_portions_async), name='add_portions'),
+    
+    # Push-канал изменений
+    path('events/', events_feed, name='events_feed'),
+    path('events/stream/', events_stream, name='events_stream'),
 ]
 
 
 # Функция для обратной совместимости
 def table_order_legacy(request, table_id):
     table = get_object_or_404(Table, id=table_id)
-    # Создаем заказ для стола
-    order = Order.objects.create(
-        order_type='dine_in',
-        table=table
-    )
-    # Занимаем стол
-    table.is_occupied = True
-    table.save()
+    # Открываем заказ для стола и занимаем его
+    order, _ = floor.seat(table)
     
     return redirect('table_order', order_id=order.id)
\ No newline at end of file
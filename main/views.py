@@ -1,27 +1,153 @@
-from django.shortcuts import render, redirect, get_object_or_404 
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.conf import settings
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import IntegrityError
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from asgiref.sync import sync_to_async
+from datetime import date, datetime, timedelta
+import csv
+import json
 from .models import *
 from .forms import *
+from . import analytics, availability, events, exchange, floor, forecast, jobs, ledger, menu_cache, performance, production, search, stats
+from .db import write_atomic
 
 # Create your views here.
 @login_required
 def Index(request):
-    context = {
-        'dishes_count': Dish.objects.count(),
-        'products_count': Product.objects.count(),
-        'tables_count': Table.objects.count(),
-        'active_orders_count': Order.objects.filter(is_completed=False).count(),
-    }
-    return render(request, 'index.html', context)
+    return render(request, 'index.html', stats.dashboard_stats())
+
+
+@staff_member_required
+def perf_stats(request):
+    """Гистограммы задержек и SQL по имени URL (сводка всех процессов)"""
+    return JsonResponse(performance.collect())
+
+
+# Обслуживание, которое персонал может запустить кнопкой, не дожидаясь ответа
+MAINTENANCE_JOBS = {
+    'sales.rebuild': 'Пересборка сводок продаж',
+    'dish.refresh_costs': 'Пересчёт себестоимости блюд',
+    'stock.snapshot': 'Снимок остатков склада',
+    'stock.forecast': 'Пересчёт прогноза расхода',
+}
+
+
+@staff_member_required
+def job_enqueue(request, name):
+    if request.method != 'POST' or name not in MAINTENANCE_JOBS:
+        return HttpResponse(status=404)
+    job = jobs.enqueue(name, priority=Job.PRIORITY_LOW)
+    messages.success(request, f'{MAINTENANCE_JOBS[name]} поставлена в очередь (задача #{job.pk})')
+    next_url = request.POST.get('next')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        next_url = 'index'
+    return redirect(next_url)
+
+
+@login_required
+def job_status(request, job_id):
+    """JSON со статусом фоновой задачи — для опроса со страницы"""
+    return JsonResponse(get_object_or_404(Job, pk=job_id).as_dict())
+
+
+@login_required
+def search_api(request, kind):
+    """Подсказки для полей выбора блюда и продукта: ?q=...&limit=..."""
+    if kind not in search.INDEXES:
+        return HttpResponse(status=404)
+    try:
+        limit = int(request.GET.get('limit', search.DEFAULT_LIMIT))
+    except ValueError:
+        limit = search.DEFAULT_LIMIT
+    query = request.GET.get('q', '')
+    if kind == 'dish':
+        dishes = search.search('dish', query, limit, only=('name', 'price', 'portions'))
+        producible = availability.producible_portions([dish.pk for dish in dishes]) if dishes else {}
+        results = [{
+            'id': dish.pk,
+            'name': dish.name,
+            'price': str(dish.price),
+            'portions': dish.portions,
+            'producible': producible.get(dish.pk),
+        } for dish in dishes]
+    else:
+        results = [{
+            'id': product.pk,
+            'name': product.name,
+            'unit': product.get_unit_display(),
+            'available': product.available_quantity(),
+        } for product in search.search('product', query, limit)]
+    response = JsonResponse({'results': results})
+    response['Cache-Control'] = 'private, max-age=30'
+    return response
+
+
+@login_required
+def dashboard_stats(request):
+    """JSON для настенных экранов: те же показатели, что и на панели"""
+    data = stats.dashboard_stats()
+    data['revenue_today'] = str(data['revenue_today'])
+    return JsonResponse(data)
 
 
 # Продукты - CRUD
+PRODUCTS_PAGE_SIZE = 50
+
+
 def product_list(request):
-    products = Product.objects.all()
-    return render(request, 'product_list.html', {'products': products})
+    # ?q= — поиск по индексу, иначе keyset-страницы по id
+    query = request.GET.get('q', '').strip()
+    after = request.GET.get('after', '')
+    next_cursor = None
+    if query:
+        products = search.search('product', query, limit=search.MAX_LIMIT)
+    else:
+        products = Product.objects.order_by('id')
+        if after.isdigit():
+            products = products.filter(id__gt=int(after))
+        products = list(products[:PRODUCTS_PAGE_SIZE + 1])
+        if len(products) > PRODUCTS_PAGE_SIZE:
+            products = products[:PRODUCTS_PAGE_SIZE]
+            next_cursor = products[-1].pk
+    # ?as_of=2024-05-01T18:00 — остатки на момент времени по журналу склада
+    as_of = request.GET.get('as_of')
+    if as_of:
+        try:
+            moment = timezone.make_aware(datetime.fromisoformat(as_of))
+        except ValueError:
+            messages.error(request, 'Некорректная дата')
+            as_of = None
+        else:
+            balances = ledger.balances([product.pk for product in products], moment)
+            for product in products:
+                product.quantity, product.reserved_quantity = balances[product.pk]
+    return render(request, 'product_list.html', {
+        'products': products,
+        'as_of': as_of,
+        'query': query,
+        'is_first_page': not after,
+        'next_cursor': next_cursor,
+    })
+
+def reorder_suggestions(request):
+    """Прогноз расхода: запас в днях и что пора заказать"""
+    only_reorder = request.GET.get('all') != '1'
+    return render(request, 'reorder.html', {
+        'suggestions': forecast.suggestions(only_reorder=only_reorder),
+        'only_reorder': only_reorder,
+        'lead_days': forecast.LEAD_DAYS,
+        'target_days': forecast.TARGET_DAYS,
+    })
 
 def product_add(request):
     if request.method == 'POST':
@@ -54,13 +180,17 @@ def product_delete(request, product_id):
     return redirect('stock')
 
 # Блюда - CRUD
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=menu_cache.etag, last_modified_func=menu_cache.last_modified)
 def dish_list(request):
-    dishes = Dish.objects.all()
-    has_planned_dishes = dishes.filter(portions__gt=0).exists()
+    # Список вычисляется лениво: при попадании во фрагментный кэш ORM не вызывается
+    dishes = SimpleLazyObject(lambda: availability.annotate_dishes(Dish.objects.all()))
     
     return render(request, 'dish_list.html', {
         'dishes': dishes,
-        'has_planned_dishes': has_planned_dishes
+        'has_planned_dishes': lambda: any(dish.portions > 0 for dish in dishes),
+        'menu_version': menu_cache.get_version(),
+        'menu_client': menu_cache.client_key(request),
     })
 
 def dish_add(request):
@@ -112,26 +242,24 @@ def dish_delete(request, dish_id):
 
 def dish_detail(request, dish_id):
     dish = get_object_or_404(Dish, id=dish_id)
-    ingredients = dish.ingredients.all()
+    ingredients = dish.ingredients.select_related('product')
     
-    cost = 0
+    # Итоги — из сохранённых cost/margin (их ведёт refresh_costs), строки — для расшифровки
     ingredients_with_cost = []
-    
     for ingredient in ingredients:
-        converted_quantity = ingredient.get_quantity_in_product_units()
-        ingredient_cost = converted_quantity * float(ingredient.product.purchase_price)
-        cost += ingredient_cost
+        converted_quantity = ingredient.base_quantity
         ingredients_with_cost.append({
             'ingredient': ingredient,
             'converted_quantity': converted_quantity,
-            'cost': ingredient_cost
+            'cost': converted_quantity * float(ingredient.product.purchase_price)
         })
     
-    profit = float(dish.price) - cost
+    cost = dish.cost
+    profit = dish.margin
     
     # Расчет коэффициента наценки
     if cost > 0:
-        dish_price_ratio = float(dish.price) / cost
+        dish_price_ratio = dish.price / cost
     else:
         dish_price_ratio = 0
     
@@ -145,19 +273,41 @@ def dish_detail(request, dish_id):
         'profit': profit,
         'dish_price_ratio': dish_price_ratio,
         'available_portions': available_portions,  # Добавляем количество порций
-        'can_be_prepared': available_portions > 0  # Можно ли приготовить
+        'can_be_prepared': available_portions is None or available_portions > 0  # Можно ли приготовить
     })
 
+MARGIN_SORTS = {
+    'margin': '-margin',
+    'cost': '-cost',
+    'price': '-price',
+    'name': 'name',
+}
+
+
+def dish_margins(request):
+    """Меню-инжиниринг: себестоимость и маржа всех блюд одним запросом"""
+    sort = request.GET.get('sort', 'margin')
+    dishes = Dish.objects.only('name', 'price', 'cost', 'margin').order_by(
+        MARGIN_SORTS.get(sort, '-margin'), 'id')
+    return render(request, 'dish_margins.html', {'dishes': dishes, 'sort': sort})
+
 # Столы - CRUD
 def tables_list(request):
-    tables = Table.objects.all()
-    return render(request, 'tables.html', {'tables': tables})
+    return render(request, 'tables.html', {'tables': floor.state()['tables']})
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=floor.etag)
+def floor_state(request):
+    """JSON план зала: статус, открытый заказ, сумма и время посадки каждого стола"""
+    return JsonResponse(floor.state())
 
 def table_add(request):
     if request.method == 'POST':
         form = TableForm(request.POST)
         if form.is_valid():
             form.save()
+            floor.bump()
             messages.success(request, 'Стол успешно добавлен!')
             return redirect('tables')
     else:
@@ -170,6 +320,7 @@ def table_edit(request, table_id):
         form = TableForm(request.POST, instance=table)
         if form.is_valid():
             form.save()
+            floor.bump()
             messages.success(request, 'Стол успешно обновлен!')
             return redirect('tables')
     else:
@@ -180,22 +331,165 @@ def table_delete(request, table_id):
     table = get_object_or_404(Table, id=table_id)
     table_number = table.number
     table.delete()
+    floor.bump()
     messages.success(request, f'Стол #{table_number} удален!')
     return redirect('tables')
 
 def table_toggle(request, table_id):
     table = get_object_or_404(Table, id=table_id)
-    table.is_occupied = not table.is_occupied
-    table.save()
-    
-    status = "занят" if table.is_occupied else "свободен"
-    messages.success(request, f'Стол #{table.number} теперь {status}')
+    changed, message = floor.toggle(table)
+    (messages.success if changed else messages.error)(request, message)
     return redirect('tables')
 
 # Заказы
+ORDERS_PAGE_SIZE = 50
+
+
+def _encode_order_cursor(order):
+    return f"{order.created_at.isoformat()}_{order.id}"
+
+
+def _decode_order_cursor(cursor):
+    """Разбирает курсор вида '<created_at>_<id>', при ошибке возвращает None"""
+    try:
+        created_at, order_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _orders_query(request):
+    """Запрос страницы заказов по фильтрам и курсору: (queryset, контекст без страницы)"""
+    orders = (Order.objects.with_subtotal()
+              .select_related('table')
+              .order_by('-created_at', '-id'))
+
+    status = request.GET.get('status', '')
+    if status == 'active':
+        orders = orders.filter(is_completed=False)
+    elif status == 'completed':
+        orders = orders.filter(is_completed=True)
+
+    order_type = request.GET.get('type', '')
+    if order_type in dict(Order.ORDER_TYPES):
+        orders = orders.filter(order_type=order_type)
+
+    # Keyset-пагинация по (created_at, id): страница стоит одинаково при любой истории
+    cursor = _decode_order_cursor(request.GET.get('after'))
+    if cursor:
+        created_at, order_id = cursor
+        orders = orders.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id)
+        )
+
+    return orders[:ORDERS_PAGE_SIZE + 1], {
+        'status': status,
+        'order_type': order_type,
+        'order_types': Order.ORDER_TYPES,
+        'is_first_page': cursor is None,
+    }
+
+
+def _orders_page(page, context):
+    next_cursor = None
+    if len(page) > ORDERS_PAGE_SIZE:
+        page = page[:ORDERS_PAGE_SIZE]
+        next_cursor = _encode_order_cursor(page[-1])
+    return dict(context, orders=page, next_cursor=next_cursor)
+
+
 def orders_list(request):
-    orders = Order.objects.all().order_by('-created_at')
-    return render(request, 'orders.html', {'orders': orders})
+    orders, context = _orders_query(request)
+    return render(request, 'orders.html', _orders_page(list(orders), context))
+
+# Отчёты по продажам (читают только сводные таблицы)
+REPORT_DAYS = 30
+
+
+def _report_params(request):
+    today = timezone.localdate()
+    try:
+        end = date.fromisoformat(request.GET.get('to') or today.isoformat())
+        start = date.fromisoformat(request.GET.get('from') or (end - timedelta(days=REPORT_DAYS - 1)).isoformat())
+    except ValueError:
+        end, start = today, today - timedelta(days=REPORT_DAYS - 1)
+    if start > end:
+        start, end = end, start
+    period = request.GET.get('period', analytics.DAY)
+    if period not in (analytics.HOUR, analytics.DAY):
+        period = analytics.DAY
+    return start, end, period
+
+
+@login_required
+def sales_report(request):
+    start, end, period = _report_params(request)
+    report = analytics.sales_report(start, end, period)
+    order_types = dict(Order.ORDER_TYPES)
+    for row in report.by_order_type:
+        row['label'] = order_types.get(row['order_type'], row['order_type'])
+    return render(request, 'sales_report.html', {'report': report})
+
+
+@login_required
+def sales_report_csv(request, section):
+    if section not in analytics.EXPORTS:
+        return HttpResponse(status=404)
+    start, end, period = _report_params(request)
+    report = analytics.sales_report(start, end, period, top=None)
+    response = HttpResponse(content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="sales-{section}-{start}-{end}.csv"'
+    csv.writer(response).writerows(analytics.export_rows(report, section))
+    return response
+
+
+# Импорт и экспорт данных
+EXCHANGE_KINDS = {
+    'products': 'Mahsulotlar',
+    'dishes': 'Taomlar',
+    'ingredients': 'Retseptlar',
+    'orders': 'Buyurtmalar',
+    'order_lines': 'Buyurtma qatorlari',
+}
+
+
+@staff_member_required
+def data_exchange(request):
+    """Загрузка CSV/JSON Lines со справочниками и ссылки на выгрузки"""
+    result = None
+    if request.method == 'POST':
+        kind = request.POST.get('kind')
+        upload = request.FILES.get('file')
+        if kind not in exchange.IMPORTS or upload is None:
+            messages.error(request, 'Выберите тип данных и файл')
+        else:
+            fmt = 'jsonl' if upload.name.lower().endswith(('.jsonl', '.json')) else 'csv'
+            result = exchange.import_file(kind, upload.file, fmt)
+            messages.success(request, f'Импорт: создано {result.created}, обновлено {result.updated}, '
+                                      f'ошибок {len(result.errors)}')
+    return render(request, 'data_exchange.html', {
+        'import_kinds': [(kind, EXCHANGE_KINDS[kind]) for kind in exchange.IMPORTS],
+        'export_kinds': [(kind, EXCHANGE_KINDS[kind]) for kind in exchange.EXPORTS],
+        'formats': exchange.FORMATS,
+        'result': result,
+    })
+
+
+@staff_member_required
+def data_export(request, kind, fmt):
+    """Потоковая выгрузка: строки читаются из БД порциями по мере отправки"""
+    if kind not in exchange.EXPORTS or fmt not in exchange.FORMATS:
+        return HttpResponse(status=404)
+    start = end = None
+    if request.GET.get('from') or request.GET.get('to'):
+        report_start, report_end, _ = _report_params(request)
+        start, end = analytics.date_range(report_start, report_end)
+    content_type = 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/x-ndjson; charset=utf-8'
+    stream = exchange.astream if settings.ASYNC_VIEWS else exchange.stream
+    response = StreamingHttpResponse(stream(kind, fmt, start, end), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
 
 def order_create(request):
     if request.method == 'POST':
@@ -205,6 +499,7 @@ def order_create(request):
             phone_number=request.POST.get('phone_number', ''),
             address=request.POST.get('address', ''),
         )
+        events.publish('order', 'created', order.id, order_type=order.order_type)
         messages.success(request, f'Заказ #{order.id} создан!')
         return redirect('table_order_by_id', order_id=order.id)
     
@@ -216,7 +511,12 @@ def order_create(request):
 def order_delete(request, order_id):
     order = get_object_or_404(Order, id=order_id)
     order_number = order.id
-    order.delete()
+    with write_atomic():
+        order.delete()
+        # Удалённый открытый заказ больше не держит стол
+        if order.table_id and not order.is_completed:
+            floor.release(order.table_id)
+    events.publish('order', 'deleted', order_number)
     messages.success(request, f'Заказ #{order_number} удален!')
     return redirect('orders')
 
@@ -227,28 +527,27 @@ def table_order(request, table_id=None, order_id=None):
     if table_id:
         # Старый вариант: создаем заказ для стола
         table = get_object_or_404(Table, id=table_id)
-        order, created = Order.objects.get_or_create(
-            table=table,
-            is_completed=False
-        )
+        order, created = floor.seat(table)
         
-        # Если заказ создан впервые, занимаем стол
-        if created and not table.is_occupied:
-            table.is_occupied = True
-            table.save()
+        # Если заказ создан впервые, стол занят
+        if created:
             messages.success(request, f'Стол {table.number} теперь занят!')
     else:
         # Новый вариант: работа с существующим заказом
         order = get_object_or_404(Order, id=order_id)
     
-    dishes = Dish.objects.all()
-    
     if request.method == 'POST':
         action = request.POST.get('action')
         
-        if action == 'add_item':
-            dish_id = request.POST.get('dish_id')
-            quantity = int(request.POST.get('quantity', 1))
+        if action == 'add_item' and _posted_dish_id(request) is None:
+            messages.error(request, 'Выберите блюдо из списка')
+
+        elif action in ('add_item', 'update_quantity') and _posted_quantity(request) is None:
+            messages.error(request, 'Введите корректное число!')
+
+        elif action == 'add_item':
+            dish_id = _posted_dish_id(request)
+            quantity = _posted_quantity(request)
             
             dish = get_object_or_404(Dish, id=dish_id)
             
@@ -260,63 +559,41 @@ def table_order(request, table_id=None, order_id=None):
             )
             
             if not created:
-                order_item.quantity += quantity
-                order_item.save()
+                # Прибавляем на стороне БД: параллельные добавления не теряются
+                OrderItem.objects.filter(pk=order_item.pk).update(quantity=F('quantity') + quantity)
+                order_item.refresh_from_db(fields=['quantity'])
+            events.publish('order', 'item_added', order.id, item_id=order_item.id,
+                           dish_id=dish.id, quantity=order_item.quantity)
                 
             messages.success(request, f'{dish.name} заказ добавлен!')
             
         elif action == 'update_quantity':
             order_item_id = request.POST.get('order_item_id')
-            quantity = int(request.POST.get('quantity', 1))
-    
-            print(f"Updating item {order_item_id} to quantity {quantity}")  # Для дебага
+            quantity = _posted_quantity(request)
     
             try:
                 order_item = OrderItem.objects.get(id=order_item_id, order=order)
                 if quantity >= 1:
                     order_item.quantity = quantity
                     order_item.save()
-                    print(f"Successfully updated to {quantity}")
+                    events.publish('order', 'item_updated', order.id, item_id=order_item.id,
+                                   dish_id=order_item.dish_id, quantity=quantity)
                 else:
+                    events.publish('order', 'item_removed', order.id, item_id=order_item.id)
                     order_item.delete()
-                    print("Item deleted")
             except OrderItem.DoesNotExist:
-                print("Item not found")
                 messages.error(request, 'Позиция не найдена')
                 
         elif action == 'remove_item':
             order_item_id = request.POST.get('order_item_id')
-            OrderItem.objects.filter(id=order_item_id, order=order).delete()
+            deleted, _ = OrderItem.objects.filter(id=order_item_id, order=order).delete()
+            if deleted:
+                events.publish('order', 'item_removed', order.id, item_id=int(order_item_id))
             messages.success(request, 'Блюдо удалено из заказа!')
             
         elif action == 'complete_order':
-            # Списание продуктов со склада
-            success = deduct_products_from_stock(order)
-            
-            if success:
-                # Завершаем заказ
-                order.is_completed = True
-                order.save()
-                
-                # Освобождаем стол если он был занят
-                if order.table:
-                    order.table.is_occupied = False
-                    order.table.save()
-                
-                messages.success(request, f'Заказ #{order.id} завершен! Продукты списаны со склада.')
-            else:
-                order_items = order.order_items.all()
-                problematic_dishes = []
-        
-                for item in order_items:
-                    if item.dish.get_available_planned_portions() < item.quantity:
-                        problematic_dishes.append(
-                            f"{item.dish.name} (нужно: {item.quantity}, доступно: {item.dish.get_available_planned_portions()})"
-                        )
-        
-                messages.error(request, 
-                    f'Недостаточно запланированных порций для заказа! Проблемы: {", ".join(problematic_dishes)}')
-            
+            # Списание порций, завершение заказа и освобождение стола — одной транзакцией
+            _complete_order_messages(request, order, *order.complete())
             return redirect('orders')
             
         if table_id:
@@ -324,46 +601,207 @@ def table_order(request, table_id=None, order_id=None):
         else:
             return redirect('table_order_by_id', order_id=order.id)  # Исправлено: order.id вместо order_id
     
-    order_items = order.order_items.all()
-    
+    order_items = order.order_items.select_related('dish')
+    context = _table_order_context(order, table if table_id else None, order_items, order.total_price())
+    return render(request, 'table_order.html', context)
+
+
+def _posted_dish_id(request):
+    """id блюда из формы добавления; None, если подсказка не выбрана"""
+    try:
+        return int(request.POST.get('dish_id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _posted_quantity(request):
+    """Количество из формы (по умолчанию 1); None, если это не целое число
+    или добавление меньше одной порции"""
+    try:
+        quantity = int(request.POST.get('quantity') or 1)
+    except ValueError:
+        return None
+    if request.POST.get('action') == 'add_item' and quantity < 1:
+        return None
+    return quantity
+
+
+def _complete_order_messages(request, order, success, shortages):
+    if success:
+        messages.success(request, f'Заказ #{order.id} завершен! Продукты списаны со склада.')
+    elif shortages:
+        problematic_dishes = [
+            f"{shortage.name} (нужно: {shortage.required}, доступно: {shortage.available})"
+            for shortage in shortages
+        ]
+        messages.error(request, 
+            f'Недостаточно запланированных порций для заказа! Проблемы: {", ".join(problematic_dishes)}')
+    else:
+        messages.error(request, f'Заказ #{order.id} уже завершен')
+
+
+def _table_order_context(order, table, order_items, subtotal):
     # Расчет суммы заказа с чаевыми
-    subtotal = order.total_price()
-    service_fee = subtotal * Decimal('0.10')
-    total_with_service = subtotal + service_fee
-    
-    context = {
+    service_fee = subtotal * SERVICE_FEE_RATE
+    return {
         'order': order,
-        'dishes': dishes,
+        'table': table,
         'order_items': order_items,
         'subtotal': subtotal,
         'service_fee': service_fee,
-        'total_with_service': total_with_service,
+        'total_with_service': subtotal + service_fee,
     }
-    
-    # Если это заказ без стола, передаем table как None
-    if not table_id:
-        context['table'] = None
-    else:
-        context['table'] = table
-    
-    return render(request, 'table_order.html', context)
 
-def deduct_products_from_stock(order):
-    """Списать порции для заказа (теперь просто порции, без продуктов)"""
-    order_items = order.order_items.all()
-    
-    # Проверяем хватает ли порций
-    for item in order_items:
-        if item.dish.portions < item.quantity:
-            return False
-    
-    # Списываем порции
-    for item in order_items:
-        item.dish.use_portions(item.quantity)
-    
-    return True
-    
-    
+SERVICE_FEE_RATE = Decimal('0.10')
+
+
+def _order_totals(order):
+    subtotal = order.total_price()
+    service_fee = subtotal * SERVICE_FEE_RATE
+    return {
+        'subtotal': str(subtotal),
+        'service_fee': str(service_fee.quantize(Decimal('0.01'))),
+        'total_with_service': str((subtotal + service_fee).quantize(Decimal('0.01'))),
+    }
+
+
+def _line_json(item):
+    return {
+        'id': item.id,
+        'dish_id': item.dish_id,
+        'name': item.dish.name,
+        'price': str(item.dish.price),
+        'quantity': item.quantity,
+        'total': str(item.total),
+        'removed': False,
+    }
+
+
+class OrderLinesError(Exception):
+    pass
+
+
+def _op_quantity(op):
+    """Количество операции: целое число или строка с целым числом"""
+    value = op.get('quantity', 1)
+    if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise OrderLinesError('Некорректное количество')
+    return value
+
+
+def _apply_line_ops(order, ops):
+    """
+    Применить пакет операций над строками заказа.
+
+    Операции: {"op": "add", "dish_id", "quantity"}, {"op": "set", "item_id", "quantity"},
+    {"op": "remove", "item_id"}. Возвращает список изменённых строк (JSON).
+    """
+    if not isinstance(ops, list):
+        raise OrderLinesError('Операции должны быть списком')
+    if not ops:
+        raise OrderLinesError('Пустой список операций')
+
+    dish_ids, item_ids = set(), set()
+    for op in ops:
+        if not isinstance(op, dict):
+            raise OrderLinesError('Некорректная операция')
+        try:
+            if op.get('op') == 'add':
+                dish_ids.add(int(op['dish_id']))
+            elif op.get('op') in ('set', 'remove'):
+                item_ids.add(int(op['item_id']))
+            else:
+                raise OrderLinesError(f"Неизвестная операция: {op.get('op')}")
+        except (KeyError, TypeError, ValueError):
+            raise OrderLinesError('Некорректная операция')
+
+    # Все затронутые строки и блюда — двумя запросами
+    lines = list(order.order_items.select_related('dish').filter(Q(dish_id__in=dish_ids) | Q(id__in=item_ids)))
+    by_id = {line.id: line for line in lines}
+    by_dish = {line.dish_id: line for line in lines}
+    # Блюда всех add: после remove строки того же блюда она создаётся заново
+    dishes = Dish.objects.in_bulk(dish_ids)
+
+    increments, absolute, created, removed = {}, set(), {}, set()
+    for op in ops:
+        kind = op['op']
+        quantity = _op_quantity(op)
+
+        if kind == 'add':
+            if quantity < 1:
+                raise OrderLinesError('Некорректное количество')
+            dish_id = int(op['dish_id'])
+            line = by_dish.get(dish_id)
+            if line is None or line.id in removed:
+                if dish_id not in dishes:
+                    raise OrderLinesError(f'Блюдо #{dish_id} не найдено')
+                line = created.setdefault(dish_id, OrderItem(order=order, dish=dishes[dish_id], quantity=0))
+                line.quantity += quantity
+                continue
+            line.quantity += quantity
+            if line.id not in absolute:
+                increments[line.id] = increments.get(line.id, 0) + quantity
+            continue
+
+        line = by_id.get(int(op['item_id']))
+        if line is None or line.id in removed:
+            raise OrderLinesError('Позиция не найдена')
+        if kind == 'remove' or quantity < 1:
+            removed.add(line.id)
+        else:
+            line.quantity = quantity
+            absolute.add(line.id)
+            increments.pop(line.id, None)
+
+    with write_atomic():
+        if removed:
+            OrderItem.objects.filter(order=order, id__in=removed).delete()
+        # Прибавки — через F(), чтобы не потерять параллельные изменения
+        for line_id, delta in increments.items():
+            if line_id not in removed:
+                OrderItem.objects.filter(pk=line_id).update(quantity=F('quantity') + delta)
+        to_set = [by_id[line_id] for line_id in absolute - removed]
+        if to_set:
+            OrderItem.objects.bulk_update(to_set, ['quantity'])
+        new_lines = OrderItem.objects.bulk_create(list(created.values()))
+
+    # Перечитываем изменённые строки одним запросом: прибавки могли совпасть с чужими
+    changed_ids = ((set(increments) | absolute) - removed) | {line.pk for line in new_lines}
+    changed = order.order_items.select_related('dish').filter(id__in=changed_ids).order_by('id')
+    result = [_line_json(line) for line in changed]
+    result += [{'id': line_id, 'removed': True} for line_id in sorted(removed)]
+    return result
+
+
+def order_lines_api(request, order_id):
+    """JSON API: пакет операций над строками заказа в одной транзакции"""
+    order = get_object_or_404(Order, id=order_id)
+    if request.method != 'POST':
+        return JsonResponse({'ok': False, 'error': 'Только POST'}, status=405)
+    if order.is_completed:
+        return JsonResponse({'ok': False, 'error': 'Заказ уже завершен'}, status=409)
+
+    try:
+        payload = json.loads(request.body or b'{}')
+        if isinstance(payload, dict):
+            payload = payload.get('ops')
+        elif not isinstance(payload, list):
+            raise OrderLinesError('Ожидается объект {"ops": [...]} или список операций')
+        lines = _apply_line_ops(order, payload)
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'Некорректный JSON'}, status=400)
+    except OrderLinesError as error:
+        return JsonResponse({'ok': False, 'error': str(error)}, status=400)
+    except IntegrityError:
+        # Параллельно добавили ту же позицию (одна строка на блюдо) — клиент повторит запрос
+        return JsonResponse({'ok': False, 'error': 'Заказ изменён параллельно, повторите'}, status=409)
+
+    events.publish('order', 'lines_changed', order.id,
+                   item_ids=[line['id'] for line in lines if line.get('id')])
+    return JsonResponse({'ok': True, 'lines': lines, 'totals': _order_totals(order)})
+
 
 def register_view(request):
     if request.method == 'POST':
@@ -404,20 +842,225 @@ def logout_view(request):
 def add_portions(request, dish_id):
     """Добавить порции и списать продукты со склада"""
     dish = get_object_or_404(Dish, id=dish_id)
-    
     if request.method == 'POST':
-        portions = request.POST.get('portions', 0)
+        _add_portions(request, dish)
+    return redirect('menu')
+
+
+def _add_portions(request, dish):
+    """Заготовка порций по POST-форме: списание склада и сообщение пользователю"""
+    try:
+        portions = int(request.POST.get('portions', 0))
+    except ValueError:
+        messages.error(request, 'Введите корректное число!')
+        return
+    if portions <= 0:
+        messages.error(request, 'Введите положительное число!')
+        return
+    success, message = dish.add_portions(portions)
+    if success:
+        events.publish('dish', 'portions_changed', dish.id, portions=dish.portions)
+        messages.success(request, f'✅ Добавлено {portions} порций "{dish.name}"! Продукты списаны со склада.')
+    else:
+        messages.error(request, f'❌ Не удалось добавить порции: {message}')
+
+
+@login_required
+def production_plan(request):
+    """Пакетная заготовка порций по плану дня (форма или JSON)"""
+    if request.content_type == 'application/json':
+        try:
+            payload = json.loads(request.body or b'{}')
+            plan = production.clean_plan(payload.get('plan', {}))
+        except (ValueError, TypeError, AttributeError):
+            return JsonResponse({'ok': False, 'error': 'Некорректный план'}, status=400)
+        mode = payload.get('mode', production.MODE_EXACT)
+        if mode not in production.MODES:
+            return JsonResponse({'ok': False, 'error': 'Неизвестный режим'}, status=400)
+
+        try:
+            # apply_plan проверяет блюда сам; оптимизацию и пробный прогон проверяем заранее
+            if mode != production.MODE_EXACT or payload.get('dry_run'):
+                production.check_dishes(plan)
+            if mode != production.MODE_EXACT:
+                plan = production.optimize_plan(plan, mode)
+            if payload.get('dry_run'):
+                return JsonResponse({'ok': True, 'plan': plan, 'applied': False})
+            result = production.apply_plan(plan)
+        except production.PlanError as e:
+            return JsonResponse({'ok': False, 'error': str(e), 'unknown': e.unknown}, status=400)
+        return JsonResponse({
+            'ok': result.ok,
+            'plan': plan,
+            'applied': result.ok,
+            'shortages': [shortage._asdict() for shortage in result.shortages],
+        }, status=200 if result.ok else 409)
+
+    dishes = availability.annotate_dishes(Dish.objects.all())
+    plan = {}
+    if request.method == 'POST':
         try:
-            portions = int(portions)
-            if portions > 0:
-                success, message = dish.add_portions(portions)
-                if success:
-                    messages.success(request, f'✅ Добавлено {portions} порций "{dish.name}"! Продукты списаны со склада.')
+            plan = production.clean_plan({
+                dish.pk: request.POST.get(f'portions_{dish.pk}') or 0 for dish in dishes
+            })
+        except ValueError:
+            messages.error(request, 'Введите корректное число!')
+        else:
+            mode = request.POST.get('mode', production.MODE_EXACT)
+            if mode in (production.MODE_MAX_PORTIONS, production.MODE_MAX_VALUE):
+                # Оптимизированный план только предлагается, применяет его повар
+                plan = production.optimize_plan(plan, mode)
+                messages.info(request, 'План подобран по остаткам склада. Проверьте и подтвердите.')
+            elif plan:
+                try:
+                    result = production.apply_plan(plan)
+                except production.PlanError as e:
+                    messages.error(request, f'❌ Не удалось применить план: {e}')
                 else:
-                    messages.error(request, f'❌ Не удалось добавить порции: {message}')
+                    if result.ok:
+                        messages.success(request, f'✅ План применён: {sum(plan.values())} порций. Продукты списаны со склада.')
+                        return redirect('menu')
+                    messages.error(request, f'❌ Не удалось применить план: {result.message}')
             else:
                 messages.error(request, 'Введите положительное число!')
-        except ValueError:
+
+    for dish in dishes:
+        dish.planned = plan.get(dish.pk, '')
+    return render(request, 'production_plan.html', {'dishes': dishes})
+
+
+# Push-канал изменений
+def _events_cursor(request):
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get('cursor')
+    try:
+        return int(cursor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _events_kinds(request):
+    return [kind for kind in request.GET.get('kinds', '').split(',') if kind] or None
+
+
+def events_feed(request):
+    """JSON-лента событий после курсора (догрузка после переподключения)"""
+    cursor = _events_cursor(request)
+    if cursor is None:
+        return JsonResponse({'cursor': events.latest_cursor(), 'events': []})
+
+    feed = events.events_since(cursor, kinds=_events_kinds(request))
+    return JsonResponse({
+        'cursor': feed[-1]['id'] if feed else cursor,
+        'events': feed,
+    })
+
+
+async def events_stream(request):
+    """SSE-поток событий; требует ASGI-сервер (см. Cafe/asgi.py)"""
+    cursor = _events_cursor(request)
+    if cursor is None:
+        cursor = await sync_to_async(events.latest_cursor)()
+
+    response = StreamingHttpResponse(
+        events.stream(cursor, kinds=_events_kinds(request)),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Асинхронные версии горячих view для ASGI (CAFE_ASYNC_VIEWS=1, включается в Cafe/asgi.py).
+# Чтения и простые записи идут через async ORM; атомарные операции (завершение заказа,
+# заготовка порций) — в потоке через sync_to_async: async ORM не поддерживает транзакции.
+# Шаблоны тоже рендерятся в потоке: в них есть ленивые запросы (меню, фрагментный кэш).
+async def _arender(request, template_name, context):
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@login_required
+async def index_async(request):
+    return await _arender(request, 'index.html', await sync_to_async(stats.dashboard_stats)())
+
+
+async def orders_list_async(request):
+    orders, context = _orders_query(request)
+    page = [order async for order in orders]
+    return await _arender(request, 'orders.html', _orders_page(page, context))
+
+
+async def table_order_async(request, table_id=None, order_id=None):
+    table = None
+    if table_id:
+        table = await aget_object_or_404(Table, id=table_id)
+        order, created = await sync_to_async(floor.seat)(table)
+        if created:
+            messages.success(request, f'Стол {table.number} теперь занят!')
+    else:
+        order = await aget_object_or_404(Order, id=order_id)
+
+    if request.method == 'POST':
+        action = request.POST.get('action')
+
+        if action == 'add_item' and _posted_dish_id(request) is None:
+            messages.error(request, 'Выберите блюдо из списка')
+
+        elif action in ('add_item', 'update_quantity') and _posted_quantity(request) is None:
             messages.error(request, 'Введите корректное число!')
-    
-    return redirect('menu')
\ No newline at end of file
+
+        elif action == 'add_item':
+            quantity = _posted_quantity(request)
+            dish = await aget_object_or_404(Dish, id=_posted_dish_id(request))
+            order_item, created = await OrderItem.objects.aget_or_create(
+                order=order, dish=dish, defaults={'quantity': quantity})
+            if not created:
+                # Прибавляем на стороне БД: параллельные добавления не теряются
+                await OrderItem.objects.filter(pk=order_item.pk).aupdate(quantity=F('quantity') + quantity)
+                await order_item.arefresh_from_db(fields=['quantity'])
+            await events.apublish('order', 'item_added', order.id, item_id=order_item.id,
+                                  dish_id=dish.id, quantity=order_item.quantity)
+            messages.success(request, f'{dish.name} заказ добавлен!')
+
+        elif action == 'update_quantity':
+            order_item_id = request.POST.get('order_item_id')
+            quantity = _posted_quantity(request)
+            try:
+                order_item = await OrderItem.objects.aget(id=order_item_id, order=order)
+            except OrderItem.DoesNotExist:
+                messages.error(request, 'Позиция не найдена')
+            else:
+                if quantity >= 1:
+                    order_item.quantity = quantity
+                    await order_item.asave(update_fields=['quantity'])
+                    await events.apublish('order', 'item_updated', order.id, item_id=order_item.id,
+                                          dish_id=order_item.dish_id, quantity=quantity)
+                else:
+                    await events.apublish('order', 'item_removed', order.id, item_id=order_item.id)
+                    await order_item.adelete()
+
+        elif action == 'remove_item':
+            order_item_id = request.POST.get('order_item_id')
+            deleted, _ = await OrderItem.objects.filter(id=order_item_id, order=order).adelete()
+            if deleted:
+                await events.apublish('order', 'item_removed', order.id, item_id=int(order_item_id))
+            messages.success(request, 'Блюдо удалено из заказа!')
+
+        elif action == 'complete_order':
+            _complete_order_messages(request, order, *await sync_to_async(order.complete)())
+            return redirect('orders')
+
+        if table_id:
+            return redirect('table_order', table_id=table_id)
+        return redirect('table_order_by_id', order_id=order.id)
+
+    order_items = [item async for item in order.order_items.select_related('dish')]
+    context = _table_order_context(order, table, order_items, await order.atotal_price())
+    return await _arender(request, 'table_order.html', context)
+
+
+@login_required
+async def add_portions_async(request, dish_id):
+    dish = await aget_object_or_404(Dish, id=dish_id)
+    if request.method == 'POST':
+        await sync_to_async(_add_portions)(request, dish)
+    return redirect('menu')
@@ -7,6 +7,9 @@ import sys
 def main():
     """Run administrative tasks."""
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Cafe.settings')
+    if sys.argv[1:2] == ['runserver']:
+        # PRAGMA SQLite (WAL и др.) — только для сервера, см. main/db.py
+        os.environ.setdefault('CAFE_SQLITE_TUNING', '1')
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
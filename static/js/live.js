@@ -0,0 +1,139 @@
+// Живые обновления вместо перезагрузки страниц: под ASGI — push-канал events/stream/ (SSE),
+// под WSGI — опрос ленты events/ (бесконечный поток занял бы поток сервера навсегда)
+(function () {
+    const streamUrl = document.body.dataset.eventsUrl;
+    const feedUrl = document.body.dataset.eventsFeedUrl;
+    const POLL_INTERVAL = 5000;
+    if (!streamUrl && !feedUrl) {
+        return;
+    }
+
+    function parse(e) {
+        try {
+            return JSON.parse(e.data);
+        } catch (err) {
+            return null;
+        }
+    }
+
+    // Уведомление "есть изменения" для страниц со списками
+    function notify(event) {
+        const notice = document.getElementById('live-notice');
+        if (!notice) {
+            return;
+        }
+        const kinds = (notice.dataset.liveKinds || '').split(',');
+        if (kinds.indexOf(event.kind) === -1) {
+            return;
+        }
+        const objectId = notice.dataset.liveObject;
+        if (objectId && String(event.object_id) !== objectId) {
+            return;
+        }
+        notice.style.display = 'block';
+    }
+
+    // План зала: суммы открытых заказов перечитываются из tables/state/ (ETag -> 304)
+    function refreshFloor() {
+        const floor = document.querySelector('[data-floor-url]');
+        if (!floor || !window.fetch) {
+            return;
+        }
+        fetch(floor.dataset.floorUrl, {credentials: 'same-origin'})
+            .then(function (response) {
+                return response.ok ? response.json() : null;
+            })
+            .then(function (state) {
+                if (!state) {
+                    return;
+                }
+                state.tables.forEach(function (table) {
+                    const line = floor.querySelector('[data-table-id="' + table.id + '"] .table-order');
+                    if (!line) {
+                        return;
+                    }
+                    line.textContent = table.order_id
+                        ? '#' + table.order_id + ' · ' + Number(table.total).toFixed(2) + " so'm · "
+                            + new Date(table.seated_since).toTimeString().slice(0, 5) + ' dan'
+                        : '';
+                });
+            })
+            .catch(function () {});
+    }
+
+    function onTable(event) {
+        const card = document.querySelector('[data-table-id="' + event.object_id + '"]');
+        if (card && 'is_occupied' in event.data) {
+            const occupied = event.data.is_occupied;
+            card.classList.toggle('occupied', occupied);
+            card.classList.toggle('free', !occupied);
+            card.style.background = occupied
+                ? 'linear-gradient(135deg, #e74c3c, #c0392b)'
+                : 'linear-gradient(135deg, #27ae60, #219a52)';
+            const status = card.querySelector('.table-status');
+            if (status) {
+                status.textContent = occupied ? '🟥 Band' : "🟩 Bo'sh";
+            }
+            refreshFloor();
+        }
+        notify(event);
+    }
+
+    function onDish(event) {
+        const badge = document.querySelector('[data-dish-portions="' + event.object_id + '"]');
+        if (badge && 'portions' in event.data) {
+            badge.textContent = event.data.portions + ' por.';
+            badge.style.background = event.data.portions > 0 ? 'var(--success)' : 'var(--danger)';
+        }
+        notify(event);
+    }
+
+    function onOrder(event) {
+        refreshFloor();
+        notify(event);
+    }
+
+    const handlers = {table: onTable, dish: onDish, order: onOrder};
+
+    if (streamUrl && window.EventSource) {
+        const source = new EventSource(streamUrl);
+        Object.keys(handlers).forEach(function (kind) {
+            source.addEventListener(kind, function (e) {
+                const event = parse(e);
+                if (event) {
+                    handlers[kind](event);
+                }
+            });
+        });
+        return;
+    }
+
+    if (!feedUrl || !window.fetch) {
+        return;
+    }
+    // Первый запрос без курсора возвращает текущий курсор, дальше — события после него
+    let cursor = null;
+    function poll() {
+        const url = cursor === null ? feedUrl : feedUrl + '?cursor=' + cursor;
+        fetch(url, {credentials: 'same-origin'})
+            .then(function (response) {
+                return response.ok ? response.json() : null;
+            })
+            .then(function (feed) {
+                if (!feed) {
+                    return;
+                }
+                cursor = feed.cursor;
+                feed.events.forEach(function (event) {
+                    if (handlers[event.kind]) {
+                        handlers[event.kind](event);
+                    }
+                });
+            })
+            .catch(function () {})
+            .then(function () {
+                setTimeout(poll, POLL_INTERVAL);
+            });
+    }
+    poll();
+})();